@@ -1,48 +1,66 @@
-from flask import Flask, render_template
-from flask_socketio import SocketIO, emit
+from flask import Flask, Response, render_template, jsonify, request
+from flask_socketio import SocketIO, emit, join_room, leave_room
 import random
 import time
 from threading import Thread, Lock
 import math
 from datetime import datetime, timezone
 import json
-from fhir_generators.generate_synthea_patient import generate_fallback_patient, generate_fhir_resources  # Import the function
+from fhir_generators.generate_synthea_patient import generate_fallback_patient, generate_fhir_resources, configure_patient_pool, start_prefetcher, synthea_metrics  # Import the function
 import uuid
 import logging
-from fhir_generators.generate_condition import generate_condition
-from fhir_generators.generate_encounter_ed_presentation import generate_encounter_ed_presentation
+from fhir_generators.generate_condition import (generate_condition, restamp_condition, generate_conditions_batch,
+                                                condition_batch_size, condition_batch_stats, configure_condition_batching)
+from fhir_generators.generate_encounter_ed_presentation import generate_encounter_ed_presentation, restamp_encounter
 from fhir_generators.generate_encounter_discharge import generate_encounter_discharge
-from concurrent.futures import ThreadPoolExecutor
+from fhir_generators.llm_cache import configure_llm_cache, get_llm_cache, MODES as LLM_CACHE_MODES
+from fhir_generators import llm_client, llm_metrics
+from fhir_generators.llm_router import load_router_config
+from fhir_generators.fhir_template import compile_template
+from fhir_generators.fhir_validator import FHIRValidator, ResourceRejected
 import functools
 from argparse import ArgumentParser
 import atexit  # Add this import
 from fhir_generators.generate_synthea_patient import generate_fallback_patient  # Import the function
 import os  # Add this if not already present
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('simulation.log'),
-        logging.StreamHandler()
-    ]
-)
+from simulation.emitter import BatchEmitter, LOG_CHANNELS, DEFAULT_ROOM, STATS_ROOM, log_room, state_room
+from simulation.attachments import AttachmentStore
+from simulation.session_store import SessionStore
+from simulation.sinks import KafkaSink, event_save_type
+from simulation.log_pipeline import configure_logging, parse_category_levels, lazy_json
+from simulation.warm_pool import WarmPool
+from simulation.llm_scheduler import LLMScheduler, PRIORITY_ENCOUNTER, PRIORITY_CONDITION, PRIORITY_BACKGROUND
+from simulation.work_queue import BoundedExecutor, OVERFLOW_DEGRADE, OVERFLOW_POLICIES
+from simulation.state_cache import Tracked, AppendOnlyFragments, JSONCodec, CODECS as STATE_CODECS
+
+# Logging is configured once, from the command line in __main__: records are queued and
+# written by a background thread (see simulation/log_pipeline.py)
+logger = logging.getLogger('ambosim')
 # Reduce noisy request logs from Werkzeug/Socket.IO long-polling
 logging.getLogger('werkzeug').setLevel(logging.WARNING)
 logging.getLogger('engineio').setLevel(logging.WARNING)
 logging.getLogger('socketio').setLevel(logging.WARNING)
 
 app = Flask(__name__)
+# Attached to app by init_socketio() in __main__, once --transport is known
 socketio = SocketIO(
-    app,
     logger=False,
     engineio_logger=False,
-    cors_allowed_origins="*",
-    allow_upgrades=False,
-    transports=['polling']
+    cors_allowed_origins="*"
 )
 
+def init_socketio(transport):
+    """Build the Socket.IO server for transport: 'polling', or 'websocket' (polling stays
+    available for clients that cannot open a WebSocket)."""
+    if transport == 'websocket':
+        try:
+            import simple_websocket  # noqa: F401  (used by engineio for the threading WebSocket transport)
+        except ImportError as e:
+            raise RuntimeError("--transport websocket requires simple-websocket (pip install simple-websocket)") from e
+        socketio.init_app(app, transports=['polling', 'websocket'], allow_upgrades=True)
+    else:
+        socketio.init_app(app, transports=['polling'], allow_upgrades=False)
+
 # Configurable variables
 GLOBAL_MAX_PATIENTS_PER_HOSPITAL = 2  # Maximum patients that can be treated simultaneously in each hospital
 WAITING_TIME = 2  # seconds (time step in seconds; controls speed of moving from waiting to treating)
@@ -54,14 +72,63 @@ USE_LLM = True  # Default value, will be updated by command line args
 OUTPUT_FHIR = False  # Default value, will be updated by command line args
 FHIR_OUTPUT_DIR = "fhir_export"  # Base directory for FHIR outputs
 SESSION_DIR = None  # Will be set at runtime if OUTPUT_FHIR is True
+SESSION_STORE_FILENAME = "session.sqlite"  # Default name of the indexed session store
 HOSPITAL_WAITING_CAPACITY = 6  # Maximum patients allowed in a hospital waiting room
 LOG_CAPACITY = 50  # Max events to retain in each UI log
+BROADCAST_RATE_HZ = 5  # How often batched log/state updates are flushed to clients (the page dead-reckons ambulances between frames)
+PHYSICS_RATE_HZ = 20  # Movement loop ticks per second, independent of the broadcast rate
+AMBULANCE_SPEED = 80  # Map units per second along each axis
+SOCKET_TRANSPORT = 'polling'  # Socket.IO transport for the browser: 'polling' or 'websocket'
+STATE_CODEC = JSONCodec()  # Encoding of state frames: JSON text, or MessagePack bytes with --state-encoding msgpack
+STATE_REGIONS = {}  # Map areas {name: (x0, y0, x1, y1)} clients can subscribe to (--state-region); empty derives them from the layout
+ATTACHMENT_CACHE_SIZE = 500  # Attachment payloads kept in memory for the JSON viewer
+LOG_FILE = 'simulation.log'  # Log file written by the background logging thread
+LOG_LEVEL = 'INFO'  # Default root log level (override per category with --log-category)
+WARM_POOL_SEVERITIES = ('Mild', 'Moderate', 'Severe')  # Buckets of pre-generated LLM conditions
+WARM_POOL_SEVERITY_WEIGHTS = (1, 1, 1)  # Intended severity mix of new patients (the fallback condition's is uniform too)
+WARM_POOL_LOW_WATERMARK = 2  # Refill a severity bucket when it drops below this many items
+WARM_POOL_HIGH_WATERMARK = 4  # ... up to this many items
+WARM_POOL_WORKERS = 1  # Background producer threads calling the LLM
+CONDITION_BATCH_MAX = 4  # Most conditions the warm pool asks for in one prompt (1 disables batching)
+CONDITION_BATCH_TARGET_SECONDS = 60  # Shrink the batch when a call takes longer than this
+LLM_CONCURRENCY = 2  # Concurrent LLM calls per model
+LLM_MAX_QUEUE = 50  # Queued LLM requests per model before new ones are rejected (fallback is used)
+LLM_REQUEST_TIMEOUT = 120  # Seconds an LLM request may wait and run before it is abandoned
+ENCOUNTER_WORKERS = 8  # Threads preparing ED presentations for patients entering treatment
+ENCOUNTER_QUEUE_LIMIT = 32  # Waiting ED presentations before the overflow policy applies
+ENCOUNTER_MAX_AGE = 30  # Seconds an ED presentation may wait before the fallback encounter is used instead
+DISCHARGE_WORKERS = 2  # Threads writing discharge encounters
+DISCHARGE_QUEUE_LIMIT = 64  # Waiting discharges before the overflow policy applies
+ENRICHMENT_WORKERS = 4  # Threads replacing provisional conditions with LLM conditions
+ENRICHMENT_QUEUE_LIMIT = 32  # Patients waiting for enrichment before the overflow policy applies
+ENRICHMENT_MAX_AGE = 30  # Seconds a patient may wait for enrichment before keeping the provisional condition
+DEMOGRAPHICS_BUFFER = 4  # Patients fetched ahead of the arrival clock (Synthea or fallback)
+PERSISTENCE_WORKERS = 2  # Threads writing FHIR resources to disk and event sinks
+PERSISTENCE_QUEUE_LIMIT = 500  # Pending writes before the overflow policy applies
+WORK_QUEUE_OVERFLOW = {'enrichment': 'degrade', 'encounter': 'degrade', 'discharge': 'degrade', 'persistence': 'block'}  # drop / block / degrade (fallback)
 RAMP_REDIRECT_ENABLED = True  # Whether to redirect to another hospital instead of ramping (default on)
 RAMP_REDIRECT_ENABLED = False  # Whether to redirect instead of ramping when waiting is full
 
+# Resources entering the simulation are checked and normalized once against fhir_templates/,
+# requiring what the simulator reads (see fhir_generators/fhir_validator.py)
+CONDITION_VALIDATOR = FHIRValidator('condition', required=(
+    'id', 'subject.reference', 'clinicalStatus.coding.display', 'code.coding.display', 'severity.coding.display'
+))
+ENCOUNTER_VALIDATOR = FHIRValidator('encounter', required=(
+    'id', 'subject.reference', 'type.coding.display', 'reasonCode.coding.display',
+    'diagnosis.condition.reference', 'procedure.display'
+), defaults={'status': 'unknown', 'period.start': lambda: datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")})
+
+def _first_coding(resource, key):
+    """First coding of a normalized resource's CodeableConcept (or first of a list of them)."""
+    concept = resource.get(key)
+    if isinstance(concept, list):
+        concept = concept[0]
+    return concept['coding'][0] if concept and 'coding' in concept else {}
+
 class Condition:
     def __init__(self, id, clinical_status, verification_status, severity, category, 
-                 code, subject_reference, onset_datetime, recorded_date, note=None):
+                 code, subject_reference, onset_datetime, recorded_date, note=None, fhir=None):
         self.id = id
         self.clinical_status = clinical_status
         self.verification_status = verification_status
@@ -72,43 +139,34 @@ class Condition:
         self.onset_datetime = onset_datetime
         self.recorded_date = recorded_date
         self.note = note
+        self.fhir = fhir  # The normalized FHIR resource this was created from, if any
+        self.export_path = None  # Set when the Condition resource is written to the session export
 
     @classmethod
     def from_fhir(cls, fhir_condition):
-        """Create a Condition object from a FHIR Condition resource"""
-        # If upstream generator returned nothing or invalid shape, gracefully bail
-        if not isinstance(fhir_condition, dict):
-            logging.warning("Condition.from_fhir received invalid/None payload; returning None")
-            return None
+        """Create a Condition object from a FHIR Condition resource, normalized in place
+        (see CONDITION_VALIDATOR); None if it is not a Condition."""
         try:
-            logging.debug(f"Creating Condition from FHIR resource: {json.dumps(fhir_condition, indent=2)}")
-            
-            # Safely extract note text
-            notes = fhir_condition.get('note', [])
-            note_text = notes[0].get('text') if notes else None
-            logging.debug(f"Extracted note text: {note_text}")
-            
-            # Create condition object
-            condition = cls(
-                id=fhir_condition.get('id'),
-                clinical_status=fhir_condition.get('clinicalStatus', {}).get('coding', [{}])[0],
-                verification_status=fhir_condition.get('verificationStatus', {}).get('coding', [{}])[0],
-                severity=fhir_condition.get('severity', {}).get('coding', [{}])[0],
-                category=fhir_condition.get('category', [{}])[0].get('coding', [{}])[0],
-                code=fhir_condition.get('code', {}).get('coding', [{}])[0],
-                subject_reference=fhir_condition.get('subject', {}).get('reference'),
-                onset_datetime=fhir_condition.get('onsetDateTime'),
-                recorded_date=fhir_condition.get('recordedDate'),
-                note=note_text
-            )
-            logging.debug(f"Successfully created Condition object with ID: {condition.id}")
-            return condition
-            
-        except Exception as e:
-            logging.error(f"Error creating Condition from FHIR: {str(e)}")
-            logging.error(f"FHIR condition data: {json.dumps(fhir_condition, indent=2)}")
-            logging.error(f"Traceback:", exc_info=True)
+            fhir_condition, errors = CONDITION_VALIDATOR.validate(fhir_condition)
+        except ResourceRejected as e:
+            logger.warning("Condition.from_fhir rejected the resource: %s", e)
             return None
+        if errors:
+            logger.warning("Normalized Condition %s: %s", fhir_condition.get('id'), '; '.join(errors))
+        notes = fhir_condition.get('note')
+        return cls(
+            id=fhir_condition.get('id'),
+            clinical_status=_first_coding(fhir_condition, 'clinicalStatus'),
+            verification_status=_first_coding(fhir_condition, 'verificationStatus'),
+            severity=_first_coding(fhir_condition, 'severity'),
+            category=_first_coding(fhir_condition, 'category'),
+            code=_first_coding(fhir_condition, 'code'),
+            subject_reference=fhir_condition.get('subject', {}).get('reference'),
+            onset_datetime=fhir_condition.get('onsetDateTime'),
+            recorded_date=fhir_condition.get('recordedDate'),
+            note=notes[0].get('text') if notes else None,
+            fhir=fhir_condition
+        )
 
     def to_dict(self):
         """Convert Condition object to dictionary for JSON serialization"""
@@ -125,7 +183,9 @@ class Condition:
             'note': self.note
         }
 
-class Patient:
+class Patient(Tracked):
+    state_fields = frozenset({'name', 'condition'})  # Serialized once per change; wait_time per frame
+
     def __init__(self, id, name, condition, condition_severity=None, dob=None, condition_note=None, fhir_resources=None):
         self.id = id
         self.name = name
@@ -137,8 +197,13 @@ class Patient:
         self.fhir_resources = fhir_resources or {}
         self.encounters = []  # Add list to store encounters
         self.latest_encounter_id = None  # Track latest ED presentation encounter id
+        self.encounter_template = None  # Pre-generated ED presentation from the warm pool, bound at treatment start
+        self.condition_locked = False  # Set once the condition is final (enriched, or treatment started)
+        self.condition_lock = Lock()  # Guards checking condition_locked together with swapping the condition
+
+class Ambulance(Tracked):
+    state_fields = frozenset({'x', 'y', 'target', 'state', 'patient', 'queue_hospital_id'})
 
-class Ambulance:
     def __init__(self, id, x, y):
         self.id = id
         self.x = x
@@ -152,17 +217,27 @@ class Ambulance:
         self.redirect_attempted = False  # Track if we've already tried redirecting once for current patient
         self.last_arrived_hospital_id = None  # Prevent duplicate arrival logs while stationary at hospital
 
-    def move_to(self, target_x, target_y):
+    def move_to(self, target_x, target_y, step):
+        """Move up to step along each axis toward the target, stopping on it."""
         if self.x < target_x:
-            self.x += 4  # Move twice as fast
+            self.x = min(target_x, self.x + step)
         elif self.x > target_x:
-            self.x -= 4  # Move twice as fast
+            self.x = max(target_x, self.x - step)
         if self.y < target_y:
-            self.y += 4  # Move twice as fast
+            self.y = min(target_y, self.y + step)
         elif self.y > target_y:
-            self.y -= 4  # Move twice as fast
+            self.y = max(target_y, self.y - step)
+
+    def velocity(self):
+        """(vx, vy) in map units per second while heading for the target, as move_to advances it."""
+        if not self.target:
+            return 0, 0
+        target_x, target_y = self.target
+        return ((target_x > self.x) - (target_x < self.x)) * AMBULANCE_SPEED, ((target_y > self.y) - (target_y < self.y)) * AMBULANCE_SPEED
+
+class House(Tracked):
+    state_fields = frozenset({'x', 'y', 'patient_ids', 'ambulance_on_the_way'})
 
-class House:
     def __init__(self, id, x, y):
         self.id = id
         self.x = x
@@ -172,11 +247,15 @@ class House:
 
     def add_patient(self, patient_id):
         self.patient_ids.append(patient_id)
+        self.touch()
 
     def remove_patient(self, patient_id):
         self.patient_ids.remove(patient_id)
+        self.touch()
+
+class Hospital(Tracked):
+    state_fields = frozenset({'x', 'y'})
 
-class Hospital:
     def __init__(self, id, x, y):
         self.id = id
         self.x = x
@@ -184,6 +263,7 @@ class Hospital:
         self.waiting = []  # Queue for waiting patients
         self.treating = []  # Queue for treating patients
         self.discharged = []  # Queue for discharged patients
+        self.discharged_fragments = AppendOnlyFragments()  # State JSON of the discharged queue, which only grows
 
     def add_patient_to_waiting(self, patient):
         self.waiting.append(patient)
@@ -276,96 +356,122 @@ patient_event_log = []
 ambulance_event_log = []
 hospital_event_log = []
 
+# Attachment bodies are fetched on demand by the UI rather than sent with every log
+attachment_store = AttachmentStore(capacity=ATTACHMENT_CACHE_SIZE)
+
+# All Socket.IO broadcasts go through the emitter, which flushes once per broadcast tick
+emitter = BatchEmitter(
+    emit_fn=lambda event, data, room: socketio.emit(event, data, to=room),
+    state_fn=lambda view: get_state(view),
+    rate_hz=BROADCAST_RATE_HZ,
+    log_capacity=LOG_CAPACITY
+)
+
 def log_event(message, event_type='general', attachments=None):
     timestamp = datetime.now().strftime('%H:%M:%S')
     log_message = f"{timestamp} - {message}"
+
+    # Queue event attachments for persistence first so the export path can back the cached payload
+    persist_event_attachments(attachments, category=event_type, message=log_message)
+
     event_obj = {'text': log_message}
     if attachments:
-        # Keep attachments small if needed in the future; for now pass through
-        event_obj['attachments'] = attachments
+        # Clients only receive ids and labels; the JSON body is served by /attachments/<id>
+        event_obj['attachments'] = [attachment_ref(att) for att in attachments if isinstance(att, dict)]
     
     if event_type == 'patient':
         patient_event_log.insert(0, event_obj)
         if len(patient_event_log) > LOG_CAPACITY:
             patient_event_log.pop()
-        socketio.emit('update_patient_log', patient_event_log)
+        emitter.add_log('patient', event_obj)
     elif event_type == 'ambulance':
         ambulance_event_log.insert(0, event_obj)
         if len(ambulance_event_log) > LOG_CAPACITY:
             ambulance_event_log.pop()
-        socketio.emit('update_ambulance_log', ambulance_event_log)
+        emitter.add_log('ambulance', event_obj)
     elif event_type == 'hospital':
         hospital_event_log.insert(0, event_obj)
         if len(hospital_event_log) > LOG_CAPACITY:
             hospital_event_log.pop()
-        socketio.emit('update_hospital_log', hospital_event_log)
+        emitter.add_log('hospital', event_obj)
     else:
         # General log or other types can be handled here
         pass
 
-    # Persist event attachments that include JSON payloads with an 'eventType'
+def attachment_ref(att):
+    """Cache an attachment payload and return the {'id', 'label'} reference sent to clients."""
+    label = att.get('label') or 'JSON'
+    payload = att.get('json')
+    if payload is None:
+        return {'label': label}
+    return attachment_store.put(label, payload, path=att.get('preview'))
+
+def persist_event_attachments(attachments, category=None, message=None):
+    """Queue attachments that include JSON payloads with an 'eventType' for persistence;
+    each one gets the path its exported file will have as its 'preview'."""
     try:
-        if OUTPUT_FHIR and SESSION_DIR and attachments:
+        if persistence_enabled() and attachments:
             for att in attachments:
                 try:
                     payload = att.get('json') if isinstance(att, dict) else None
                 except Exception:
                     payload = None
                 if isinstance(payload, dict) and payload.get('eventType'):
-                    saved_path = save_event_payload(payload)
+                    saved_path = save_event_payload(payload, category=category, message=message)
                     if saved_path and isinstance(att, dict):
                         try:
                             att['preview'] = saved_path.replace('\\', '/')
                         except Exception:
                             pass
     except Exception as e:
-        logging.error(f"Error saving event attachment JSON: {str(e)}")
+        logger.error("Error saving event attachment JSON: %s", e)
 
-def save_event_payload(payload):
-    """Persist minimal event payloads (with 'eventType') to the session directory.
+def save_event_payload(payload, category=None, message=None):
+    """Queue an event payload (with 'eventType') for the event sinks and, if OUTPUT_FHIR is enabled,
+    a JSON file in the session directory. Returns the file path it will be written to, or None.
     Directory layout: <SESSION_DIR>/event/<eventType>/event_<timestamp>.json
     If a patient reference exists, include it in the filename for easier tracing.
     """
-    if not OUTPUT_FHIR or SESSION_DIR is None:
-        return
+    filepath = None
     try:
-        event_type = str(payload.get('eventType', 'event')).lower()
-        # Rename certain event types only for persistence
-        if event_type == 'location':
-            save_type = 'hospital_location'
-        elif event_type == 'redirect':
-            save_type = 'ambulance_redirect'
-        else:
-            save_type = event_type
-        event_dir = os.path.join(SESSION_DIR, 'event', save_type)
-        os.makedirs(event_dir, exist_ok=True)
-
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-        # Try to extract a meaningful id from the payload
-        patient_ref = None
-        try:
-            patient = payload.get('patient') if isinstance(payload, dict) else None
+        if OUTPUT_FHIR and SESSION_DIR is not None:
+            # Rename certain event types only for persistence (shared with sink topic names)
+            save_type = event_save_type(payload.get('eventType', 'event'))
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+            # Try to extract a meaningful id from the payload
+            patient_ref = None
+            patient = payload.get('patient')
             if isinstance(patient, dict):
                 ref = patient.get('reference')
                 if isinstance(ref, str) and '/' in ref:
                     patient_ref = ref.split('/')[-1]
-        except Exception:
-            patient_ref = None
 
-        filename_bits = ["event", save_type]
-        if patient_ref:
-            filename_bits.append(patient_ref)
-        filename_bits.append(timestamp)
-        filename = "_".join(filename_bits) + ".json"
+            filename_bits = ["event", save_type]
+            if patient_ref:
+                filename_bits.append(patient_ref)
+            filename_bits.append(timestamp)
+            filepath = os.path.join(SESSION_DIR, 'event', save_type, "_".join(filename_bits) + ".json")
+        data = json.dumps(payload, indent=2)
+    except Exception as e:
+        logger.error("Error saving event payload: %s", e)
+        return None
+    if not persistence_executor.submit(write_event_payload, data, filepath, category, message):
+        return None
+    return filepath
 
-        filepath = os.path.join(event_dir, filename)
+def write_event_payload(data, filepath, category=None, message=None):
+    """Persistence executor task: publish a serialized event payload to the sinks and write its file."""
+    if event_sinks:
+        index_event(json.loads(data), category=category, message=message)
+    if filepath is None:
+        return
+    try:
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
         with open(filepath, 'w') as f:
-            json.dump(payload, f, indent=2)
-        logging.debug(f"Saved event payload to {filepath}")
-        return filepath
+            f.write(data)
+        logger.debug("Saved event payload to %s", filepath)
     except Exception as e:
-        logging.error(f"Error saving event payload: {str(e)}")
-        return None
+        logger.error("Error saving event payload: %s", e)
 
 def build_ambulance_event_attachment(event_kind, ambulance=None, patient=None, hospital_id=None, extra=None):
     """Create a minimal JSON payload for ambulance-related events."""
@@ -471,162 +577,126 @@ def build_redirect_attachment(ambulance, patient, from_hospital_id, to_hospital_
 
 patients = []  # Global list to store all Patient objects
 
-def generate_fallback_condition(patient_id):
-    """Generate a basic condition without using LLM."""
+# Compiled fhir_templates/ resources for the fallback paths: filling them skips rebuilding the
+# nested literals (and, with render(), re-serializing the constant parts) for every patient
+CONDITION_TEMPLATE = compile_template('condition')
+ENCOUNTER_TEMPLATE = compile_template('encounter')
+
+# Sample conditions, severities and procedures for the fallback generators
+FALLBACK_CONDITIONS = [
+    {'code': '427623005', 'display': 'Chest Pain'},
+    {'code': '422400008', 'display': 'Vomiting'},
+    {'code': '39848009', 'display': 'Wheezing'},
+    {'code': '62315008', 'display': 'Dizziness'},
+    {'code': '25064002', 'display': 'Headache'}
+]
+FALLBACK_SEVERITIES = [
+    {'code': '24484000', 'display': 'Severe'},
+    {'code': '6736007', 'display': 'Moderate'},
+    {'code': '255604002', 'display': 'Mild'}
+]
+FALLBACK_PROCEDURES = [
+    "Vital signs measurement",
+    "Physical examination",
+    "Blood test",
+    "X-ray examination",
+    "ECG monitoring"
+]
+
+def generate_fallback_condition(patient_id, persist=True):
+    """Generate a basic condition without using LLM.
+
+    persist=False skips saving it, for provisional conditions that may still be replaced.
+    """
     current_time = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
-    
-    # List of sample conditions
-    conditions = [
-        {
-            'code': '427623005',
-            'display': 'Chest Pain'
-        },
-        {
-            'code': '422400008',
-            'display': 'Vomiting'
-        },
-        {
-            'code': '39848009',
-            'display': 'Wheezing'
-        },
-        {
-            'code': '62315008',
-            'display': 'Dizziness'
-        },
-        {
-            'code': '25064002',
-            'display': 'Headache'
-        }
-    ]
-    
-    # List of sample severities
-    severities = [
-        {
-            'code': '24484000',
-            'display': 'Severe'
-        },
-        {
-            'code': '6736007',
-            'display': 'Moderate'
-        },
-        {
-            'code': '255604002',
-            'display': 'Mild'
-        }
-    ]
-    
-    chosen_condition = random.choice(conditions)
-    chosen_severity = random.choice(severities)
-    
-    condition = Condition(
-        id=str(uuid.uuid4()),
-        clinical_status={
-            "system": "http://terminology.hl7.org/CodeSystem/condition-clinical",
-            "code": "active",
-            "display": "Active"
-        },
-        verification_status={
-            "system": "http://terminology.hl7.org/CodeSystem/condition-ver-status",
-            "code": "confirmed",
-            "display": "Confirmed"
-        },
-        severity=chosen_severity,
-        category={
-            "system": "http://terminology.hl7.org/CodeSystem/condition-category",
-            "code": "encounter-diagnosis",
-            "display": "Encounter Diagnosis"
-        },
-        code=chosen_condition,
-        subject_reference=f"Patient/{patient_id}",
-        onset_datetime=current_time,
-        recorded_date=current_time,
-        note=f"Patient presents with {chosen_condition['display']}"
-    )
+    chosen_condition = random.choice(FALLBACK_CONDITIONS)
+    chosen_severity = random.choice(FALLBACK_SEVERITIES)
+    slots = {
+        'condition_id': str(uuid.uuid4()),
+        'clinical_status_code': 'active',
+        'clinical_status_display': 'Active',
+        'verification_status_code': 'confirmed',
+        'verification_status_display': 'Confirmed',
+        'category_code': 'encounter-diagnosis',
+        'category_display': 'Encounter Diagnosis',
+        'severity_code': chosen_severity['code'],
+        'severity_display': chosen_severity['display'],
+        'condition_code': chosen_condition['code'],
+        'condition_display': chosen_condition['display'],
+        'patient_id': patient_id,
+        'onset_date': current_time,
+        'recorded_date': current_time,
+        'note_text': f"Patient presents with {chosen_condition['display']}"
+    }
+    condition = Condition.from_fhir(CONDITION_TEMPLATE.fill(slots))
 
-    # Add this block to save the condition to file
-    if OUTPUT_FHIR and SESSION_DIR:
+    if persist and persistence_enabled():
         try:
-            # Convert condition to FHIR format dictionary
-            condition_fhir = {
-                "resourceType": "Condition",
-                "id": condition.id,
-                "clinicalStatus": {
-                    "coding": [condition.clinical_status]
-                },
-                "verificationStatus": {
-                    "coding": [condition.verification_status]
-                },
-                "severity": {
-                    "coding": [condition.severity]
-                },
-                "category": [{
-                    "coding": [condition.category]
-                }],
-                "code": {
-                    "coding": [condition.code]
-                },
-                "subject": {
-                    "reference": condition.subject_reference
-                },
-                "onsetDateTime": condition.onset_datetime,
-                "recordedDate": condition.recorded_date,
-                "note": [{"text": condition.note}]
-            }
-            save_fhir_resource('condition', condition_fhir)
-            logging.info(f"Saved condition FHIR resource for condition {condition.id}")
+            condition.export_path = save_fhir_resource(
+                'condition', {'id': condition.id}, data=CONDITION_TEMPLATE.render(slots, indent=2))
+            logger.info("Saved condition FHIR resource for condition %s", condition.id)
         except Exception as e:
-            logging.error(f"Error saving condition FHIR resource: {str(e)}")
+            logger.error("Error saving condition FHIR resource: %s", e)
     
     return condition
 
+def condition_slots(condition_obj):
+    """CONDITION_TEMPLATE slots for a Condition object."""
+    clinical_status = condition_obj.clinical_status or {}
+    verification_status = condition_obj.verification_status or {}
+    category = condition_obj.category or {}
+    severity = condition_obj.severity or {}
+    code = condition_obj.code or {}
+    subject = condition_obj.subject_reference
+    return {
+        'condition_id': condition_obj.id,
+        'clinical_status_code': clinical_status.get('code'),
+        'clinical_status_display': clinical_status.get('display'),
+        'verification_status_code': verification_status.get('code'),
+        'verification_status_display': verification_status.get('display'),
+        'category_code': category.get('code'),
+        'category_display': category.get('display'),
+        'severity_code': severity.get('code'),
+        'severity_display': severity.get('display'),
+        'condition_code': code.get('code'),
+        'condition_display': code.get('display'),
+        'patient_id': subject[len('Patient/'):] if subject and subject.startswith('Patient/') else subject,
+        'onset_date': condition_obj.onset_datetime,
+        'recorded_date': condition_obj.recorded_date,
+        'note_text': condition_obj.note or None
+    }
+
 def condition_to_fhir_dict(condition_obj):
-    """Convert a Condition object back to a FHIR Condition resource dict."""
+    """The FHIR Condition resource of a Condition object: the normalized one it was created
+    from, or one filled from its fields."""
     if condition_obj is None:
         return None
+    if condition_obj.fhir is not None:
+        return condition_obj.fhir
     try:
-        return {
-            "resourceType": "Condition",
-            "id": condition_obj.id,
-            "clinicalStatus": {"coding": [condition_obj.clinical_status]},
-            "verificationStatus": {"coding": [condition_obj.verification_status]},
-            "severity": {"coding": [condition_obj.severity]},
-            "category": [{"coding": [condition_obj.category]}],
-            "code": {"coding": [condition_obj.code]},
-            "subject": {"reference": condition_obj.subject_reference},
-            "onsetDateTime": condition_obj.onset_datetime,
-            "recordedDate": condition_obj.recorded_date,
-            "note": ([{"text": condition_obj.note}] if condition_obj.note else [])
-        }
+        return CONDITION_TEMPLATE.fill(condition_slots(condition_obj))
     except Exception:
         return None
 
 def generate_fallback_encounter(patient_id, condition_id, hospital_id):
     """Generate a basic encounter without using LLM."""
     current_time = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
-    
-    # Sample procedures based on condition
-    procedures = [
-        "Vital signs measurement",
-        "Physical examination",
-        "Blood test",
-        "X-ray examination",
-        "ECG monitoring"
-    ]
-    
-    encounter = {
-        'id': str(uuid.uuid4()),
-        'status': 'finished',
-        'type': [{'coding': [{'display': 'Emergency visit'}]}],
-        'priority': {'coding': [{'display': 'Urgent'}]},
-        'subject': {'reference': f'Patient/{patient_id}'},
-        'serviceType': {'coding': [{'display': 'Emergency Medicine'}]},
-        'period': {'start': current_time},
-        'diagnosis': [{'condition': {'display': 'Acute condition'}}],
-        'reasonCode': [{'coding': [{'display': 'Emergency presentation'}]}],
-        'procedure': [{'display': random.choice(procedures)}]
-    }
-    
-    return encounter
+    return ENCOUNTER_TEMPLATE.fill(
+        encounter_id=str(uuid.uuid4()),
+        encounter_status='finished',
+        encounter_class_code='EMER',
+        encounter_class_display='emergency',
+        encounter_type_display='Emergency visit',
+        service_type_display='Emergency Medicine',
+        priority_display='Urgent',
+        patient_id=patient_id,
+        encounter_start_date=current_time,
+        reason_display='Emergency presentation',
+        condition_id=condition_id,
+        condition_display='Acute condition',
+        diagnosis_rank=1,
+        procedure_display=random.choice(FALLBACK_PROCEDURES)
+    )
 
 def generate_discharge_for_patient(hospital, patient):
     """Process discharge for a single patient"""
@@ -645,12 +715,13 @@ def generate_discharge_for_patient(hospital, patient):
             patient.encounters.append(discharge)
             
             # Save the discharge encounter to file if OUTPUT_FHIR is enabled
-            if OUTPUT_FHIR and SESSION_DIR:
+            discharge_path = None
+            if persistence_enabled():
                 try:
-                    save_fhir_resource('encounter_discharge', discharge)
-                    logging.info(f"Saved discharge encounter FHIR resource for encounter {discharge['id']}")
+                    discharge_path = save_fhir_resource('encounter_discharge', discharge, patient_ref=patient.id)
+                    logger.info("Saved discharge encounter FHIR resource for encounter %s", discharge['id'])
                 except Exception as e:
-                    logging.error(f"Error saving discharge encounter FHIR resource: {str(e)}")
+                    logger.error("Error saving discharge encounter FHIR resource: %s", e)
             
             # Add discharge event logging with JSON attachment
             discharge_summary = (
@@ -662,136 +733,172 @@ def generate_discharge_for_patient(hospital, patient):
                 log_event(
                     discharge_summary,
                     event_type='hospital',
-                    attachments=[{'label': 'Discharge', 'json': validate_encounter_data(discharge)}]
+                    attachments=[{'label': 'Discharge', 'json': discharge, 'preview': discharge_path}]
                 )
             except Exception:
                 log_event(discharge_summary, event_type='hospital')
     except Exception as e:
-        logging.error(f"Error generating discharge: {str(e)}")
+        logger.error("Error generating discharge: %s", e)
         log_event(f"Error processing discharge for {patient.name}", event_type='hospital')
 
-# Add thread pool for parallel patient generation
-patient_generator_pool = ThreadPoolExecutor(max_workers=8)
-
-def safe_submit(executor, fn, *args, **kwargs):
-    """Submit to ThreadPoolExecutor, ignoring submissions after shutdown.
-    Returns a Future or None if submission is not possible.
-    """
+# Bounded executors per workload: a slow LLM degrades new encounters to the fallback instead of
+# queueing minutes of stale work (see simulation/work_queue.py)
+encounter_executor = BoundedExecutor(
+    'encounter', workers=ENCOUNTER_WORKERS, max_queue=ENCOUNTER_QUEUE_LIMIT, overflow=WORK_QUEUE_OVERFLOW['encounter'],
+    fallback=lambda hospital, patient: process_patient_encounter(hospital, patient, use_llm=False), max_age=ENCOUNTER_MAX_AGE)
+# Discharges never call the LLM; when their queue is full they run on the hospital queue thread
+discharge_executor = BoundedExecutor(
+    'discharge', workers=DISCHARGE_WORKERS, max_queue=DISCHARGE_QUEUE_LIMIT, overflow=WORK_QUEUE_OVERFLOW['discharge'],
+    fallback=lambda hospital, patient: generate_discharge_for_patient(hospital, patient))
+persistence_executor = BoundedExecutor(
+    'persistence', workers=PERSISTENCE_WORKERS, max_queue=PERSISTENCE_QUEUE_LIMIT, overflow=WORK_QUEUE_OVERFLOW['persistence'])
+# Patient creation stages: demographics (buffered ahead of the arrival clock) -> registration (on the
+# clock, provisional condition) -> enrichment (LLM condition, updated in place) -> persistence
+demographics_pool = WarmPool('demographics', lambda bucket: fetch_demographics(SESSION_DIR), ('patient',),
+                             low_watermark=max(1, DEMOGRAPHICS_BUFFER // 2), high_watermark=DEMOGRAPHICS_BUFFER)
+enrichment_executor = BoundedExecutor(
+    'enrichment', workers=ENRICHMENT_WORKERS, max_queue=ENRICHMENT_QUEUE_LIMIT, overflow=WORK_QUEUE_OVERFLOW['enrichment'],
+    fallback=lambda patient, llm_model=None: finalize_patient(patient), max_age=ENRICHMENT_MAX_AGE)
+work_queues = {e.name: e for e in (enrichment_executor, encounter_executor, discharge_executor, persistence_executor)}
+
+def work_queue_stats():
+    return {name: executor.stats() for name, executor in work_queues.items()}
+
+def fetch_demographics(session_dir=None):
+    """Demographic source stage: a buffered Synthea patient, or the fallback patient."""
+    patient_data = generate_fhir_resources(session_dir)
+    if not patient_data or 'error' in patient_data:
+        logger.info("Using fallback patient generation")
+        patient_data = generate_fallback_patient(session_dir)
+    return patient_data
+
+def register_patient(house, patient_data):
+    """Registration stage: place the patient at house now, with a provisional fallback condition
+    that the enrichment stage replaces in place."""
     try:
-        return executor.submit(fn, *args, **kwargs)
-    except RuntimeError as e:
-        # Happens when executor is shutting down; log at debug to avoid noise
-        logging.debug(f"Skipped task submission during shutdown: {e}")
-        return None
-
-def create_patient(house, session_dir=None, llm_model=None):
-    """Create a patient with either Synthea API or fallback, for both manual and automatic generation."""
-    try:
-        # Try Synthea API first if available
-        logging.info("Attempting to generate patient using Synthea API...")
-        patient_data = generate_fhir_resources(session_dir)
-        
-        if not patient_data or 'error' in patient_data:
-            logging.info("Using fallback patient generation")
-            patient_data = generate_fallback_patient(session_dir)
-            
         patient_resource = patient_data.get('patient', {})
-        
-        # Generate condition using either API data or basic condition
-        if USE_LLM:
-            logging.info(f"Generating condition using LLM model: {llm_model or DEFAULT_LLM_MODEL}")
-            request_counter.increment_started()
-            try:
-                condition_dict = generate_condition(
-                    patient_id=patient_resource['id'],
-                    llm_model=llm_model or DEFAULT_LLM_MODEL
-                )
-                request_counter.increment_completed()
-                logging.info(f"Successfully generated condition: {json.dumps(condition_dict, indent=2)}")
-                
-                # Save the LLM-generated condition FHIR resource
-                if OUTPUT_FHIR and condition_dict:
-                    save_fhir_resource('condition', condition_dict)
-                    logging.info(f"Saved LLM-generated condition FHIR resource")
-                
-                # Convert dictionary to Condition object
-                condition = Condition.from_fhir(condition_dict)
-                logging.info("Successfully converted condition dict to object")
-                
-            except Exception as e:
-                logging.error(f"Error in LLM condition generation: {str(e)}", exc_info=True)
-                logging.info("Falling back to basic condition")
-                condition = None
-        
-        if not USE_LLM or condition is None:
-            # Use richer fallback generator that picks realistic codes and severities
-            condition = generate_fallback_condition(patient_resource['id'])
-            logging.info("Created fallback condition (varied) using generate_fallback_condition")
-        
-        # Create the patient object
-        try:
-            patient = Patient(
-                id=patient_resource['id'],
-                name=patient_resource['name'][0]['given'][0],
-                condition=condition,
-                dob=patient_resource.get('birthDate', 'Unknown'),
-                condition_note=condition.note if condition else None,
-                fhir_resources=patient_data
-            )
-            logging.info(f"Successfully created patient: {patient.id}")
-        except Exception as e:
-            logging.error(f"Error creating Patient object: {str(e)}", exc_info=True)
-            logging.error(f"Patient resource: {json.dumps(patient_resource, indent=2)}")
-            logging.error(f"Condition object: {vars(condition) if condition else None}")
-            raise
-        
-        # Add patient to simulation
+        condition = generate_fallback_condition(patient_resource['id'], persist=False)
+        patient = Patient(
+            id=patient_resource['id'],
+            name=patient_resource['name'][0]['given'][0],
+            condition=condition,
+            dob=patient_resource.get('birthDate', 'Unknown'),
+            condition_note=condition.note,
+            fhir_resources=patient_data
+        )
         patients.append(patient)
         house.add_patient(patient.id)
-        
-        # Log patient creation with request counter stats
-        counts = request_counter.get_counts()
-        log_parts = [
-            f"Patient Generated:",
-            f"ID: {patient.id}",
-            f"Name: {patient.name}",
-            f"DOB: {patient.dob}",
-            f"Condition: {condition.code.get('display', 'Unknown')}",
-            f"Severity: {condition.severity.get('display', 'Unknown')}",
-            f"Clinical Status: {condition.clinical_status.get('display', 'Unknown')}",
-            f"LLM Requests: {counts['started']}",
-            f"Completed: {counts['completed']}"
-        ]
-        
-        if condition.note:
-            log_parts.append(f"Notes: {condition.note}")
-
-        # Attach FHIR JSON for patient and condition
-        attachments = []
-        try:
-            if isinstance(patient_resource, dict) and patient_resource:
-                attachments.append({'label': 'Patient', 'json': patient_resource})
-        except Exception:
-            pass
-        try:
-            condition_fhir = condition_to_fhir_dict(condition) if isinstance(condition, Condition) else None
-            if not condition_fhir and 'condition_dict' in locals():
-                condition_fhir = condition_dict
-            if condition_fhir:
-                attachments.append({'label': 'Condition', 'json': condition_fhir})
-        except Exception:
-            pass
-
-        log_event(" | ".join(log_parts), event_type='patient', attachments=attachments)
+        logger.info("Registered patient %s at house %s", patient.id, house.id)
         return patient
-        
     except Exception as e:
-        logging.error(f"Error creating patient: {str(e)}", exc_info=True)
+        logger.error("Error registering patient: %s", e, exc_info=True)
+        logger.error("Patient resource: %s", lazy_json(patient_data.get('patient') if patient_data else None, indent=2))
         return None
 
+def generate_llm_condition(patient_id, llm_model=None, cancel_if=None):
+    """LLM Condition for a patient, from the warm pool or a scheduled call.
+    Returns (Condition, pre-generated ED presentation or None), or (None, None) on failure.
+    """
+    encounter_template = None
+    try:
+        if warm_pool is not None:
+            # Take a pre-generated condition; never wait for the LLM when the pool has one
+            item = warm_pool.take()
+            condition_dict = restamp_condition(item['condition'], patient_id) if item else None
+            encounter_template = item.get('encounter') if item else None
+            if item is None:
+                logger.info("Warm pool bucket empty; using fallback condition")
+        else:
+            logger.info("Generating condition using LLM model: %s", llm_model or DEFAULT_LLM_MODEL)
+            condition_dict = llm_scheduler.call(
+                llm_model or DEFAULT_LLM_MODEL, generate_condition,
+                patient_id=patient_id,
+                llm_model=llm_model or DEFAULT_LLM_MODEL,
+                priority=PRIORITY_CONDITION,
+                cancel_if=cancel_if
+            )
+            logger.info("Successfully generated condition for patient %s", patient_id)
+        logger.debug("Generated condition: %s", lazy_json(condition_dict, indent=2))
+
+        # Convert dictionary to Condition object
+        condition = Condition.from_fhir(condition_dict) if condition_dict else None
+        if condition is not None:
+            condition.export_path = None
+            logger.info("Successfully converted condition dict to object")
+        return condition, (encounter_template if condition is not None else None)
+    except Exception as e:
+        logger.error("Error in LLM condition generation: %s", e, exc_info=True)
+        logger.info("Falling back to basic condition")
+        return None, None
+
+def enrich_patient(patient, llm_model=None):
+    """Clinical enrichment stage: swap in an LLM condition unless treatment has already started."""
+    condition, encounter_template = None, None
+    if USE_LLM and not patient.condition_locked:
+        condition, encounter_template = generate_llm_condition(patient.id, llm_model, cancel_if=lambda: patient.condition_locked)
+        llm_metrics.record_result(llm_model or DEFAULT_LLM_MODEL, 'condition', fallback=condition is None)
+    finalize_patient(patient, condition, encounter_template)
+
+def finalize_patient(patient, condition=None, encounter_template=None):
+    """Settle the patient's condition (the enriched one, else the provisional fallback), then queue
+    its persistence and log it. Also the enrichment queue's overflow fallback."""
+    if patient not in patients:
+        return  # Removed by a reset while being enriched
+    with patient.condition_lock:
+        # Treatment may start on another thread; it locks the condition under the same lock
+        if condition is not None and not patient.condition_locked:
+            patient.condition = condition
+            patient.condition_note = condition.note
+            patient.encounter_template = encounter_template
+            emitter.mark_state_dirty()
+        condition = patient.condition
+        patient.condition_locked = True
+
+    patient_resource = patient.fhir_resources.get('patient', {})
+    condition_fhir = condition_to_fhir_dict(condition)
+    if persistence_enabled():
+        if condition_fhir:
+            condition.export_path = save_fhir_resource('condition', condition_fhir)
+        if event_sinks:
+            persistence_executor.submit(index_resource, 'patient', patient_resource)
+
+    # Log patient creation with LLM scheduler stats
+    llm_stats = llm_scheduler.stats()
+    log_parts = [
+        f"Patient Generated:",
+        f"ID: {patient.id}",
+        f"Name: {patient.name}",
+        f"DOB: {patient.dob}",
+        f"Condition: {condition.code.get('display', 'Unknown')}",
+        f"Severity: {condition.severity.get('display', 'Unknown')}",
+        f"Clinical Status: {condition.clinical_status.get('display', 'Unknown')}",
+        f"LLM Requests: {llm_stats['submitted']}",
+        f"Completed: {llm_stats['completed']}"
+    ]
+
+    if condition.note:
+        log_parts.append(f"Notes: {condition.note}")
+
+    # Attach FHIR JSON for patient and condition
+    attachments = []
+    if isinstance(patient_resource, dict) and patient_resource:
+        attachments.append({'label': 'Patient', 'json': patient_resource, 'preview': patient_export_path(patient.id)})
+    if condition_fhir:
+        attachments.append({'label': 'Condition', 'json': condition_fhir, 'preview': getattr(condition, 'export_path', None)})
+
+    log_event(" | ".join(log_parts), event_type='patient', attachments=attachments)
+
 def move_ambulances():
-    """Move ambulances to pick up patients and take them to the nearest hospital."""
+    """Move ambulances to pick up patients and take them to the nearest hospital.
+
+    Runs PHYSICS_RATE_HZ ticks per second; clients see the result at BROADCAST_RATE_HZ.
+    """
     while True:
+        started = time.monotonic()
+        rate_hz = max(1.0, float(PHYSICS_RATE_HZ))
+        step = AMBULANCE_SPEED / rate_hz
+        if step.is_integer():
+            step = int(step)  # Keeps positions integral at the default rates
         for house in houses:
             if house.patient_ids and not house.ambulance_on_the_way:
                 # Find the closest available ambulance
@@ -825,11 +932,15 @@ def move_ambulances():
                             attachments=build_ambulance_event_attachment('ambulance_no_patient', ambulance=closest_ambulance, patient=None, hospital_id=None, extra={'houseId': house.id})
                         )
 
+        # Any ambulance with a target moves (or arrives) this tick, so clients need a new frame
+        if any(a.target for a in ambulances):
+            emitter.mark_state_dirty()
+
         for ambulance in ambulances:
             if ambulance.target:
                 # Move ambulance to the target (house or hospital)
                 target_x, target_y = ambulance.target
-                ambulance.move_to(target_x, target_y)
+                ambulance.move_to(target_x, target_y, step)
 
                 # If reached house with patient
                 if ambulance.x == target_x and ambulance.y == target_y:
@@ -969,8 +1080,7 @@ def move_ambulances():
                             ambulance.redirect_attempted = False
                         ambulance.last_arrived_hospital_id = None
 
-        socketio.emit('update_state', get_state())
-        time.sleep(0.05)  # Reduce the sleep time to make the simulation feel faster
+        time.sleep(max(0.0, 1.0 / rate_hz - (time.monotonic() - started)))
 
 def find_nearest_hospital(x, y):
     """Find the nearest hospital to the given coordinates."""
@@ -999,97 +1109,136 @@ def choose_best_redirect_hospital(current_hospital_id, from_x, from_y):
     best = min(candidates, key=rank)
     return (best, ramp_counts.get(best.id, 0))
 
-def get_state():
-    """Returns the state of ambulances, houses, and hospitals."""
+def _patient_state(p):
     return {
-        'ambulances': [{
-            'id': a.id,
-            'x': a.x,
-            'y': a.y,
-            'state': a.state,
-            'patient_id': a.patient.id if a.patient else None,
-            'patient_name': a.patient.name if a.patient else None,
-            'patient_condition_display': (a.patient.condition.code.get('display', 'Unknown') if a.patient and a.patient.condition else None),
-            'queue_hospital_id': a.queue_hospital_id,
-            'ramp_wait_seconds': int(time.time() - a.ramp_since) if a.state == 'orange' and a.ramp_since else 0
-        } for a in ambulances],
-        'houses': [
-            {
-                'id': h.id,
-                'x': h.x,
-                'y': h.y,
-                'has_patient': len(h.patient_ids) > 0,
-                'ambulance_on_the_way': h.ambulance_on_the_way,
-                'patient_ids': h.patient_ids
-            } for h in houses
-        ],
-        'hospitals': [
-            {
-                'id': h.id,
-                'x': h.x,
-                'y': h.y,
-                'waiting': [{
-                    'id': p.id,
-                    'name': p.name,
-                    'condition': p.condition.to_dict() if p.condition else None,  # Convert Condition to dict
-                    'wait_time': p.wait_time
-                } for p in h.waiting],
-                'treating': [{
-                    'id': p.id,
-                    'name': p.name,
-                    'condition': p.condition.to_dict() if p.condition else None,  # Convert Condition to dict
-                    'wait_time': p.wait_time
-                } for p in h.treating],
-                'discharged': [{
-                    'id': p.id,
-                    'name': p.name,
-                    'condition': p.condition.to_dict() if p.condition else None,  # Convert Condition to dict
-                    'wait_time': p.wait_time
-                } for p in h.discharged]
-            } for h in hospitals
-        ]
+        'id': p.id,
+        'name': p.name,
+        'condition': p.condition.to_dict() if p.condition else None
     }
 
-def validate_encounter_data(encounter):
-    """Validate the encounter data structure and ensure required fields exist."""
-    required_structure = {
-        'type': [{'coding': [{'display': 'Unknown'}]}],
-        'status': 'Unknown',
-        'priority': {'coding': [{'display': 'Unknown'}]},
-        'serviceType': {'coding': [{'display': 'Unknown'}]},
-        'diagnosis': [{'condition': {'display': 'Unknown'}}],
-        'reasonCode': [{'coding': [{'display': 'Unknown'}]}],
-        'procedure': [{'display': 'Unknown'}]
+def patient_state(p, codec):
+    """A patient's state entry: cached identity and condition, then the current wait time."""
+    return codec.extend(p.state_fragment(_patient_state, codec), [('wait_time', codec.encode(p.wait_time))])
+
+def _ambulance_state(a):
+    vx, vy = a.velocity()
+    return {
+        'id': a.id,
+        'x': a.x,
+        'y': a.y,
+        # Lets the page dead-reckon between frames: move at (vx, vy) per second, stopping on target
+        'vx': vx,
+        'vy': vy,
+        'target': list(a.target) if a.target else None,
+        'state': a.state,
+        'patient_id': a.patient.id if a.patient else None,
+        'patient_name': a.patient.name if a.patient else None,
+        'patient_condition_display': (a.patient.condition.code.get('display', 'Unknown') if a.patient and a.patient.condition else None),
+        'queue_hospital_id': a.queue_hospital_id
     }
-    
-    # If encounter is None, return default structure
-    if not encounter:
-        logging.warning("Received null encounter data, using default structure")
-        return required_structure
-    
-    # Ensure all required fields exist with proper structure
-    validated = {}
-    try:
-        validated['type'] = encounter.get('type', required_structure['type'])
-        validated['status'] = encounter.get('status', required_structure['status'])
-        validated['priority'] = encounter.get('priority', required_structure['priority'])
-        validated['serviceType'] = encounter.get('serviceType', required_structure['serviceType'])
-        validated['diagnosis'] = encounter.get('diagnosis', required_structure['diagnosis'])
-        validated['reasonCode'] = encounter.get('reasonCode', required_structure['reasonCode'])
-        validated['procedure'] = encounter.get('procedure', required_structure['procedure'])
-        
-        # Copy any additional fields that might exist
-        for key in encounter:
-            if key not in validated:
-                validated[key] = encounter[key]
-                
-        return validated
-        
-    except Exception as e:
-        logging.error(f"Error validating encounter data: {str(e)}")
-        logging.debug(f"Raw encounter data: {encounter}")
-        return required_structure
 
+def ambulance_state(a, codec):
+    ramp_wait = int(time.time() - a.ramp_since) if a.state == 'orange' and a.ramp_since else 0
+    return codec.extend(a.state_fragment(_ambulance_state, codec, depends=a.patient),
+                        [('ramp_wait_seconds', codec.encode(ramp_wait))])
+
+def _house_state(h):
+    return {
+        'id': h.id,
+        'x': h.x,
+        'y': h.y,
+        'has_patient': len(h.patient_ids) > 0,
+        'ambulance_on_the_way': h.ambulance_on_the_way,
+        'patient_ids': h.patient_ids
+    }
+
+def _hospital_state(h):
+    return {'id': h.id, 'x': h.x, 'y': h.y}
+
+def _state_array(codec, fragments):
+    return codec.array(codec.join(fragments), len(fragments))
+
+def hospital_state(h, codec):
+    return codec.extend(h.state_fragment(_hospital_state, codec), [
+        ('waiting', _state_array(codec, [patient_state(p, codec) for p in list(h.waiting)])),
+        ('treating', _state_array(codec, [patient_state(p, codec) for p in list(h.treating)])),
+        ('discharged', h.discharged_fragments.array(list(h.discharged), lambda p: patient_state(p, codec), codec))
+    ])
+
+def layout_regions():
+    """Regions of the current map layout: 'houses' and 'hospitals', the two sides of the line
+    halfway between the house column and the hospital column (whole map if one side is empty)."""
+    inf = float('inf')
+    house_xs, hospital_xs = [h.x for h in list(houses)], [h.x for h in list(hospitals)]
+    if house_xs and hospital_xs:
+        split = (max(house_xs) + min(hospital_xs)) / 2
+    else:
+        split = inf if house_xs else -inf
+    return {'houses': (-inf, -inf, split, inf), 'hospitals': (split, -inf, inf, inf)}
+
+def state_regions():
+    """Subscribable regions: the configured STATE_REGIONS, or those of the current layout."""
+    return STATE_REGIONS or layout_regions()
+
+def parse_state_regions(items):
+    """{name: (x0, y0, x1, y1)} from NAME=X0,Y0,X1,Y1 items. Raises ValueError on a malformed item."""
+    regions = {}
+    for item in items:
+        name, _, bounds = item.partition('=')
+        try:
+            x0, y0, x1, y1 = (float(b) for b in bounds.split(','))
+        except ValueError:
+            raise ValueError(f"Expected NAME=X0,Y0,X1,Y1, got {item!r}") from None
+        if not name.strip() or x0 >= x1 or y0 >= y1:
+            raise ValueError(f"Expected NAME=X0,Y0,X1,Y1 with X0 < X1 and Y0 < Y1, got {item!r}")
+        regions[name.strip()] = (x0, y0, x1, y1)
+    return regions
+
+def state_view_entities(view):
+    """(ambulances, houses, hospitals) shown in a state view:
+    'all'; 'hospital:<id>', the hospital and the ambulances heading for or queued at it;
+    'region:<name>', what lies in that area (see state_regions)."""
+    current_ambulances, current_houses, current_hospitals = list(ambulances), list(houses), list(hospitals)
+    kind, _, key = view.partition(':')
+    if kind == 'hospital':
+        current_hospitals = [h for h in current_hospitals if str(h.id) == key]
+        spots = {(h.x, h.y) for h in current_hospitals}
+        return ([a for a in current_ambulances if a.target in spots or (a.queue_hospital_id is not None and str(a.queue_hospital_id) == key)],
+                [], current_hospitals)
+    if kind == 'region':
+        x0, y0, x1, y1 = state_regions()[key]
+        inside = lambda e: x0 <= e.x < x1 and y0 <= e.y < y1
+        return ([a for a in current_ambulances if inside(a)], [h for h in current_houses if inside(h)],
+                [h for h in current_hospitals if inside(h)])
+    return current_ambulances, current_houses, current_hospitals
+
+def get_state(view='all'):
+    """Returns the state of ambulances, houses, and hospitals in a view (see state_view_entities),
+    encoded with STATE_CODEC (JSON text, or MessagePack bytes with --state-encoding msgpack).
+
+    Each entity's encoding is cached and redone only after it changed (see
+    simulation/state_cache.py); per frame only wait and ramp times are filled in, so a
+    snapshot costs the entities that changed plus the patients in waiting and treatment.
+    """
+    codec = STATE_CODEC
+    view_ambulances, view_houses, view_hospitals = state_view_entities(view)
+    return codec.object([
+        ('ambulances', _state_array(codec, [ambulance_state(a, codec) for a in view_ambulances])),
+        ('houses', _state_array(codec, [h.state_fragment(_house_state, codec) for h in view_houses])),
+        ('hospitals', _state_array(codec, [hospital_state(h, codec) for h in view_hospitals]))
+    ])
+
+def ingest_encounter(encounter, hospital_id):
+    """Normalize an ED presentation once (see ENCOUNTER_VALIDATOR) and place it at the hospital.
+    Returns the encounter, changed in place, or None if it is not an Encounter."""
+    try:
+        encounter, errors = ENCOUNTER_VALIDATOR.validate(encounter)
+    except ResourceRejected as e:
+        logger.warning("Discarded ED presentation: %s", e)
+        return None
+    if errors:
+        logger.warning("Normalized ED presentation %s: %s", encounter.get('id'), '; '.join(errors))
+    return add_simple_location_to_encounter(encounter, hospital_id)
 
 def add_simple_location_to_encounter(encounter, hospital_id):
     """Ensure Encounter.location includes a simple hospital location entry.
@@ -1115,110 +1264,159 @@ def add_simple_location_to_encounter(encounter, hospital_id):
     except Exception:
         return encounter
 
-class RequestCounter:
-    def __init__(self):
-        self._count = 0
-        self._lock = Lock()
-        self._completed = 0
-
-    def increment_started(self):
-        with self._lock:
-            self._count += 1
-            return self._count
-
-    def increment_completed(self):
-        with self._lock:
-            self._completed += 1
-            return self._completed
-
-    def get_counts(self):
-        with self._lock:
-            return {
-                'started': self._count,
-                'completed': self._completed
-            }
+# All LLM calls go through the scheduler: per-model concurrency, priorities, deadlines and cancellation
+llm_scheduler = LLMScheduler(
+    default_concurrency=LLM_CONCURRENCY,
+    max_queue=LLM_MAX_QUEUE,
+    default_timeout=LLM_REQUEST_TIMEOUT
+)
+
+def describe_condition(condition):
+    """Condition context passed to the ED presentation prompt."""
+    return (f"{condition.code.get('display', 'Unknown condition')} - "
+            f"Severity: {condition.severity.get('display', 'Unknown severity')}")
 
-# Add after other global variables
-request_counter = RequestCounter()
+# Warm pool of pre-generated LLM conditions (with matching ED presentations), set up in __main__
+warm_pool = None
+WARM_POOL_PLACEHOLDER_ID = 'warm-pool'  # Ids in pooled items; replaced when bound to a patient
+
+def produce_warm_pool_encounter(condition_dict, llm_model):
+    """Pair a pooled Condition with an ED presentation for it; None if the condition is unusable."""
+    condition = Condition.from_fhir(condition_dict) if condition_dict else None
+    if condition is None:
+        return None
+    encounter_dict = llm_scheduler.call(
+        llm_model, generate_encounter_ed_presentation,
+        patient_id=WARM_POOL_PLACEHOLDER_ID,
+        condition_id=condition.id,
+        practitioner_id=WARM_POOL_PLACEHOLDER_ID,
+        organization_id=WARM_POOL_PLACEHOLDER_ID,
+        condition_description=describe_condition(condition),
+        llm_model=llm_model,
+        priority=PRIORITY_BACKGROUND
+    )
+    return {'condition': condition_dict, 'encounter': encounter_dict}
+
+def produce_warm_pool_item(severity, llm_model):
+    """Generate a Condition of the given severity and an ED presentation for it."""
+    condition_dict = llm_scheduler.call(
+        llm_model, generate_condition,
+        patient_id=WARM_POOL_PLACEHOLDER_ID, llm_model=llm_model, severity=severity,
+        priority=PRIORITY_BACKGROUND
+    )
+    return produce_warm_pool_encounter(condition_dict, llm_model)
+
+def produce_warm_pool_items(severity, count, llm_model):
+    """Generate up to count Conditions of the given severity in one batched prompt, each with an ED presentation."""
+    count = min(count, condition_batch_size(llm_model).size)
+    condition_dicts = llm_scheduler.call(
+        llm_model, generate_conditions_batch,
+        [WARM_POOL_PLACEHOLDER_ID] * count, llm_model=llm_model, severity=severity,
+        priority=PRIORITY_BACKGROUND
+    ) or []
+    return [produce_warm_pool_encounter(condition_dict, llm_model) for condition_dict in condition_dicts]
+
+def initialize_warm_pool(llm_model, low_watermark=None, high_watermark=None, workers=None, batch_max=None):
+    """Start the background producers that keep pre-generated conditions in every severity bucket."""
+    global warm_pool
+    batch_max = CONDITION_BATCH_MAX if batch_max is None else batch_max
+    # Batched generations bypass the LLM cache, whose entries are per single generation
+    batched = batch_max > 1 and get_llm_cache() is None
+    if batched:
+        configure_condition_batching(maximum=batch_max, target_seconds=CONDITION_BATCH_TARGET_SECONDS)
+    warm_pool = WarmPool(
+        'warm-pool',
+        functools.partial(produce_warm_pool_item, llm_model=llm_model),
+        WARM_POOL_SEVERITIES,
+        low_watermark=WARM_POOL_LOW_WATERMARK if low_watermark is None else low_watermark,
+        high_watermark=WARM_POOL_HIGH_WATERMARK if high_watermark is None else high_watermark,
+        workers=WARM_POOL_WORKERS if workers is None else workers,
+        produce_many=functools.partial(produce_warm_pool_items, llm_model=llm_model) if batched else None,
+        weights=WARM_POOL_SEVERITY_WEIGHTS
+    )
+    warm_pool.start()
+    logger.info("Warm pool started for %s (%d-%d items per severity, batches of up to %d)",
+                llm_model, warm_pool.low_watermark, warm_pool.high_watermark, batch_max if batched else 1)
+    return warm_pool
 
 # Modify process_patient_encounter to track requests
-def process_patient_encounter(hospital, patient):
-    """Process a patient encounter with LLM if enabled."""
+def process_patient_encounter(hospital, patient, use_llm=True):
+    """Process a patient encounter with LLM if enabled.
+
+    use_llm=False (the encounter executor's fallback) still binds a pre-generated ED
+    presentation but never waits on a new LLM call.
+    """
+    # The encounter references the current condition, so enrichment may no longer replace it
+    with patient.condition_lock:
+        patient.condition_locked = True
     try:
+        encounter = None
         if USE_LLM:
-            request_counter.increment_started()
-            # Get condition description for context
-            condition_desc = (f"{patient.condition.code.get('display', 'Unknown condition')} - "
-                            f"Severity: {patient.condition.severity.get('display', 'Unknown severity')}")
+            if patient.encounter_template is not None:
+                # Bind the ED presentation pre-generated with this patient's condition
+                encounter_dict = restamp_encounter(
+                    patient.encounter_template,
+                    patient_id=patient.id,
+                    condition_id=patient.condition.id,
+                    practitioner_id=str(uuid.uuid4()),
+                    organization_id=f"org-{hospital.id}"
+                )
+                patient.encounter_template = None
+            elif not use_llm:
+                encounter_dict = None
+            else:
+                # Only useful while the patient is being treated: deadline is the treatment time,
+                # and the request is dropped if the patient has left treatment before it runs
+                encounter_dict = llm_scheduler.call(
+                    DEFAULT_LLM_MODEL, generate_encounter_ed_presentation,
+                    patient_id=patient.id,
+                    condition_id=patient.condition.id,
+                    practitioner_id=str(uuid.uuid4()),
+                    organization_id=f"org-{hospital.id}",
+                    condition_description=describe_condition(patient.condition),
+                    llm_model=DEFAULT_LLM_MODEL,
+                    priority=PRIORITY_ENCOUNTER,
+                    timeout=TREATING_TIME,
+                    cancel_if=lambda: patient not in hospital.treating
+                )
             
-            encounter_dict = generate_encounter_ed_presentation(
+            encounter = ingest_encounter(encounter_dict, hospital.id) if encounter_dict else None
+            llm_metrics.record_result(DEFAULT_LLM_MODEL, 'encounter_ed_presentation', fallback=encounter is None)
+
+        if encounter is None:
+            # Use existing fallback logic if LLM fails or is disabled
+            encounter = ingest_encounter(generate_fallback_encounter(
                 patient_id=patient.id,
                 condition_id=patient.condition.id,
-                practitioner_id=str(uuid.uuid4()),
-                organization_id=f"org-{hospital.id}",
-                condition_description=condition_desc,
-                llm_model=DEFAULT_LLM_MODEL
-            )
-            request_counter.increment_completed()
-            
-            # Save the LLM-generated encounter if FHIR output is enabled
-            if OUTPUT_FHIR and SESSION_DIR and encounter_dict:
-                try:
-                    save_fhir_resource('encounter_ed_presentation', add_simple_location_to_encounter(encounter_dict, hospital.id))
-                    logging.info(f"Saved encounter FHIR resource for encounter {encounter_dict.get('id', 'unknown')}")
-                except Exception as e:
-                    logging.error(f"Error saving encounter FHIR resource: {str(e)}")
-            
-            if encounter_dict:
-                patient.encounters.append(add_simple_location_to_encounter(encounter_dict, hospital.id))
-                try:
-                    if isinstance(encounter_dict, dict) and encounter_dict.get('id'):
-                        patient.latest_encounter_id = encounter_dict.get('id')
-                except Exception:
-                    pass
-                try:
-                    log_event(
-                        f"ED presentation created for {patient.name} | Hospital {hospital.id}",
-                        event_type='hospital',
-                        attachments=[{'label': 'ED Presentation', 'json': validate_encounter_data(add_simple_location_to_encounter(encounter_dict, hospital.id))}]
-                    )
-                except Exception:
-                    pass
-                return encounter_dict
-            
-        # Use existing fallback logic if LLM fails or is disabled
-        fallback_encounter = generate_fallback_encounter(
-            patient_id=patient.id,
-            condition_id=patient.condition.id,
-            hospital_id=hospital.id
-        )
-        
-        # Save the fallback encounter if FHIR output is enabled
-        if OUTPUT_FHIR and SESSION_DIR and fallback_encounter:
+                hospital_id=hospital.id
+            ), hospital.id)
+            if encounter is None:
+                return None
+
+        # Save the encounter if FHIR output is enabled
+        encounter_path = None
+        if persistence_enabled():
             try:
-                save_fhir_resource('encounter_ed_presentation', add_simple_location_to_encounter(fallback_encounter, hospital.id))
-                logging.info(f"Saved encounter FHIR resource for encounter {fallback_encounter.get('id', 'unknown')}")
+                encounter_path = save_fhir_resource('encounter_ed_presentation', encounter)
+                logger.info("Saved encounter FHIR resource for encounter %s", encounter.get('id', 'unknown'))
             except Exception as e:
-                logging.error(f"Error saving encounter FHIR resource: {str(e)}")
-            
-        if fallback_encounter:
-            try:
-                try:
-                    if isinstance(fallback_encounter, dict) and fallback_encounter.get('id'):
-                        patient.latest_encounter_id = fallback_encounter.get('id')
-                except Exception:
-                    pass
-                log_event(
-                    f"ED presentation created for {patient.name} | Hospital {hospital.id}",
-                    event_type='hospital',
-                    attachments=[{'label': 'ED Presentation', 'json': validate_encounter_data(add_simple_location_to_encounter(fallback_encounter, hospital.id))}]
-                )
-            except Exception:
-                pass
-        return fallback_encounter
+                logger.error("Error saving encounter FHIR resource: %s", e)
+
+        # The normalized encounter is kept on the patient; the discharge and the log use it as is
+        patient.encounters.append(encounter)
+        patient.latest_encounter_id = encounter.get('id')
+        try:
+            log_event(
+                f"ED presentation created for {patient.name} | Hospital {hospital.id}",
+                event_type='hospital',
+                attachments=[{'label': 'ED Presentation', 'json': encounter, 'preview': encounter_path}]
+            )
+        except Exception:
+            pass
+        return encounter
             
     except Exception as e:
-        logging.error(f"Error in process_patient_encounter: {str(e)}", exc_info=True)
+        logger.error("Error in process_patient_encounter: %s", e, exc_info=True)
         return None
 
 def process_patient_discharge(hospital, patient, encounter):
@@ -1236,12 +1434,12 @@ def process_patient_discharge(hospital, patient, encounter):
             
             if OUTPUT_FHIR:
                 save_fhir_resource('encounter_discharge', discharge_dict)
-                logging.info(f"Saved encounter discharge FHIR resource")
+                logger.info("Saved encounter discharge FHIR resource")
             
             return discharge_dict
             
     except Exception as e:
-        logging.error(f"Error in process_patient_discharge: {str(e)}", exc_info=True)
+        logger.error("Error in process_patient_discharge: %s", e, exc_info=True)
         return None
 
 def manage_hospital_queues():
@@ -1273,8 +1471,7 @@ def manage_hospital_queues():
                         if patient.wait_time >= WAITING_TIME and len(hospital.treating) < GLOBAL_MAX_PATIENTS_PER_HOSPITAL:
                             moved_patient = hospital.move_patient_to_treating()
                             if moved_patient:
-                                # Use ThreadPoolExecutor to process encounters concurrently
-                                safe_submit(patient_generator_pool, process_patient_encounter, hospital, moved_patient)
+                                encounter_executor.submit(process_patient_encounter, hospital, moved_patient)
 
                 # Process treating patients
                 for patient in list(hospital.treating):
@@ -1282,13 +1479,7 @@ def manage_hospital_queues():
                     if patient.wait_time >= TREATING_TIME:
                         discharged_patient = hospital.discharge_patient()
                         if discharged_patient:
-                            # Process discharge in thread pool as well
-                            safe_submit(
-                                patient_generator_pool,
-                                generate_discharge_for_patient,
-                                hospital,
-                                discharged_patient
-                            )
+                            discharge_executor.submit(generate_discharge_for_patient, hospital, discharged_patient)
 
                 # After moving queues, try to offload any ramped ambulances if capacity is available
                 ramped = [a for a in ambulances if a.state == 'orange' and a.queue_hospital_id == hospital.id and a.patient]
@@ -1316,7 +1507,7 @@ def manage_hospital_queues():
                     amb.ramp_since = None
                     amb.redirect_attempted = False
 
-        socketio.emit('update_state', get_state())
+        emitter.mark_state_dirty()
         time.sleep(1)
 
 def log_hospital_event(message):
@@ -1325,7 +1516,7 @@ def log_hospital_event(message):
 
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return render_template('index.html', socket_transport=SOCKET_TRANSPORT)
 
 @app.route('/favicon.ico')
 def favicon():
@@ -1334,17 +1525,172 @@ def favicon():
     except Exception:
         return ("", 204)
 
+@app.route('/attachments/<attachment_id>')
+def get_attachment(attachment_id):
+    """Serve the JSON body of a log attachment (from the LRU cache, or the session export once evicted)."""
+    payload = attachment_store.get(attachment_id)
+    if payload is None:
+        return jsonify({'error': 'Attachment not found or expired'}), 404
+    return jsonify(payload)
+
+def register_event_sink(sink):
+    """Add a sink to receive every resource and event; it is flushed and closed at exit."""
+    event_sinks.append(sink)
+    atexit.register(sink.close)
+
+def initialize_kafka_sink(broker, topic_prefix=''):
+    """Stream resources and events straight to Kafka topics (patient, condition, event_ramping, ...)."""
+    try:
+        register_event_sink(KafkaSink(broker=broker, topic_prefix=topic_prefix))
+        logger.info("Streaming resources and events to Kafka broker %s", broker)
+    except Exception as e:
+        logger.error("Error connecting Kafka sink to %s: %s", broker, e)
+
+@app.route('/api/patients/<patient_id>/timeline')
+def get_patient_timeline(patient_id):
+    """Everything that happened to a patient, from the session store."""
+    if session_store is None:
+        return jsonify({'error': 'Session store is not enabled (run with --session-store)'}), 404
+    return jsonify(session_store.patient_timeline(patient_id))
+
+@app.route('/api/events')
+def get_events():
+    """Filter indexed events, e.g. /api/events?type=ramping&hospital=2"""
+    if session_store is None:
+        return jsonify({'error': 'Session store is not enabled (run with --session-store)'}), 404
+    args = request.args
+    try:
+        return jsonify(session_store.query_events(
+            patient=args.get('patient'),
+            event_type=args.get('type'),
+            hospital_id=args.get('hospital', type=int),
+            ambulance_id=args.get('ambulance', type=int),
+            since=args.get('since'),
+            until=args.get('until'),
+            limit=args.get('limit', default=500, type=int)
+        ))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/synthea')
+def get_synthea_metrics():
+    """Synthea prefetch queue depth and fetch latency, plus the patients staged for arrivals."""
+    return jsonify(dict(synthea_metrics(), staged=demographics_pool.metrics()))
+
+@app.route('/api/work-queues')
+def get_work_queue_metrics():
+    """Backlog, oldest task age and outcomes of the encounter, discharge and persistence queues."""
+    return jsonify(work_queue_stats())
+
+@app.route('/api/llm')
+def get_llm_metrics():
+    """LLM scheduler queues, endpoint load and health, plus latency percentiles, token rates, failures and fallback rate per model and generator."""
+    return jsonify(dict(llm_scheduler.stats(), perf=llm_metrics.llm_metrics_snapshot(), router=llm_client.get_router().stats()))
+
+@app.route('/metrics')
+def get_prometheus_metrics():
+    """LLM telemetry, scheduler and work queue gauges in Prometheus text format."""
+    lines = [llm_metrics.metrics.prometheus()]
+    stats = llm_scheduler.stats()
+    for name in ('queued', 'running'):
+        lines.append(f"# TYPE ambosim_llm_scheduler_{name} gauge\n")
+        for model, entry in sorted(stats['models'].items()):
+            lines.append(f'ambosim_llm_scheduler_{name}{{model="{model}"}} {entry[name]}\n')
+    endpoints = llm_client.get_router().stats()['endpoints']
+    for name, help_text in (('outstanding', 'LLM calls in flight per endpoint.'), ('up', 'Whether the endpoint circuit is closed.')):
+        lines.append(f"# HELP ambosim_llm_endpoint_{name} {help_text}\n# TYPE ambosim_llm_endpoint_{name} gauge\n")
+        for endpoint in endpoints:
+            value = endpoint['outstanding'] if name == 'outstanding' else int(endpoint['state'] == 'closed')
+            lines.append(f'ambosim_llm_endpoint_{name}{{endpoint="{endpoint["url"]}"}} {value}\n')
+    queues = work_queue_stats()
+    for name in ('queued', 'running', 'oldest_age_ms'):
+        lines.append(f"# TYPE ambosim_work_queue_{name} gauge\n")
+        for queue, entry in queues.items():
+            lines.append(f'ambosim_work_queue_{name}{{queue="{queue}"}} {entry[name]}\n')
+    for name in ('completed', 'failed', 'degraded', 'dropped', 'stale'):
+        lines.append(f"# TYPE ambosim_work_queue_{name}_total counter\n")
+        for queue, entry in queues.items():
+            lines.append(f'ambosim_work_queue_{name}_total{{queue="{queue}"}} {entry[name]}\n')
+    return Response(''.join(lines), mimetype='text/plain; version=0.0.4')
+
+def event_logs():
+    return {'patient': patient_event_log, 'ambulance': ambulance_event_log, 'hospital': hospital_event_log}
+
+def subscription_rooms(data):
+    """Rooms for a subscribe request: {'logs': [channel, ...], 'state': view or None, 'stats': bool}.
+    Raises ValueError for an unknown channel or view."""
+    channels = data.get('logs', [])
+    if isinstance(channels, str):
+        channels = [channels]
+    unknown = [c for c in channels if c not in LOG_CHANNELS]
+    if unknown:
+        raise ValueError(f"Unknown log channel(s): {', '.join(map(str, unknown))}")
+    view = data.get('state')
+    if view is not None:
+        view = str(view)
+        kind, _, key = view.partition(':')
+        regions = state_regions()
+        if not (view == 'all' or (kind == 'hospital' and key.isdigit()) or (kind == 'region' and key in regions)):
+            raise ValueError(f"Unknown state view {view!r} (all, hospital:<id>, region:<{'|'.join(regions)}>)")
+    if set(channels) == set(LOG_CHANNELS) and view == 'all' and data.get('stats'):
+        return {DEFAULT_ROOM}  # Everything: one combined batch per tick
+    rooms = {log_room(c) for c in channels}
+    if view is not None:
+        rooms.add(state_room(view))
+    if data.get('stats'):
+        rooms.add(STATS_ROOM)
+    return rooms
+
+def set_client_rooms(rooms):
+    """Move the requesting client into rooms; returns the rooms it newly joined."""
+    left, joined = emitter.set_rooms(request.sid, rooms)
+    for room in left:
+        leave_room(room)
+    for room in joined:
+        join_room(room)
+    return joined
+
 @socketio.on('connect')
 def handle_connect():
-    emit('update_patient_log', patient_event_log)
-    emit('update_ambulance_log', ambulance_event_log)
-    emit('update_hospital_log', hospital_event_log)
-    emit('update_state', get_state())
+    set_client_rooms({DEFAULT_ROOM})
+    # Send the full logs and state to the new client in a single batch
+    emit('batch_update', {
+        'logs': {channel: list(log) for channel, log in event_logs().items()},
+        'logs_reset': list(LOG_CHANNELS),
+        'log_capacity': LOG_CAPACITY,
+        'state': emitter.current_state()
+    })
+
+@socketio.on('disconnect')
+def handle_disconnect(*args):
+    emitter.remove_client(request.sid)
+
+@socketio.on('subscribe')
+def handle_subscribe(data):
+    """Receive only what the client renders (see subscription_rooms); replaces its current rooms.
+    Acknowledged with {'rooms': [...]} or {'error': ...}."""
+    try:
+        rooms = subscription_rooms(data or {})
+    except (ValueError, AttributeError, TypeError) as e:
+        return {'error': str(e)}
+    joined = set_client_rooms(rooms)
+    # Catch up on newly joined rooms; extras arrive with the next stats refresh
+    logs = {channel: list(log) for channel, log in event_logs().items()
+            if DEFAULT_ROOM in joined or log_room(channel) in joined}
+    catch_up = {}
+    if logs:
+        catch_up.update(logs=logs, logs_reset=list(logs), log_capacity=LOG_CAPACITY)
+    views = ['all'] if DEFAULT_ROOM in joined else [room[len('state:'):] for room in joined if room.startswith('state:')]
+    if views:
+        catch_up['state'] = emitter.current_state(views[0])
+    if catch_up:
+        emit('batch_update', catch_up)
+    return {'rooms': sorted(rooms)}
 
 @socketio.on('create_patient')
 def handle_create_patient():
     """Handle button click to create a patient."""
-    print('Create Patient event received')  # Debugging output
+    logger.debug('Create Patient event received')
     generate_random_patient()
 
 @socketio.on('create_patient_at_house')
@@ -1374,18 +1720,19 @@ def handle_create_patient_at_house(data):
         # Add patient to simulation
         patients.append(patient)
         house.add_patient(patient.id)
+        index_resource('patient', patient_resource)
         
         # Log patient creation with attachments
         attachments = []
         try:
             if isinstance(patient_resource, dict) and patient_resource:
-                attachments.append({'label': 'Patient', 'json': patient_resource})
+                attachments.append({'label': 'Patient', 'json': patient_resource, 'preview': patient_export_path(patient.id)})
         except Exception:
             pass
         try:
             cond_fhir = condition_to_fhir_dict(condition)
             if cond_fhir:
-                attachments.append({'label': 'Condition', 'json': cond_fhir})
+                attachments.append({'label': 'Condition', 'json': cond_fhir, 'preview': condition.export_path})
         except Exception:
             pass
 
@@ -1399,20 +1746,32 @@ def handle_create_patient_at_house(data):
             attachments=attachments
         )
         
-        socketio.emit('update_state', get_state())
+        emitter.mark_state_dirty()
 
 def generate_random_patient(llm_model=None):
-    """Generate a patient at a random house."""
+    """Admit a patient at a random house now; the condition is enriched asynchronously."""
     random_house = random.choice(houses)
-    patient = create_patient(random_house, SESSION_DIR, llm_model)
+    patient_data = demographics_pool.take('patient')
+    if patient_data is None:
+        # Never wait for Synthea on the arrival clock; the fallback patients are pre-generated
+        logger.info("Demographics buffer empty; admitting a fallback patient")
+        patient_data = generate_fallback_patient(SESSION_DIR)
+    patient = register_patient(random_house, patient_data)
     if patient:
-        socketio.emit('update_state', get_state())
+        emitter.mark_state_dirty()
+        enrichment_executor.submit(enrich_patient, patient, llm_model)
 
 def generate_patients_automatically(llm_model=None):
-    """Automatically generate patients at random intervals."""
+    """Admit patients at random intervals on a fixed schedule: creation runs in pipeline stages,
+    so slow generation does not stretch or bunch the inter-arrival times."""
+    next_arrival = time.monotonic()
     while True:
         generate_random_patient(llm_model)
-        time.sleep(random.randint(PATIENT_GENERATION_LOWER_BOUND, PATIENT_GENERATION_UPPER_BOUND))  # Random interval between 1 to 5 seconds
+        next_arrival += random.randint(PATIENT_GENERATION_LOWER_BOUND, PATIENT_GENERATION_UPPER_BOUND)  # Random interval between 1 to 5 seconds
+        delay = next_arrival - time.monotonic()
+        if delay < 0:
+            next_arrival -= delay  # Behind schedule: resume from now rather than bursting arrivals
+        time.sleep(max(0.0, delay))
 
 def reset_simulation(house_count=None, hospital_count=None, ambulance_count=None, waiting_time=None, treating_time=None, gen_min=None, gen_max=None):
     """Reset the simulation to the provided configuration (or defaults)."""
@@ -1455,14 +1814,13 @@ def reset_simulation(house_count=None, hospital_count=None, ambulance_count=None
         patient_event_log.clear()
         ambulance_event_log.clear()
         hospital_event_log.clear()
-        socketio.emit('update_patient_log', patient_event_log)
-        socketio.emit('update_ambulance_log', ambulance_event_log)
-        socketio.emit('update_hospital_log', hospital_event_log)
+        attachment_store.clear()
+        emitter.reset_logs()
     except Exception:
         pass
 
-    # Emit the updated state to all clients
-    socketio.emit('update_state', get_state())
+    # Flush the updated state to all clients on the next broadcast tick
+    emitter.mark_state_dirty()
 
 @socketio.on('reset_simulation')
 def handle_reset_simulation():
@@ -1517,52 +1875,115 @@ def initialize_fhir_session():
         # Remove this line that creates the 'fhir' subdirectory
         # os.makedirs(os.path.join(SESSION_DIR, 'fhir'), exist_ok=True)
         
-        logging.info(f"Initialized FHIR output session at {SESSION_DIR}")
+        logger.info("Initialized FHIR output session at %s", SESSION_DIR)
     except Exception as e:
-        logging.error(f"Error initializing FHIR session directory: {str(e)}")
+        logger.error("Error initializing FHIR session directory: %s", e)
         SESSION_DIR = None
 
-def save_fhir_resource(resource_type, resource):
-    """Save a FHIR resource to a JSON file if OUTPUT_FHIR is enabled."""
-    if not OUTPUT_FHIR or SESSION_DIR is None:
-        return
+def persistence_enabled():
+    """True if resources and events are kept anywhere (session export or event sinks)."""
+    return (OUTPUT_FHIR and SESSION_DIR is not None) or bool(event_sinks)
 
-    try:
-        # Create resource type directory within session directory
-        resource_dir = os.path.join(SESSION_DIR, resource_type.lower())
-        os.makedirs(resource_dir, exist_ok=True)
+def index_resource(resource_type, resource, patient_ref=None):
+    """Publish a FHIR resource to every configured event sink (session store, Kafka, ...)."""
+    for sink in event_sinks:
+        try:
+            sink.write_resource(resource_type, resource, patient_ref=patient_ref)
+        except Exception as e:
+            logger.error("Error publishing %s to %s: %s", resource_type, type(sink).__name__, e)
 
-        # Generate filename
+def index_event(payload, category=None, message=None):
+    """Publish an event payload to every configured event sink."""
+    for sink in event_sinks:
+        try:
+            sink.write_event(payload, category=category, message=message)
+        except Exception as e:
+            logger.error("Error publishing event to %s: %s", type(sink).__name__, e)
+
+def save_fhir_resource(resource_type, resource, patient_ref=None, data=None):
+    """Queue a FHIR resource for the event sinks and, if OUTPUT_FHIR is enabled, a JSON file.
+    Returns the file path it will be written to, or None if no file is written.
+    The resource is serialized here, so later changes to it are not persisted; data is its
+    JSON text when already rendered (e.g. FHIRTemplate.render), and resource then only needs its id.
+    """
+    filepath = None
+    if OUTPUT_FHIR and SESSION_DIR is not None:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
         resource_id = resource.get('id', 'unknown')
-        filename = f"{resource_type.lower()}_{resource_id}_{timestamp}.json"
-        
-        # Save the resource
-        filepath = os.path.join(resource_dir, filename)
+        filepath = os.path.join(SESSION_DIR, resource_type.lower(), f"{resource_type.lower()}_{resource_id}_{timestamp}.json")
+    try:
+        if data is None:
+            data = json.dumps(resource, indent=2)
+    except (TypeError, ValueError) as e:
+        logger.error("Error serializing FHIR resource: %s", e)
+        return None
+    if not persistence_executor.submit(write_fhir_resource, resource_type, data, filepath, patient_ref):
+        return None
+    return filepath
+
+def write_fhir_resource(resource_type, data, filepath, patient_ref=None):
+    """Persistence executor task: publish a serialized resource to the sinks and write its file."""
+    if event_sinks:
+        index_resource(resource_type, json.loads(data), patient_ref=patient_ref)
+    if filepath is None:
+        return
+    try:
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
         with open(filepath, 'w') as f:
-            json.dump(resource, f, indent=2)
-            
-        logging.debug(f"Saved FHIR resource to {filepath}")
+            f.write(data)
+        logger.debug("Saved FHIR resource to %s", filepath)
     except Exception as e:
-        logging.error(f"Error saving FHIR resource: {str(e)}")
+        logger.error("Error saving FHIR resource: %s", e)
+
+def patient_export_path(patient_id):
+    """Path of the Patient resource written by the patient generators, if it exists."""
+    if not OUTPUT_FHIR or SESSION_DIR is None:
+        return None
+    filepath = os.path.join(SESSION_DIR, 'patient', f"patient_{patient_id}.json")
+    return filepath if os.path.exists(filepath) else None
 
 # Add at the top of the file with other imports
 file_operation_lock = Lock()
 
+event_sinks = []  # EventSinks receiving every resource and event as it is produced
+session_store = None  # Indexed SessionStore, set at startup when --session-store is given
+
+def initialize_session_store(path=None):
+    """Open the indexed session store. Defaults to a file inside the FHIR session directory."""
+    global session_store
+    if not path:
+        base_dir = SESSION_DIR or FHIR_OUTPUT_DIR
+        filename = SESSION_STORE_FILENAME if SESSION_DIR else f"session_{datetime.now().strftime('%Y%m%d_%H%M%S')}.sqlite"
+        path = os.path.join(base_dir, filename)
+    try:
+        session_store = SessionStore(path)
+        register_event_sink(session_store)
+        logger.info("Indexing events and resources into session store %s", path)
+    except Exception as e:
+        logger.error("Error opening session store %s: %s", path, e)
+        session_store = None
+
 def log_llm_stats():
-    """Log LLM request statistics periodically and emit to frontend."""
+    """Log LLM scheduler statistics periodically and emit to frontend."""
     while True:
-        counts = request_counter.get_counts()
-        logging.info(f"LLM Requests - Started: {counts['started']}, Completed: {counts['completed']}")
+        stats = llm_scheduler.stats()
+        logger.info("LLM Requests - Queued: %s, Running: %s, Completed: %s, Failed: %s, Expired: %s, Cancelled: %s",
+                    stats['queued'], stats['running'], stats['completed'], stats['failed'], stats['expired'], stats['cancelled'])
         
-        # Emit stats to frontend using the correct IDs
-        socketio.emit('update_request_counts', {
-            'requests_made': counts['started'],
-            'requests_completed': counts['completed']
-        })
+        # Send stats to frontend (batched with the next broadcast)
+        emitter.set_extra('llm', dict(stats, perf=llm_metrics.llm_metrics_snapshot(), router=llm_client.get_router().stats()))
+        if warm_pool is not None:
+            emitter.set_extra('warm_pool', dict(warm_pool.metrics(), batches=condition_batch_stats()))
         
         time.sleep(1)  # Update every second
 
+def publish_runtime_stats():
+    """Send Synthea prefetch and work queue depths and latencies to the frontend every second."""
+    while True:
+        emitter.set_extra('synthea', dict(synthea_metrics(), staged=demographics_pool.metrics()))
+        emitter.set_extra('work_queues', work_queue_stats())
+        time.sleep(1)
+
 if __name__ == '__main__':
     parser = ArgumentParser(description='Run the ambulance simulation')
     parser.add_argument('--llm-model', type=str, default=DEFAULT_LLM_MODEL,
@@ -1571,29 +1992,173 @@ if __name__ == '__main__':
                        help='Run simulation without LLM integration')
     parser.add_argument('--output-fhir', '--fhir-export', action='store_true',
                        help='Output FHIR resources as JSON files')
+    parser.add_argument('--session-store', nargs='?', const='', default=None, metavar='PATH',
+                       help=f'Index events and resources into an embedded SQLite store (default path: <session dir>/{SESSION_STORE_FILENAME})')
+    parser.add_argument('--kafka-broker', type=str, default=None, metavar='HOST:PORT',
+                       help='Publish resources and events directly to this Kafka broker')
+    parser.add_argument('--kafka-topic-prefix', type=str, default='',
+                       help='Prefix added to every Kafka topic name (default: none)')
+    parser.add_argument('--attachment-cache-size', type=int, default=ATTACHMENT_CACHE_SIZE,
+                       help=f'Number of log attachment payloads kept in memory (default: {ATTACHMENT_CACHE_SIZE})')
+    parser.add_argument('--broadcast-hz', type=float, default=BROADCAST_RATE_HZ,
+                       help=f'Rate at which batched log/state updates are sent to clients (default: {BROADCAST_RATE_HZ})')
+    parser.add_argument('--physics-hz', type=float, default=PHYSICS_RATE_HZ,
+                       help=f'Ambulance movement ticks per second; speed does not depend on it (default: {PHYSICS_RATE_HZ})')
+    parser.add_argument('--transport', choices=['polling', 'websocket'], default=SOCKET_TRANSPORT,
+                       help=f'Socket.IO transport for the browser; websocket needs simple-websocket (default: {SOCKET_TRANSPORT})')
+    parser.add_argument('--state-encoding', choices=sorted(STATE_CODECS), default=STATE_CODEC.name,
+                       help=f'Encoding of state frames; msgpack sends binary frames and needs msgpack (default: {STATE_CODEC.name})')
+    parser.add_argument('--state-region', action='append', default=[], metavar='NAME=X0,Y0,X1,Y1',
+                       help='Map area clients can subscribe to as region:NAME, repeatable (default: $AMBOSIM_STATE_REGIONS, '
+                            'items separated by ";", else houses/hospitals derived from the layout)')
+    parser.add_argument('--llm-concurrency', type=int, default=LLM_CONCURRENCY,
+                       help=f'Concurrent LLM calls per model (default: {LLM_CONCURRENCY})')
+    parser.add_argument('--llm-model-concurrency', action='append', default=[], metavar='MODEL=N',
+                       help='Concurrency for one model, e.g. llama3.1:8b=1 (repeatable)')
+    parser.add_argument('--llm-timeout', type=float, default=LLM_REQUEST_TIMEOUT,
+                       help=f'Seconds an LLM request may wait and run before it is abandoned (default: {LLM_REQUEST_TIMEOUT})')
+    parser.add_argument('--llm-queue-limit', type=int, default=LLM_MAX_QUEUE,
+                       help=f'Queued LLM requests per model before new ones fall back (default: {LLM_MAX_QUEUE})')
+    parser.add_argument('--llm-endpoints', type=str, default=os.getenv('AMBOSIM_LLM_ENDPOINTS'), metavar='FILE_OR_JSON',
+                       help='Pool of Ollama endpoints (JSON file or inline JSON, see fhir_generators/llm_router.py); default: OLLAMA_HOST')
+    parser.add_argument('--llm-hedge', action='append', default=[], metavar='MODEL=SMALLER',
+                       help='Also ask SMALLER when MODEL\'s p95 latency exceeds the request deadline, e.g. llama3.1:8b=gemma2:2b (repeatable)')
+    parser.add_argument('--work-queue-limit', action='append', default=[], metavar='NAME=N',
+                       help=f'Waiting tasks for the {", ".join(work_queues)} queue, e.g. encounter=16 (repeatable)')
+    parser.add_argument('--work-queue-policy', action='append', default=[], metavar='NAME=POLICY',
+                       help=f'What a full queue does: {", ".join(OVERFLOW_POLICIES)}, e.g. persistence=drop '
+                            f'(default: {", ".join(f"{k}={v}" for k, v in WORK_QUEUE_OVERFLOW.items())})')
+    parser.add_argument('--no-warm-pool', action='store_true',
+                       help='Call the LLM synchronously for each new patient instead of using pre-generated conditions')
+    parser.add_argument('--warm-pool-low', type=int, default=WARM_POOL_LOW_WATERMARK,
+                       help=f'Refill a severity bucket below this many pre-generated conditions (default: {WARM_POOL_LOW_WATERMARK})')
+    parser.add_argument('--warm-pool-high', type=int, default=WARM_POOL_HIGH_WATERMARK,
+                       help=f'Fill severity buckets up to this many pre-generated conditions (default: {WARM_POOL_HIGH_WATERMARK})')
+    parser.add_argument('--warm-pool-workers', type=int, default=WARM_POOL_WORKERS,
+                       help=f'Background threads pre-generating conditions (default: {WARM_POOL_WORKERS})')
+    parser.add_argument('--condition-batch-max', type=int, default=CONDITION_BATCH_MAX,
+                       help=f'Most conditions the warm pool requests per LLM call; 1 disables batching (default: {CONDITION_BATCH_MAX})')
+    parser.add_argument('--llm-cache', type=str, default=None, metavar='DIR',
+                       help='Record/replay LLM generations in this directory (default: $AMBOSIM_LLM_CACHE)')
+    parser.add_argument('--llm-cache-mode', choices=LLM_CACHE_MODES, default=None,
+                       help='record, replay (no LLM calls) or record_on_miss (default)')
+    parser.add_argument('--llm-cache-variants', type=int, default=3,
+                       help='Recorded outputs kept per prompt; record_on_miss calls the LLM until this many exist (default: 3)')
+    parser.add_argument('--llm-cache-slots', type=int, default=32,
+                       help='Cache keys per prompt input; identical inputs are served from up to slots x variants outputs (default: 32)')
+    parser.add_argument('--llm-cache-seed', type=int, default=None,
+                       help='Seed for choosing cache slots and replayed variants, for repeatable runs (default: unseeded)')
+    parser.add_argument('--synthea-pool', type=str, default=None, metavar='PATH',
+                       help='Local Synthea patient pool (NDJSON); API responses are cached into it and it is sampled when the API buffer is empty (default: $AMBOSIM_SYNTHEA_POOL)')
+    parser.add_argument('--synthea-offline', action='store_true',
+                       help='Sample patients only from --synthea-pool, never calling the Synthea API')
+    parser.add_argument('--synthea-seed', type=int, default=None,
+                       help='Seed for sampling --synthea-pool, so runs get the same patients and ids (default: unseeded)')
+    parser.add_argument('--log-level', type=str, default=LOG_LEVEL,
+                       help=f'Root log level for simulation.log and the console (default: {LOG_LEVEL})')
+    parser.add_argument('--log-category', action='append', default=[], metavar='LOGGER=LEVEL',
+                       help='Per-category log level, e.g. fhir_generators=DEBUG or ambosim=WARNING (repeatable)')
+    parser.add_argument('--log-json', action='store_true',
+                       help='Write one JSON object per log line instead of plain text')
     
     args = parser.parse_args()
+
+    try:
+        category_levels = parse_category_levels(args.log_category)
+    except ValueError as e:
+        parser.error(str(e))
+    configure_logging(log_file=LOG_FILE, level=args.log_level, json_format=args.log_json,
+                      category_levels=category_levels)
     
     # Update global flags
     USE_LLM = not args.no_llm
     OUTPUT_FHIR = args.output_fhir
+    BROADCAST_RATE_HZ = max(0.1, args.broadcast_hz)
+    emitter.rate_hz = BROADCAST_RATE_HZ
+    PHYSICS_RATE_HZ = max(1.0, args.physics_hz)
+    SOCKET_TRANSPORT = args.transport
+    try:
+        init_socketio(SOCKET_TRANSPORT)
+        STATE_CODEC = STATE_CODECS[args.state_encoding]()
+        STATE_REGIONS = parse_state_regions(args.state_region or
+                                            [r for r in os.getenv('AMBOSIM_STATE_REGIONS', '').split(';') if r.strip()])
+    except (RuntimeError, ValueError) as e:
+        parser.error(str(e))
+    ATTACHMENT_CACHE_SIZE = max(1, args.attachment_cache_size)
+    attachment_store.capacity = ATTACHMENT_CACHE_SIZE
     
     if OUTPUT_FHIR:
         initialize_fhir_session()  # Initialize the global session directory
-        logging.info(f"FHIR resources will be saved to {SESSION_DIR}/")
+        logger.info("FHIR resources will be saved to %s/", SESSION_DIR)
+
+    if args.session_store is not None:
+        initialize_session_store(args.session_store)
+    if args.kafka_broker:
+        initialize_kafka_sink(args.kafka_broker, args.kafka_topic_prefix)
     
     if USE_LLM:
-        logging.info(f"Running simulation with LLM")
+        logger.info("Running simulation with LLM")
+        llm_scheduler.default_concurrency = max(1, args.llm_concurrency)
+        llm_scheduler.max_queue = max(1, args.llm_queue_limit)
+        llm_scheduler.default_timeout = max(1.0, args.llm_timeout)
+        for item in args.llm_model_concurrency:
+            model, sep, count = item.rpartition('=')
+            if not sep or not count.isdigit():
+                parser.error(f"Expected MODEL=N, got {item!r}")
+            llm_scheduler.concurrency[model] = max(1, int(count))
+        router = llm_client.get_router()
+        if args.llm_endpoints:
+            try:
+                router = load_router_config(args.llm_endpoints)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                parser.error(f"Invalid --llm-endpoints: {e}")
+            # Let the scheduler keep every endpoint busy
+            capacity = router.capacity()
+            if capacity:
+                llm_scheduler.default_concurrency = max(llm_scheduler.default_concurrency, capacity)
+        for item in args.llm_hedge:
+            model, sep, smaller = item.partition('=')
+            if not sep or not model or not smaller:
+                parser.error(f"Expected MODEL=SMALLER, got {item!r}")
+            router.hedge[model] = smaller
+        llm_client.configure_router(router)
+        logger.info("LLM endpoints: %s", ', '.join(e.name for e in router.endpoints))
+        configure_llm_cache(args.llm_cache, args.llm_cache_mode, variants_per_key=max(1, args.llm_cache_variants),
+                            slots=max(1, args.llm_cache_slots), seed=args.llm_cache_seed)
+        if not args.no_warm_pool:
+            initialize_warm_pool(args.llm_model, max(0, args.warm_pool_low), max(1, args.warm_pool_high), max(1, args.warm_pool_workers),
+                                 max(1, args.condition_batch_max))
     
-    # Register shutdown handler for thread pool
-    atexit.register(lambda: patient_generator_pool.shutdown(wait=True))
+    for item in args.work_queue_limit:
+        name, sep, count = item.partition('=')
+        if name not in work_queues or not count.isdigit():
+            parser.error(f"Expected NAME=N with NAME one of {', '.join(work_queues)}, got {item!r}")
+        work_queues[name].max_queue = max(1, int(count))
+    for item in args.work_queue_policy:
+        name, sep, policy = item.partition('=')
+        executor = work_queues.get(name)
+        if executor is None or policy not in OVERFLOW_POLICIES or (policy == OVERFLOW_DEGRADE and executor.fallback is None):
+            degradable = [queue for queue, e in work_queues.items() if e.fallback is not None]
+            parser.error(f"Expected NAME=POLICY with NAME one of {', '.join(work_queues)} and POLICY one of "
+                         f"{', '.join(OVERFLOW_POLICIES)} (degrade only for {', '.join(degradable)}), got {item!r}")
+        executor.overflow = policy
+
+    # Register shutdown handler for the work queues: finish queued encounters and discharges first, since they queue writes
+    atexit.register(lambda: [executor.shutdown(wait=True) for executor in work_queues.values()])
     
+    # Start filling the Synthea buffer before the first patient is requested
+    configure_patient_pool(args.synthea_pool, offline=args.synthea_offline, seed=args.synthea_seed)
+    start_prefetcher()
+    demographics_pool.start()
+
     # Start background threads with specified model
     Thread(target=lambda: generate_patients_automatically(args.llm_model)).start()
     Thread(target=move_ambulances).start()
     Thread(target=manage_hospital_queues).start()
+    emitter.start()
     
     if USE_LLM:
         Thread(target=log_llm_stats, daemon=True).start()
+    Thread(target=publish_runtime_stats, daemon=True).start()
     
     socketio.run(app)
@@ -0,0 +1,114 @@
+import logging
+import time
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class CircuitOpenError(Exception):
+    """Raised by CircuitBreaker.call when the circuit is open."""
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker for an external dependency.
+
+    After failure_threshold consecutive failures the circuit opens and allow_request()
+    returns False, so callers take their fallback path straight away. Once reset_timeout
+    seconds have passed a single trial request is allowed (half-open); its success closes
+    the circuit, its failure re-opens it for another reset_timeout.
+    on_state_change(name, old_state, new_state) is called on every transition.
+    """
+
+    def __init__(self, name, failure_threshold=3, reset_timeout=10.0, on_state_change=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.on_state_change = on_state_change
+        self._lock = Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._open_count = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state
+
+    def allow_request(self):
+        """True if a request may be attempted now (moves open -> half-open when the timeout expires)."""
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                transition = self._set_state(HALF_OPEN)
+            else:
+                return False
+        self._notify(transition)
+        return True
+
+    def retry_after(self):
+        """Seconds until the next trial request is allowed (0 when closed)."""
+        with self._lock:
+            if self._state != OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            transition = self._set_state(CLOSED)
+        self._notify(transition)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            transition = None
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                transition = self._set_state(OPEN)
+        self._notify(transition)
+
+    def call(self, fn, *args, **kwargs):
+        if not self.allow_request():
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self._state,
+                'consecutive_failures': self._failures,
+                'open_count': self._open_count
+            }
+
+    def _set_state(self, new_state):
+        old_state = self._state
+        if old_state == new_state:
+            return None
+        self._state = new_state
+        if new_state == OPEN:
+            self._open_count += 1
+        return old_state, new_state
+
+    def _notify(self, transition):
+        if transition is None:
+            return
+        old_state, new_state = transition
+        if new_state == OPEN:
+            logger.warning("%s circuit opened after %d consecutive failures (was %s)", self.name, self._failures, old_state)
+        else:
+            logger.info("%s circuit %s -> %s", self.name, old_state, new_state)
+        if self.on_state_change:
+            try:
+                self.on_state_change(self.name, old_state, new_state)
+            except Exception as e:
+                logger.error("Error in circuit state callback: %s", e)
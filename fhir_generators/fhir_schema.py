@@ -0,0 +1,106 @@
+import argparse
+import copy
+import functools
+import json
+import os
+import re
+
+# python3 -m fhir_generators.fhir_schema condition
+# python3 -m fhir_generators.fhir_schema encounter --fields resourceType id status
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'fhir_templates')
+
+_COMMENT = re.compile(r'<!--.*?-->', re.DOTALL)
+_BARE_PLACEHOLDER = re.compile(r'(:\s*)<[^<>"\n]+>')  # e.g. "rank": <diagnosis-rank>
+_PLACEHOLDER = re.compile(r'<[^<>]+>')
+
+def template_source(name):
+    """Text of fhir_templates/<name>.json with <!-- --> comments removed (bare placeholders kept)."""
+    with open(os.path.join(TEMPLATE_DIR, f"{name}.json"), 'r') as f:
+        return _COMMENT.sub('', f.read())
+
+@functools.lru_cache(maxsize=None)
+def _load_template(name):
+    # Unquoted placeholders stand for numbers in the templates
+    return json.loads(_BARE_PLACEHOLDER.sub(r'\g<1>0', template_source(name)))
+
+def load_template(name):
+    """A fhir_templates/<name>.json template as a dict, with <!-- --> comments removed and
+    bare (unquoted) placeholders replaced by 0."""
+    return copy.deepcopy(_load_template(name))
+
+def schema_from_template(node):
+    """JSON Schema for a template node.
+
+    Objects require every key and allow no others, arrays need at least one item shaped
+    like the template's first item, strings containing a <placeholder> may be any string
+    and other strings are fixed values.
+    """
+    if isinstance(node, dict):
+        return {
+            'type': 'object',
+            'properties': {key: schema_from_template(value) for key, value in node.items()},
+            'required': list(node),
+            'additionalProperties': False
+        }
+    if isinstance(node, list):
+        schema = {'type': 'array', 'minItems': 1}
+        if node:
+            schema['items'] = schema_from_template(node[0])
+        return schema
+    if isinstance(node, bool):
+        return {'type': 'boolean'}
+    if isinstance(node, int):
+        return {'type': 'integer'}
+    if isinstance(node, float):
+        return {'type': 'number'}
+    if isinstance(node, str) and not _PLACEHOLDER.search(node):
+        return {'type': 'string', 'enum': [node]}
+    return {'type': 'string'}
+
+def omit_path(template, path):
+    """Remove a dotted path from template in place (lists are followed through their first item)."""
+    node = template
+    *parents, leaf = path.split('.')
+    for key in parents:
+        node = node.get(key) if isinstance(node, dict) else None
+        if isinstance(node, list):
+            node = node[0] if node else None
+    if isinstance(node, dict):
+        node.pop(leaf, None)
+
+@functools.lru_cache(maxsize=None)
+def _resource_schema(name, fields, extend, omit):
+    template = load_template(name)
+    extra = json.loads(extend) if extend else {}
+    for path in omit:
+        omit_path(template, path)
+    selected = {}
+    for field in fields or list(template) + list(extra):
+        if field in extra:
+            selected[field] = extra[field]
+        elif field in template:
+            selected[field] = template[field]
+        else:
+            raise KeyError(f"{field!r} is neither in fhir_templates/{name}.json nor in extend")
+    return schema_from_template(selected)
+
+def resource_schema(name, fields=None, extend=None, omit=()):
+    """JSON Schema for a resource, derived from fhir_templates/<name>.json.
+
+    Args:
+        name (str): Template name, e.g. 'condition'
+        fields (list, optional): Top-level fields to keep, in order (default: all)
+        extend (dict, optional): Template fragments for fields the template lacks
+        omit (iterable, optional): Dotted paths to drop, e.g. 'period.end'
+    """
+    return copy.deepcopy(_resource_schema(
+        name, tuple(fields) if fields else None,
+        json.dumps(extend, sort_keys=True) if extend else None, tuple(omit)))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Print the JSON Schema derived from a FHIR template')
+    parser.add_argument('name', help='Template name in fhir_templates/, e.g. condition')
+    parser.add_argument('--fields', nargs='*', help='Top-level fields to keep (default: all)')
+    args = parser.parse_args()
+    print(json.dumps(resource_schema(args.name, args.fields), indent=2))
@@ -0,0 +1,199 @@
+import functools
+import json
+import re
+
+from fhir_generators.fhir_schema import template_source, omit_path
+
+# Fill fhir_templates/*.json without rebuilding nested literals by hand:
+# CONDITION = compile_template('condition', omit=('encounter', 'recorder', 'asserter'))
+# CONDITION.fill(condition_id='c1', patient_id='p1', condition_display='Headache', ...)
+#
+# Every <placeholder> is a slot named after it (<patient-id> -> patient_id). A string that is
+# only a placeholder (or a bare placeholder such as "rank": <diagnosis-rank>) takes any JSON
+# value; a placeholder inside other text ("Patient/<patient-id>") takes its str(). Slots left
+# out (or None) drop their key, and so does any part of the template whose slots are all left out.
+
+_PLACEHOLDER = re.compile(r'<([^<>"\n]+)>')
+_BARE_PLACEHOLDER = re.compile(r'(:\s*)(<[^<>"\n]+>)')
+# Private-use markers for slots in pre-serialized fragments (json.dumps escapes them as \ue000 / \ue001)
+_MARK_OPEN, _MARK_CLOSE = '\ue000', '\ue001'
+_FRAGMENT_SLOT = re.compile(r'"\\ue000W(\d+)\\ue001"|\\ue000E(\d+)\\ue001')
+_encode_string = json.encoder.encode_basestring_ascii  # What json.dumps uses for a str
+
+def _slot_name(placeholder):
+    return re.sub(r'\W+', '_', placeholder).strip('_').lower()
+
+class _Slot:
+    """A whole-value slot, or an embedded one: parts alternates literal text and slot names."""
+    __slots__ = ('parts',)
+
+    def __init__(self, parts):
+        self.parts = parts
+
+    @property
+    def names(self):
+        return self.parts[1::2]
+
+    @property
+    def whole(self):
+        return len(self.parts) == 3 and not self.parts[0] and not self.parts[2]
+
+def _parse(node):
+    """Template node with placeholder strings replaced by _Slot objects."""
+    if isinstance(node, dict):
+        return {key: _parse(value) for key, value in node.items()}
+    if isinstance(node, list):
+        return [_parse(item) for item in node]
+    if isinstance(node, str) and _PLACEHOLDER.search(node):
+        parts = _PLACEHOLDER.split(node)
+        return _Slot([_slot_name(part) if i % 2 else part for i, part in enumerate(parts)])
+    return node
+
+def _slot_names(node, names):
+    if isinstance(node, dict):
+        for value in node.values():
+            _slot_names(value, names)
+    elif isinstance(node, list):
+        for item in node:
+            _slot_names(item, names)
+    elif isinstance(node, _Slot):
+        for name in node.names:
+            if name not in names:
+                names.append(name)
+    return names
+
+_EMPTY = object()
+
+def _prune(node, present):
+    """node without slots missing from present, and without parts whose slots are all missing
+    (a coding left with only its fixed system means nothing); purely constant parts stay."""
+    names = _slot_names(node, [])
+    if names and not any(name in present for name in names):
+        return _EMPTY
+    if isinstance(node, dict):
+        pruned = {}
+        for key, value in node.items():
+            value = _prune(value, present)
+            if value is not _EMPTY:
+                pruned[key] = value
+        return pruned if pruned or not node else _EMPTY
+    if isinstance(node, list):
+        pruned = [value for value in (_prune(item, present) for item in node) if value is not _EMPTY]
+        return pruned if pruned or not node else _EMPTY
+    if isinstance(node, _Slot) and not all(name in present for name in node.names):
+        return _EMPTY
+    return node
+
+def _expression(node):
+    """Python expression building node from the slot dict `s` (constants become fresh literals)."""
+    if isinstance(node, dict):
+        return '{' + ', '.join(f"{key!r}: {_expression(value)}" for key, value in node.items()) + '}'
+    if isinstance(node, list):
+        return '[' + ', '.join(_expression(item) for item in node) + ']'
+    if isinstance(node, _Slot):
+        if node.whole:
+            return f"s[{node.names[0]!r}]"
+        # Adjacent literals: one string built with str() of each embedded value
+        return ' '.join('f"{s[%r]!s}"' % part if i % 2 else repr(part) for i, part in enumerate(node.parts) if part or i % 2)
+    return repr(node)
+
+def _marked(node, slots):
+    """node with slots replaced by marker strings, collecting the slots in order."""
+    if isinstance(node, dict):
+        return {key: _marked(value, slots) for key, value in node.items()}
+    if isinstance(node, list):
+        return [_marked(item, slots) for item in node]
+    if isinstance(node, _Slot):
+        if node.whole:
+            slots.append((True, node.names[0]))
+            return f"{_MARK_OPEN}W{len(slots) - 1}{_MARK_CLOSE}"
+        text = []
+        for i, part in enumerate(node.parts):
+            if i % 2:
+                slots.append((False, part))
+                text.append(f"{_MARK_OPEN}E{len(slots) - 1}{_MARK_CLOSE}")
+            else:
+                text.append(part)
+        return ''.join(text)
+    return node
+
+class FHIRTemplate:
+    """A fhir_templates/ resource compiled into fill functions.
+
+    fill() returns a new resource dict, built by a function generated for the slots given
+    (so dropping unfilled keys costs nothing per call). render() returns the JSON text
+    from pre-serialized fragments, with only the slot values serialized per call.
+    Slot values are inserted as given, not copied.
+    """
+
+    def __init__(self, name, node):
+        self.name = name
+        self._node = node
+        self.slots = tuple(_slot_names(node, []))
+        self._builders = {}
+        self._fragments = {}
+
+    def _present(self, values):
+        return frozenset([name for name, value in values.items() if value is not None])
+
+    def _builder(self, slots):
+        # Callers pass the same slots in the same order, so the key tuple finds the builder
+        # without working out which slots are present (only valid when none of them is None)
+        key = tuple(slots) if None not in slots.values() else self._present(slots)
+        builder = self._builders.get(key)
+        if builder is None:
+            node = _prune(self._node, self._present(slots))
+            source = f"def build(s):\n    return {_expression({} if node is _EMPTY else node)}\n"
+            namespace = {}
+            exec(compile(source, f"<fhir template {self.name}>", 'exec'), namespace)
+            builder = self._builders[key] = namespace['build']
+        return builder
+
+    def fill(self, values=None, **slots):
+        """The resource with slots filled from values and/or keyword arguments."""
+        if values:
+            slots = dict(values, **slots)
+        return self._builder(slots)(slots)
+
+    def _compiled_fragments(self, slots, indent):
+        key = (tuple(slots) if None not in slots.values() else self._present(slots), indent)
+        compiled = self._fragments.get(key)
+        if compiled is None:
+            node = _prune(self._node, self._present(slots))
+            slots = []
+            text = json.dumps(_marked({} if node is _EMPTY else node, slots), indent=indent)
+            literals, refs, last = [], [], 0
+            for match in _FRAGMENT_SLOT.finditer(text):
+                literals.append(text[last:match.start()])
+                index = int(match.group(1) if match.group(1) is not None else match.group(2))
+                refs.append(slots[index])
+                last = match.end()
+            literals.append(text[last:])
+            compiled = self._fragments[key] = (literals, refs)
+        return compiled
+
+    def render(self, values=None, indent=None, **slots):
+        """JSON text of fill(values, **slots), as json.dumps(..., indent=indent) would write it
+        (whole-value slots holding objects are not re-indented)."""
+        if values:
+            slots = dict(values, **slots)
+        literals, refs = self._compiled_fragments(slots, indent)
+        out = [literals[0]]
+        for (whole, name), literal in zip(refs, literals[1:]):
+            value = slots[name]
+            if whole:
+                out.append(_encode_string(value) if isinstance(value, str) else json.dumps(value))
+            else:
+                out.append(_encode_string(value if isinstance(value, str) else str(value))[1:-1])
+            out.append(literal)
+        return ''.join(out)
+
+@functools.lru_cache(maxsize=None)
+def compile_template(name, omit=()):
+    """FHIRTemplate for fhir_templates/<name>.json without the dotted paths in omit
+    (list items are reached through their first element, e.g. 'participant.individual')."""
+    text = _BARE_PLACEHOLDER.sub(r'\g<1>"\g<2>"', template_source(name))
+    node = json.loads(text)
+    for path in omit:
+        omit_path(node, path)
+    return FHIRTemplate(name, _parse(node))
@@ -0,0 +1,181 @@
+import copy
+import functools
+
+from fhir_generators.fhir_schema import load_template
+
+# Checks for resources entering the simulation (LLM output, warm pool, cache replays),
+# compiled once from fhir_templates/<name>.json plus the paths the simulator relies on:
+# ENCOUNTER = FHIRValidator('encounter', required=('id', 'period.start'), defaults={'status': 'unknown'})
+# encounter, errors = ENCOUNTER.validate(encounter)  # errors: ['diagnosis[0].condition: expected object, got str']
+#
+# Paths are dotted and go through every item of a list ('type.coding.display'). The resource
+# is normalized in place: a value of the wrong shape is replaced by its default or removed, a
+# lone object where the template has a list is wrapped in one, numbers given for strings are
+# converted, and missing required values get their default. Keys the template does not know are
+# left alone, and a fixed value that differs (e.g. another code system) is reported but kept.
+
+class ResourceRejected(ValueError):
+    """Not usable at all: not an object, or a different resourceType."""
+
+_INVALID = object()
+
+def _join(where, key):
+    return f"{where}.{key}" if where else key
+
+def _path(parent, key):
+    """Error path of a value; built only when needed (list items have int keys)."""
+    return f"{parent}[{key}]" if isinstance(key, int) else _join(parent, key)
+
+def _compile(node, path, required, defaults):
+    """check(value, parent, key, errors) for a template node: the normalized value, or _INVALID."""
+    if isinstance(node, dict):
+        fields = []
+        for key, child in node.items():
+            child_path = _join(path, key)
+            fields.append((key, _compile(child, child_path, required, defaults),
+                           child_path in required, _default_factory(child, child_path, defaults)))
+
+        def check_object(value, parent, at, errors):
+            if not isinstance(value, dict):
+                errors.append(f"{_path(parent, at)}: expected object, got {type(value).__name__}")
+                return _INVALID
+            where = _path(parent, at) if at is not None else parent
+            for key, check, key_required, default in fields:
+                item = value.get(key, _INVALID)
+                if item is _INVALID:
+                    if key_required:
+                        if default is None:
+                            errors.append(f"{_join(where, key)}: missing")
+                        else:
+                            value[key] = default()
+                    continue
+                normalized = check(item, where, key, errors)
+                if normalized is _INVALID:
+                    if default is None:
+                        del value[key]
+                    else:
+                        value[key] = default()
+                elif normalized is not item:
+                    value[key] = normalized
+            return value
+        return check_object
+
+    if isinstance(node, list):
+        check_item = _compile(node[0], path, required, defaults) if node else None
+
+        def check_array(value, parent, at, errors):
+            where = _path(parent, at)
+            if isinstance(value, dict):
+                errors.append(f"{where}: expected array, got object")
+                value = [value]
+            elif not isinstance(value, list):
+                errors.append(f"{where}: expected array, got {type(value).__name__}")
+                return _INVALID
+            if check_item is not None:
+                kept = None
+                for i, item in enumerate(value):
+                    normalized = check_item(item, where, i, errors)
+                    if normalized is _INVALID:
+                        if kept is None:
+                            kept = value[:i]
+                    elif kept is not None:
+                        kept.append(normalized)
+                    elif normalized is not item:
+                        value[i] = normalized
+                if kept is not None:
+                    value[:] = kept
+            if not value:
+                errors.append(f"{where}: empty")
+                return _INVALID
+            return value
+        return check_array
+
+    if isinstance(node, bool):
+        def check_bool(value, parent, at, errors):
+            if isinstance(value, bool):
+                return value
+            errors.append(f"{_path(parent, at)}: expected boolean, got {type(value).__name__}")
+            return _INVALID
+        return check_bool
+
+    if isinstance(node, (int, float)):
+        # Bare placeholders load as 0; any number will do
+        def check_number(value, parent, at, errors):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                return value
+            if isinstance(value, str):
+                try:
+                    number = float(value)
+                except ValueError:
+                    pass
+                else:
+                    errors.append(f"{_path(parent, at)}: expected number, got str")
+                    return int(number) if number.is_integer() else number
+            errors.append(f"{_path(parent, at)}: expected number, got {type(value).__name__}")
+            return _INVALID
+        return check_number
+
+    fixed = node if isinstance(node, str) and '<' not in node else None
+
+    def check_string(value, parent, at, errors):
+        if not isinstance(value, str):
+            errors.append(f"{_path(parent, at)}: expected string, got {type(value).__name__}")
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                return _INVALID
+            value = str(value)
+        if fixed is not None and value != fixed:
+            errors.append(f"{_path(parent, at)}: expected {fixed!r}, got {value!r}")
+        return value
+    return check_string
+
+def _default_factory(node, path, defaults):
+    """Function building the default for a template node, or None if it has none.
+
+    A container's default holds the defaults of its descendants, in the template's shape.
+    """
+    if path in defaults:
+        value = defaults[path]
+        return value if callable(value) else functools.partial(copy.deepcopy, value)
+    if isinstance(node, dict):
+        parts = [(key, _default_factory(child, _join(path, key), defaults)) for key, child in node.items()]
+        parts = [(key, factory) for key, factory in parts if factory is not None]
+        if not parts:
+            return None
+        return lambda: {key: factory() for key, factory in parts}
+    if isinstance(node, list) and node:
+        factory = _default_factory(node[0], path, defaults)
+        return (lambda: [factory()]) if factory is not None else None
+    return None
+
+class FHIRValidator:
+    """A fhir_templates/ resource compiled into a normalizing check (see the top of this module).
+
+    Args:
+        name (str): Template name, e.g. 'encounter'
+        required (iterable): Dotted paths that must be present, e.g. 'type.coding.display'
+        defaults (dict, optional): Values (or functions returning one) for missing or unusable paths
+    """
+
+    def __init__(self, name, required=(), defaults=None):
+        template = load_template(name)
+        self.name = name
+        self.resource_type = template.get('resourceType')
+        defaults = dict(defaults or {})
+        # A required path needs its parents too, and a default implies the path is wanted
+        wanted = set()
+        for path in list(required) + list(defaults):
+            parts = path.split('.')
+            wanted.update('.'.join(parts[:i]) for i in range(1, len(parts) + 1))
+        self.required = frozenset(wanted)
+        self._check = _compile(template, '', self.required, defaults)
+
+    def validate(self, resource):
+        """(resource normalized in place, list of 'path: problem' strings).
+        Raises ResourceRejected if it is not an object of this template's resourceType."""
+        if not isinstance(resource, dict):
+            raise ResourceRejected(f"expected a {self.resource_type} object, got {type(resource).__name__}")
+        if resource.get('resourceType') != self.resource_type:
+            raise ResourceRejected(f"expected resourceType {self.resource_type!r}, got {resource.get('resourceType')!r}")
+        errors = []
+        self._check(resource, '', None, errors)
+        return resource, errors
@@ -1,137 +1,349 @@
-import ollama
 from datetime import datetime, timezone
 import json
 import uuid
 import argparse
+import logging
+import time
+from threading import Lock
+from fhir_generators import llm_client, llm_metrics
+from fhir_generators.llm_cache import cached_generation
+from fhir_generators.fhir_schema import resource_schema
+from fhir_generators.json_stream import StreamAborted
 
-# python3 generate_condition.py --llm-model gemma:2b
-# python3 generate_condition.py --llm-model llama3.1:8b
+logger = logging.getLogger(__name__)
 
-def generate_condition(patient_id, llm_model='gemma:2b'):
+# python3 -m fhir_generators.generate_condition --llm-model gemma:2b
+# python3 -m fhir_generators.generate_condition --llm-model llama3.1:8b
+
+# Bump when the prompt changes so cached generations from the old prompt are not replayed
+CONDITION_TEMPLATE_VERSION = 2
+
+def restamp_condition(condition, patient_id):
+    """Bind a recorded Condition to a new patient: fresh id, subject and onset/recorded times."""
+    current_time = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    return _bind_condition(condition, str(uuid.uuid4()), patient_id, current_time)
+
+def generate_condition(patient_id, llm_model='gemma:2b', severity=None):
     """Generate a FHIR Condition resource for a given patient ID.
     
     Args:
         patient_id (str): The ID of the patient this condition is for
         llm_model (str, optional): The Ollama model to use. Defaults to 'llama3:8b'
+        severity (str, optional): Required severity ('Mild', 'Moderate' or 'Severe'); the LLM chooses if None
     
     Returns:
         dict: A FHIR Condition resource, or None if generation fails
     """
-    # Get current time in UTC and format it
-    current_time = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
-    condition_id = str(uuid.uuid4())
+    return cached_generation(
+        llm_model, 'condition', CONDITION_TEMPLATE_VERSION, {'severity': severity} if severity else {},
+        generate=lambda: _generate_condition(patient_id, llm_model, severity),
+        restamp=lambda condition: restamp_condition(condition, patient_id)
+    )
 
-    prompt = f"""Generate a valid FHIR R4 Condition resource that exactly follows this structure:
-    {{
+REQUIRED_FIELDS = [
+    "resourceType", "id", "clinicalStatus", "verificationStatus",
+    "severity", "category", "code", "subject", "note"
+]
+CONDITION_FIELDS = REQUIRED_FIELDS[:-1] + ["onsetDateTime", "recordedDate", "note"]
+
+def condition_schema():
+    """JSON Schema of the Condition the prompts ask for, from fhir_templates/condition.json."""
+    return resource_schema('condition', CONDITION_FIELDS)
+
+# Static part of every Condition prompt. Per-request values (ids, time, severity) go after
+# it, so the model server can reuse the prefix's KV cache from the previous request.
+CONDITION_PROMPT_PREFIX = """Generate valid FHIR R4 Condition resources for emergency department patients. Each Condition must exactly follow this structure:
+    {
         "resourceType": "Condition",
-        "id": "{condition_id}",
-        "clinicalStatus": {{
-            "coding": [{{
+        "id": "<assigned id>",
+        "clinicalStatus": {
+            "coding": [{
                 "system": "http://terminology.hl7.org/CodeSystem/condition-clinical",
                 "code": "active",
                 "display": "Active"
-            }}]
-        }},
-        "verificationStatus": {{
-            "coding": [{{
+            }]
+        },
+        "verificationStatus": {
+            "coding": [{
                 "system": "http://terminology.hl7.org/CodeSystem/condition-ver-status",
                 "code": "confirmed",
                 "display": "Confirmed"
-            }}]
-        }},
-        "severity": {{
-            "coding": [{{
+            }]
+        },
+        "severity": {
+            "coding": [{
                 "system": "http://snomed.info/sct",
                 "code": "<generate valid SNOMED CT severity code only - no other symbols>",
                 "display": "<severity display: mild, moderate, or severe>"
-            }}]
-        }},
-        "category": [{{
-            "coding": [{{
+            }]
+        },
+        "category": [{
+            "coding": [{
                 "system": "http://terminology.hl7.org/CodeSystem/condition-category",
                 "code": "encounter-diagnosis",
                 "display": "Encounter Diagnosis"
-            }}]
-        }}],
-        "code": {{
-            "coding": [{{
+            }]
+        }],
+        "code": {
+            "coding": [{
                 "system": "http://snomed.info/sct",
                 "code": "<generate valid SNOMED CT code - no other symbols>",
                 "display": "<matching SNOMED display name>"
-            }}],
+            }],
             "text": "<human readable condition description>"
-        }},
-        "subject": {{
-            "reference": "Patient/{patient_id}"
-        }},
-        "onsetDateTime": "{current_time}",
-        "recordedDate": "{current_time}",
-        "note": [{{
+        },
+        "subject": {
+            "reference": "Patient/<assigned patient id>"
+        },
+        "onsetDateTime": "<current time>",
+        "recordedDate": "<current time>",
+        "note": [{
             "text": "<detailed clinical notes about the emergency presentation>"
-        }}]
-    }}
+        }]
+    }
 
     Requirements:
     - Use a real SNOMED CT code and matching display name for an emergency condition
     - Use appropriate SNOMED CT severity codes (e.g., 24484000 =Severe, 6736007 =Moderate, 255604002 =Mild)
     - Make the condition text and clinical notes realistic for an emergency presentation
+    - Use exactly the assigned ids, patients and current time given below
     - Return valid FHIR JSON only, no markdown or explanation
+"""
+
+def _severity_requirement(severity):
+    if not severity:
+        return ""
+    return f"\n    The severity must be {severity}, and the condition must be one that typically presents as {severity.lower()}"
+
+def condition_prompt(condition_id, patient_id, current_time, severity=None):
+    """Prompt for one Condition: the static prefix, then this request's values."""
+    return CONDITION_PROMPT_PREFIX + f"""
+    Current time: {current_time}
+    Assigned id: "{condition_id}", subject "Patient/{patient_id}"{_severity_requirement(severity)}
+
+    Return one Condition as a JSON object only."""
+
+def condition_batch_prompt(assignments, current_time, severity=None):
+    """Prompt for len(assignments) Conditions, sharing the single-Condition prefix."""
+    listing = "\n".join(f'    {i}. "id": "{condition_id}", subject "Patient/{patient_id}"'
+                         for i, (condition_id, patient_id) in enumerate(assignments, 1))
+    return CONDITION_PROMPT_PREFIX + f"""
+    Current time: {current_time}
+    Generate {len(assignments)} Conditions, each a different emergency condition, for these assigned ids and patients in this order:
+{listing}{_severity_requirement(severity)}
+
+    Return {{"conditions": [...]}} holding the {len(assignments)} Conditions as a JSON object only."""
 
-    Return the JSON only."""
+def _bind_condition(condition, condition_id, patient_id, current_time):
+    condition['id'] = condition_id
+    condition['subject'] = {'reference': f"Patient/{patient_id}"}
+    condition['onsetDateTime'] = current_time
+    condition['recordedDate'] = current_time
+    return condition
+
+def _validate_condition(condition, on_invalid=None):
+    """Check the resource type and required fields and normalize the note; returns the condition or None.
+
+    on_invalid(category) is called with the failure category when the condition is rejected.
+    """
+    if not isinstance(condition, dict) or condition.get("resourceType") != "Condition":
+        logger.warning("Generated resource is not a Condition")
+        if on_invalid:
+            on_invalid('wrong_resource_type')
+        return None
+
+    missing_fields = [field for field in REQUIRED_FIELDS if field not in condition]
+    if missing_fields:
+        logger.warning("Missing required fields: %s", missing_fields)
+        if on_invalid:
+            on_invalid('missing_fields')
+        return None
+
+    # Ensure note field is properly structured
+    if not isinstance(condition["note"], list):
+        condition["note"] = [{"text": str(condition["note"])}]
+    elif not condition["note"]:
+        condition["note"] = [{"text": "No additional notes"}]
+    elif not isinstance(condition["note"][0], dict) or "text" not in condition["note"][0]:
+        condition["note"][0] = {"text": str(condition["note"][0])}
+
+    return condition
+
+def _generate_condition(patient_id, llm_model, severity=None):
+    """Call the LLM for a new Condition resource (uncached)."""
+    # Get current time in UTC and format it
+    current_time = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    condition_id = str(uuid.uuid4())
+
+    prompt = condition_prompt(condition_id, patient_id, current_time, severity)
 
     try:
-        response = ollama.generate(model=llm_model, prompt=prompt)
-        response_text = response['response']
-        
-        # Add debug logging
-        print(f"Raw LLM response: {response_text}")
-        
-        # Clean up the response text
-        # Remove any markdown code block markers
-        response_text = response_text.replace('```json', '').replace('```', '')
-        
-        # Find the JSON content between curly braces
-        start = response_text.find('{')
-        end = response_text.rfind('}') + 1
-        
-        if start >= 0 and end > start:
-            try:
-                condition = json.loads(response_text[start:end])
-                
-                # Validate required fields
-                required_fields = [
-                    "resourceType", "id", "clinicalStatus", "verificationStatus",
-                    "severity", "category", "code", "subject", "note"
-                ]
-                
-                missing_fields = [field for field in required_fields if field not in condition]
-                if missing_fields:
-                    print(f"Missing required fields: {missing_fields}")
-                    return None
-                
-                # Ensure note field is properly structured
-                if not isinstance(condition["note"], list):
-                    condition["note"] = [{"text": str(condition["note"])}]
-                elif not condition["note"]:
-                    condition["note"] = [{"text": "No additional notes"}]
-                elif "text" not in condition["note"][0]:
-                    condition["note"][0] = {"text": str(condition["note"][0])}
-                
-                return condition
-                
-            except json.JSONDecodeError as e:
-                print(f"Error parsing JSON: {str(e)}")
-                print(f"Invalid JSON content: {response_text[start:end]}")
-                return None
-        else:
-            print("No valid JSON found in response")
-            print(f"Response content: {response_text}")
-            return None
-            
+        condition = _validate_condition(
+            llm_client.generate_json(llm_model, prompt, condition_schema(), generator='condition'),
+            on_invalid=lambda category: llm_metrics.record_invalid(llm_model, 'condition', category))
+        return _bind_condition(condition, condition_id, patient_id, current_time) if condition else None
+    except StreamAborted as e:
+        logger.warning("Discarded Condition generation: %s", e)
+        return None
+    except ValueError as e:
+        logger.warning("Error parsing JSON: %s", e)
+        return None
     except Exception as e:
-        print(f"Error generating Condition resource: {str(e)}")
+        logger.error("Error generating Condition resource: %s", e)
         return None
 
+class AdaptiveBatchSize:
+    """Batch size for multi-item prompts, adapted to the observed latency of each call.
+
+    Grows by one while calls finish well inside target_seconds and most items come back
+    valid; halves when a call overruns the target or fewer than half the items are usable
+    (small models lose track of long arrays before they get slow).
+    """
+
+    def __init__(self, initial=2, minimum=1, maximum=6, target_seconds=60.0):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.target_seconds = target_seconds
+        self._size = min(self.maximum, max(self.minimum, initial))
+        self._lock = Lock()
+        self._metrics = {'calls': 0, 'requested': 0, 'valid': 0, 'avg_call_ms': None, 'avg_item_ms': None}
+
+    @property
+    def size(self):
+        with self._lock:
+            return self._size
+
+    def record(self, requested, valid, elapsed_seconds):
+        """Record one call that asked for `requested` items and got `valid` of them back."""
+        with self._lock:
+            m = self._metrics
+            m['calls'] += 1
+            m['requested'] += requested
+            m['valid'] += valid
+            call_ms = elapsed_seconds * 1000.0
+            m['avg_call_ms'] = round(call_ms if m['avg_call_ms'] is None else 0.8 * m['avg_call_ms'] + 0.2 * call_ms, 1)
+            if valid:
+                item_ms = call_ms / valid
+                m['avg_item_ms'] = round(item_ms if m['avg_item_ms'] is None else 0.8 * m['avg_item_ms'] + 0.2 * item_ms, 1)
+
+            if requested < self._size:
+                return  # A partial batch (re-request) says little about the current size
+            if elapsed_seconds > self.target_seconds or valid * 2 < requested:
+                self._size = max(self.minimum, self._size // 2)
+            elif elapsed_seconds < 0.75 * self.target_seconds and valid == requested:
+                self._size = min(self.maximum, self._size + 1)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._metrics, size=self._size, minimum=self.minimum, maximum=self.maximum,
+                        target_seconds=self.target_seconds)
+
+_batch_sizes = {}
+_batch_settings = {'maximum': 6, 'target_seconds': 60.0}
+_batch_lock = Lock()
+
+def configure_condition_batching(maximum=None, target_seconds=None):
+    """Set the largest batch and the per-call latency target used for new models."""
+    with _batch_lock:
+        if maximum is not None:
+            _batch_settings['maximum'] = max(1, maximum)
+        if target_seconds is not None:
+            _batch_settings['target_seconds'] = target_seconds
+        _batch_sizes.clear()
+
+def condition_batch_size(llm_model):
+    """The current adaptive batch size for llm_model."""
+    with _batch_lock:
+        sizer = _batch_sizes.get(llm_model)
+        if sizer is None:
+            sizer = _batch_sizes[llm_model] = AdaptiveBatchSize(
+                initial=min(2, _batch_settings['maximum']), maximum=_batch_settings['maximum'],
+                target_seconds=_batch_settings['target_seconds'])
+    return sizer
+
+def condition_batch_stats():
+    with _batch_lock:
+        sizers = dict(_batch_sizes)
+    return {model: sizer.stats() for model, sizer in sizers.items()}
+
+def _generate_condition_batch(assignments, llm_model, severity=None):
+    """One LLM call for len(assignments) Conditions; returns {condition_id: condition} for the valid ones.
+
+    assignments is a list of (condition_id, patient_id). Items are matched back by id, or by
+    position when the model drops the id; ids, subjects and times are always re-stamped.
+    """
+    current_time = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    prompt = condition_batch_prompt(assignments, current_time, severity)
+
+    schema = {
+        'type': 'object',
+        'properties': {'conditions': {'type': 'array', 'items': condition_schema(),
+                                      'minItems': len(assignments), 'maxItems': len(assignments)}},
+        'required': ['conditions'],
+        'additionalProperties': False
+    }
+    try:
+        items = llm_client.generate_json(llm_model, prompt, schema, max_chars=8000 * len(assignments),
+                                        generator='condition_batch')['conditions']
+    except StreamAborted as e:
+        items = e.partial  # Keep the Conditions completed before the abort
+    except ValueError as e:
+        logger.warning("Error parsing batch JSON: %s", e)
+        items = []
+
+    patients = dict(assignments)
+    pending = [condition_id for condition_id, _ in assignments]
+    results = {}
+    rejected = []
+    for position, item in enumerate(items):
+        condition = _validate_condition(item, on_invalid=rejected.append)
+        if condition is None:
+            continue
+        condition_id = condition.get('id')
+        if condition_id not in pending:
+            if position >= len(assignments) or assignments[position][0] not in pending:
+                continue
+            condition_id = assignments[position][0]
+        pending.remove(condition_id)
+        results[condition_id] = _bind_condition(condition, condition_id, patients[condition_id], current_time)
+    if rejected and not results:
+        # Counted per call like every other outcome; a partly salvaged batch is a success
+        llm_metrics.record_invalid(llm_model, 'condition_batch', rejected[0])
+    return results
+
+def generate_conditions_batch(patient_ids, llm_model='gemma:2b', severity=None, max_attempts=3):
+    """Generate one FHIR Condition per patient ID with multi-item prompts.
+
+    Asks for up to the model's adaptive batch size per call, keeps the valid items and
+    re-requests only the missing ones, for at most max_attempts rounds. Results are not
+    recorded in the LLM cache (its keys are per single generation).
+
+    Returns:
+        list: A Condition (or None where generation failed) for each patient ID, in order
+    """
+    sizer = condition_batch_size(llm_model)
+    assignments = [(str(uuid.uuid4()), patient_id) for patient_id in patient_ids]
+    results = {}
+    for attempt in range(max_attempts):
+        missing = [a for a in assignments if a[0] not in results]
+        while missing:
+            chunk, missing = missing[:sizer.size], missing[sizer.size:]
+            started = time.monotonic()
+            try:
+                batch = _generate_condition_batch(chunk, llm_model, severity)
+            except llm_client.LLMDeadlineExceeded as e:
+                logger.info("Stopping condition batch: %s", e)
+                return [results.get(condition_id) for condition_id, _ in assignments]
+            except Exception as e:
+                logger.error("Error generating Condition batch: %s", e)
+                batch = {}
+            sizer.record(len(chunk), len(batch), time.monotonic() - started)
+            results.update(batch)
+            logger.info("Condition batch of %d for %s: %d valid (attempt %d)", len(chunk), llm_model, len(batch), attempt + 1)
+        if len(results) == len(assignments):
+            break
+    return [results.get(condition_id) for condition_id, _ in assignments]
+
 if __name__ == '__main__':
     # Set up argument parser
     parser = argparse.ArgumentParser(description='Generate a FHIR Condition resource')
@@ -1,5 +1,8 @@
 from datetime import datetime, timezone
 import json
+from fhir_generators.fhir_template import compile_template
+
+DISCHARGE_TEMPLATE = compile_template('encounter_discharge')
 
 def generate_encounter_discharge(encounter_id, start_time, end_time):
     """Generate a FHIR Encounter discharge resource.
@@ -12,25 +15,7 @@ def generate_encounter_discharge(encounter_id, start_time, end_time):
     Returns:
         dict: A FHIR Encounter discharge resource
     """
-    return {
-        "resourceType": "Encounter",
-        "id": encounter_id,
-        "status": "completed",
-        "hospitalization": {
-            "dischargeDisposition": {
-                "coding": [{
-                    "system": "http://terminology.hl7.org/CodeSystem/discharge-disposition",
-                    "code": "home",
-                    "display": "Discharged to home"
-                }],
-                "text": "Patient discharged to home after treatment"
-            }
-        },
-        "period": {
-            "start": start_time,
-            "end": end_time
-        }
-    }
+    return DISCHARGE_TEMPLATE.fill(encounter_id=encounter_id, encounter_start_date=start_time, encounter_end_date=end_time)
 
 if __name__ == '__main__':
     import argparse
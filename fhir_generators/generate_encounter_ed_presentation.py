@@ -1,177 +1,228 @@
-import ollama
 from datetime import datetime, timezone
 import json
 import uuid
 import argparse
+import logging
+from fhir_generators import llm_client, llm_metrics
+from fhir_generators.llm_cache import cached_generation
+from fhir_generators.fhir_schema import resource_schema
+from fhir_generators.json_stream import StreamAborted
 
-def generate_encounter_ed_presentation(patient_id, condition_id, practitioner_id, organization_id, condition_description=None, llm_model='gemma:2b'):
-    """Generate a FHIR Encounter resource for a given patient and condition.
-    
-    Args:
-        patient_id (str): The ID of the patient this encounter is for
-        condition_id (str): The ID of the related condition
-        practitioner_id (str): The ID of the treating practitioner
-        organization_id (str): The ID of the healthcare organization
-        condition_description (str, optional): Description of patient's condition to inform diagnosis and procedures
-        llm_model (str, optional): The Ollama model to use. Defaults to 'gemma:2b'
-    
-    Returns:
-        dict: A FHIR Encounter resource, or None if generation fails
-    """
-    try:
-        current_time = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
-        encounter_id = str(uuid.uuid4())
-        procedure_id = str(uuid.uuid4())
+logger = logging.getLogger(__name__)
 
-        condition_context = ""
-        if condition_description:
-            condition_context = f"""
-            Patient Condition Context:
-            {condition_description}
-            
-            Use this condition description to:
-            1. Generate appropriate SNOMED codes for the diagnosis
-            2. Select relevant procedures that would be performed for this condition
-            3. Ensure the encounter type and reason codes align with the described condition
-            """
-
-        prompt = f"""Generate a valid FHIR R4 Encounter resource that exactly follows this structure:
-        {condition_context}
-        {{
+# Bump when the prompt changes so cached generations from the old prompt are not replayed
+ENCOUNTER_TEMPLATE_VERSION = 2
+
+REQUIRED_FIELDS = [
+    "resourceType", "id", "status", "class", "type",
+    "subject", "participant", "period", "serviceProvider"
+]
+# Fields of the ED presentation prompt, in prompt order
+ENCOUNTER_FIELDS = [
+    "resourceType", "id", "status", "class", "type", "subject", "participant",
+    "period", "location", "serviceProvider", "reasonCode", "diagnosis", "procedure"
+]
+
+# Static part of every ED presentation prompt; the condition context and ids go after it so
+# the model server can reuse the prefix's KV cache from the previous request.
+ENCOUNTER_PROMPT_PREFIX = """Generate a valid FHIR R4 Encounter resource for an emergency department presentation that exactly follows this structure:
+        {
             "resourceType": "Encounter",
-            "id": "{encounter_id}",
+            "id": "<assigned encounter id>",
             "status": "in-progress",
-            "class": {{
+            "class": {
                 "system": "http://terminology.hl7.org/CodeSystem/v3-ActCode",
                 "code": "EMER",
                 "display": "Emergency"
-            }},
-            "type": [{{
-                "coding": [{{
+            },
+            "type": [{
+                "coding": [{
                     "system": "http://snomed.info/sct",
                     "code": "<generate valid SNOMED CT code for emergency encounter matching the condition>",
                     "display": "<matching SNOMED display name>"
-                }}],
+                }],
                 "text": "<encounter type description>"
-            }}],
-            "subject": {{
-                "reference": "Patient/{patient_id}"
-            }},
-            "participant": [{{
-                "type": [{{
-                    "coding": [{{
+            }],
+            "subject": {
+                "reference": "Patient/<assigned patient id>"
+            },
+            "participant": [{
+                "type": [{
+                    "coding": [{
                         "system": "http://terminology.hl7.org/CodeSystem/v3-ParticipationType",
                         "code": "PPRF",
                         "display": "Primary Performer"
-                    }}]
-                }}],
-                "individual": {{
-                    "reference": "Practitioner/{practitioner_id}",
+                    }]
+                }],
+                "individual": {
+                    "reference": "Practitioner/<assigned practitioner id>",
                     "display": "<generate practitioner name>"
-                }}
-            }}],
-            "period": {{
-                "start": "{current_time}"
-            }},
-            "location": [{{
-                "location": {{
+                }
+            }],
+            "period": {
+                "start": "<current time>"
+            },
+            "location": [{
+                "location": {
                     "reference": "Location/emergency-1",
                     "display": "Emergency Department"
-                }},
+                },
                 "status": "active"
-            }}],
-            "serviceProvider": {{
-                "reference": "Organization/{organization_id}",
+            }],
+            "serviceProvider": {
+                "reference": "Organization/<assigned organization id>",
                 "display": "<generate organization name>"
-            }},
-            "reasonCode": [{{
-                "coding": [{{
+            },
+            "reasonCode": [{
+                "coding": [{
                     "system": "http://snomed.info/sct",
                     "code": "<generate valid SNOMED CT code matching the condition>",
                     "display": "<matching SNOMED display name>"
-                }}],
+                }],
                 "text": "<reason for visit description based on the condition>"
-            }}],
-            "diagnosis": [{{
-                "condition": {{
-                    "reference": "Condition/{condition_id}",
+            }],
+            "diagnosis": [{
+                "condition": {
+                    "reference": "Condition/<assigned condition id>",
                     "display": "<generate condition display name matching the description>"
-                }},
+                },
                 "rank": 1
-            }}],
-            "procedure": [{{
-                "reference": "Procedure/{procedure_id}",
+            }],
+            "procedure": [{
+                "reference": "Procedure/<new procedure id>",
                 "display": "<generate procedure name appropriate for the condition>",
-                "performedDateTime": "{current_time}",
-                "code": {{
-                    "coding": [{{
+                "performedDateTime": "<current time>",
+                "code": {
+                    "coding": [{
                         "system": "http://snomed.info/sct",
                         "code": "<generate valid SNOMED CT code for procedure appropriate for the condition>",
                         "display": "<matching SNOMED display name>"
-                    }}],
+                    }],
                     "text": "<procedure description explaining treatment for the condition>"
-                }}
-            }}]
-        }}
+                }
+            }]
+        }
 
         Requirements:
         - Use real SNOMED CT codes and matching display names that are appropriate for the described condition
         - Make the encounter type, reason, and procedure descriptions realistic and relevant to the condition
         - Generate plausible names for the organization and practitioner
         - Ensure all generated content is medically appropriate for an emergency setting
+        - Use exactly the assigned ids and current time given below
         - Return valid FHIR JSON only, no markdown or explanation
+"""
+
+def encounter_prompt(encounter_id, patient_id, condition_id, practitioner_id, organization_id, current_time, condition_description=None):
+    """Prompt for one ED presentation Encounter: the static prefix, then this request's values."""
+    condition_context = ""
+    if condition_description:
+        condition_context = f"""
+        Patient Condition Context:
+        {condition_description}
+
+        Use this condition description to:
+        1. Generate appropriate SNOMED codes for the diagnosis
+        2. Select relevant procedures that would be performed for this condition
+        3. Ensure the encounter type and reason codes align with the described condition
+"""
+    return ENCOUNTER_PROMPT_PREFIX + f"""{condition_context}
+        Current time: {current_time}
+        Assigned ids: encounter "{encounter_id}", patient "{patient_id}", condition "{condition_id}",
+        practitioner "{practitioner_id}", organization "{organization_id}"
 
         Return the JSON only."""
 
-        print(f"Generating encounter using model: {llm_model}")
-        print(f"Patient condition context: {condition_description}")
-        
-        response = ollama.generate(model=llm_model, prompt=prompt)
-        response_text = response['response']
-        
-        print(f"Raw LLM response: {response_text}")
-        
-        # Clean up the response text
-        response_text = response_text.replace('```json', '').replace('```', '')
-        
-        start = response_text.find('{')
-        end = response_text.rfind('}') + 1
+def encounter_schema():
+    """JSON Schema of the ED presentation Encounter, from fhir_templates/encounter.json."""
+    return resource_schema('encounter', ENCOUNTER_FIELDS, omit=('period.end',))
+
+def _bind_encounter(encounter, encounter_id, patient_id, condition_id, practitioner_id, organization_id, current_time):
+    encounter['id'] = encounter_id
+    encounter['subject'] = {'reference': f"Patient/{patient_id}"}
+    encounter['period'] = {'start': current_time}
+    for participant in encounter.get('participant', []):
+        if isinstance(participant.get('individual'), dict):
+            participant['individual']['reference'] = f"Practitioner/{practitioner_id}"
+    if isinstance(encounter.get('serviceProvider'), dict):
+        encounter['serviceProvider']['reference'] = f"Organization/{organization_id}"
+    for diagnosis in encounter.get('diagnosis', []):
+        if isinstance(diagnosis.get('condition'), dict):
+            diagnosis['condition']['reference'] = f"Condition/{condition_id}"
+    for procedure in encounter.get('procedure', []):
+        if isinstance(procedure, dict):
+            procedure['reference'] = f"Procedure/{uuid.uuid4()}"
+            procedure['performedDateTime'] = current_time
+    return encounter
+
+def restamp_encounter(encounter, patient_id, condition_id, practitioner_id, organization_id):
+    """Bind a recorded ED Encounter to new ids: encounter, patient, condition, practitioner,
+    organization and procedure references, with the period and procedure times set to now.
+    """
+    current_time = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    return _bind_encounter(encounter, str(uuid.uuid4()), patient_id, condition_id, practitioner_id, organization_id, current_time)
+
+def generate_encounter_ed_presentation(patient_id, condition_id, practitioner_id, organization_id, condition_description=None, llm_model='gemma:2b'):
+    """Generate a FHIR Encounter resource for a given patient and condition.
+    
+    Args:
+        patient_id (str): The ID of the patient this encounter is for
+        condition_id (str): The ID of the related condition
+        practitioner_id (str): The ID of the treating practitioner
+        organization_id (str): The ID of the healthcare organization
+        condition_description (str, optional): Description of patient's condition to inform diagnosis and procedures
+        llm_model (str, optional): The Ollama model to use. Defaults to 'gemma:2b'
+    
+    Returns:
+        dict: A FHIR Encounter resource, or None if generation fails
+    """
+    return cached_generation(
+        llm_model, 'encounter_ed_presentation', ENCOUNTER_TEMPLATE_VERSION,
+        {'condition_description': condition_description or ''},
+        generate=lambda: _generate_encounter_ed_presentation(
+            patient_id, condition_id, practitioner_id, organization_id, condition_description, llm_model),
+        restamp=lambda encounter: restamp_encounter(encounter, patient_id, condition_id, practitioner_id, organization_id)
+    )
+
+def _generate_encounter_ed_presentation(patient_id, condition_id, practitioner_id, organization_id, condition_description, llm_model):
+    """Call the LLM for a new ED presentation Encounter resource (uncached)."""
+    try:
+        current_time = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        encounter_id = str(uuid.uuid4())
+
+        prompt = encounter_prompt(encounter_id, patient_id, condition_id, practitioner_id, organization_id,
+                                  current_time, condition_description)
+
+        logger.debug("Generating encounter using model: %s", llm_model)
+        logger.debug("Patient condition context: %s", condition_description)
         
-        if start >= 0 and end > start:
-            try:
-                encounter = json.loads(response_text[start:end])
-                print(f"Successfully parsed encounter JSON: {json.dumps(encounter, indent=2)}")
-                
-                if encounter.get("resourceType") != "Encounter":
-                    print("Generated resource is not an Encounter")
-                    return None
-                
-                # Validate required fields
-                required_fields = [
-                    "resourceType", "id", "status", "class", "type",
-                    "subject", "participant", "period", "serviceProvider"
-                ]
-                
-                missing_fields = [field for field in required_fields if field not in encounter]
-                if missing_fields:
-                    print(f"Missing required fields: {missing_fields}")
-                    return None
-                
-                print(f"Successfully generated encounter with ID: {encounter['id']}")
-                return encounter
-                
-            except json.JSONDecodeError as e:
-                print(f"Error parsing JSON: {str(e)}")
-                print(f"Invalid JSON content: {response_text[start:end]}")
-                return None
-        else:
-            print("No valid JSON found in response")
-            print(f"Response content: {response_text}")
+        try:
+            encounter = llm_client.generate_json(llm_model, prompt, encounter_schema(), generator='encounter_ed_presentation')
+        except StreamAborted as e:
+            logger.warning("Discarded Encounter generation: %s", e)
+            return None
+        except ValueError as e:
+            logger.warning("Error parsing JSON: %s", e)
+            return None
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Successfully parsed encounter JSON: %s", json.dumps(encounter, indent=2))
+
+        if not isinstance(encounter, dict) or encounter.get("resourceType") != "Encounter":
+            logger.warning("Generated resource is not an Encounter")
+            llm_metrics.record_invalid(llm_model, 'encounter_ed_presentation', 'wrong_resource_type')
             return None
+
+        missing_fields = [field for field in REQUIRED_FIELDS if field not in encounter]
+        if missing_fields:
+            logger.warning("Missing required fields: %s", missing_fields)
+            llm_metrics.record_invalid(llm_model, 'encounter_ed_presentation', 'missing_fields')
+            return None
+
+        _bind_encounter(encounter, encounter_id, patient_id, condition_id, practitioner_id, organization_id, current_time)
+        logger.debug("Successfully generated encounter with ID: %s", encounter['id'])
+        return encounter
             
     except Exception as e:
-        print(f"Error generating Encounter resource: {str(e)}")
-        print(f"Full traceback:", exc_info=True)
+        logger.error("Error generating Encounter resource: %s", e, exc_info=True)
         return None
 
 if __name__ == '__main__':
@@ -1,8 +1,11 @@
-import ollama
 import random
 from datetime import datetime, timezone
 import json
 import uuid
+import logging
+from fhir_generators import llm_client
+
+logger = logging.getLogger(__name__)
 
 def generate_fhir_resources(patient_guid=None):
     """Generate FHIR resources for a patient and their condition."""
@@ -38,7 +41,7 @@ def generate_fhir_resources(patient_guid=None):
     Return valid FHIR JSON only."""
 
     try:
-        response = ollama.generate(model='gemma:2b', prompt=prompt)
+        response = llm_client.generate(model='gemma:2b', prompt=prompt, generator='patient')
         
         # Extract just the JSON content from the response
         response_text = response['response']
@@ -65,7 +68,7 @@ def generate_fhir_resources(patient_guid=None):
         return bundle if bundle["entry"] else None
         
     except Exception as e:
-        print(f"Error generating FHIR resources: {str(e)}")
+        logger.error("Error generating FHIR resources: %s", e)
         return None
 
 if __name__ == '__main__':
@@ -2,24 +2,31 @@ import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 import logging
-from threading import Lock
-import random
+from threading import Condition, Lock, Thread
+import time
 import uuid
 import os
 import json
 from datetime import datetime
 from collections import deque
+import itertools
+import numpy as np
+from fhir_generators.synthea_pool import PatientPool
+from fhir_generators.circuit_breaker import CircuitBreaker, CLOSED, HALF_OPEN
 
-# Prefetch buffer for batched patients
-_prefetch_queue = deque()
-_prefetch_lock = Lock()
+logger = logging.getLogger(__name__)
 
-# Default prefetch size (can be overridden via AMBOSIM_SYNTHEA_PREFETCH env var)
-def _get_prefetch_size():
+SYNTHEA_URL = os.getenv('AMBOSIM_SYNTHEA_URL', 'http://localhost:5001')
+
+def _env_int(name, default):
     try:
-        return max(1, int(os.getenv('AMBOSIM_SYNTHEA_PREFETCH', '10')))
+        return max(1, int(os.getenv(name, str(default))))
     except Exception:
-        return 10
+        return default
+
+# Default prefetch size (can be overridden via AMBOSIM_SYNTHEA_PREFETCH env var)
+def _get_prefetch_size():
+    return _env_int('AMBOSIM_SYNTHEA_PREFETCH', 10)
 
 # Create a session with connection pooling and retry strategy
 def create_session():
@@ -38,69 +45,298 @@ def create_session():
     session.mount('https://', adapter)
     return session
 
-# Add a lock for the API call
-api_call_lock = Lock()
+class SyntheaClient:
+    """Long-lived client for the Synthea API; reuses one pooled requests.Session."""
 
-def generate_fallback_patient(session_dir=None):
-    """Generate a basic patient with minimal FHIR resources."""
-    # Generate patient ID first to use its number for name suffixes
-    patient_number = random.randint(1000, 9999)
-    patient_id = f"pat-{patient_number}"
-    
-    # Separate lists for male and female given names
-    male_given_names = ['John', 'Bob', 'Charlie', 'Michael', 'David', 'Chris', 'Daniel', 'James', 'Matthew', 'Andrew']
-    female_given_names = ['Jane', 'Alice', 'Emily', 'Sarah', 'Laura', 'Jessica', 'Emma', 'Olivia', 'Sophia', 'Isabella']
-    family_names = ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez', 'Martinez',
-                    'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore', 'Jackson', 'Martin']
-    
-    # Randomly select gender
-    gender = random.choice(['male', 'female'])
-    
-    # Choose given name based on gender
-    if gender == 'male':
-        given_name = random.choice(male_given_names) + str(patient_number)
-    else:
-        given_name = random.choice(female_given_names) + str(patient_number)
-    
-    family_name = random.choice(family_names) + str(patient_number)
-    
-    # Generate random birthdate for someone over 18
+    def __init__(self, base_url=SYNTHEA_URL, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = create_session()
+        self.probe_session = requests.Session()  # No retries: health probes should fail fast
+
+    def fetch_batch(self, batch_size, probe=False):
+        """POST /generate_patient_bundle and return a list of patient bundles."""
+        session = self.probe_session if probe else self.session
+        response = session.post(
+            f'{self.base_url}/generate_patient_bundle?batch_size={batch_size}',
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        payload = response.json()
+
+        # Normalize payloads: single vs batch
+        results = []
+        if isinstance(payload, dict) and 'results' in payload:
+            results = payload.get('results', [])
+        elif isinstance(payload, dict) and 'patient' in payload:
+            results = [payload]
+
+        if not results:
+            raise requests.exceptions.RequestException('Empty results from Synthea batch request')
+        return results
+
+    def close(self):
+        self.session.close()
+        self.probe_session.close()
+
+class SyntheaPrefetcher:
+    """Background worker that keeps a buffer of Synthea patients between two watermarks.
+
+    When the buffer drops below low_watermark the worker fetches batches until it reaches
+    high_watermark. take() never touches the network: it returns a buffered patient or None.
+
+    Fetches go through a circuit breaker. While it is open no batches are requested; every
+    reset_timeout the worker sends a single-patient probe without retries, and the circuit
+    closes as soon as one succeeds.
+    """
+
+    def __init__(self, client, batch_size=10, low_watermark=None, high_watermark=None, breaker=None, retry_delay=1.0, on_batch=None):
+        self.client = client
+        self.on_batch = on_batch  # Called with every fetched batch, e.g. PatientPool.extend
+        self.batch_size = batch_size
+        self.low_watermark = low_watermark if low_watermark is not None else batch_size
+        self.high_watermark = max(self.low_watermark + 1, high_watermark if high_watermark is not None else 2 * batch_size)
+        self.breaker = breaker or CircuitBreaker('synthea')
+        self.retry_delay = retry_delay  # Pause between failed fetches while the circuit is still closed
+        self._queue = deque()
+        self._cond = Condition()
+        self._running = False
+        self._thread = None
+        self._metrics = {
+            'fetches': 0,
+            'fetch_failures': 0,
+            'patients_fetched': 0,
+            'served': 0,
+            'misses': 0,
+            'last_fetch_ms': None,
+            'avg_fetch_ms': None,
+            'max_fetch_ms': None
+        }
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = Thread(target=self._run, name='synthea-prefetch', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+    def take(self):
+        """Pop a prefetched patient bundle, or return None immediately if the buffer is empty."""
+        with self._cond:
+            item = self._queue.popleft() if self._queue else None
+            self._metrics['served' if item is not None else 'misses'] += 1
+            if len(self._queue) < self.low_watermark:
+                self._cond.notify()
+            return item
+
+    def depth(self):
+        with self._cond:
+            return len(self._queue)
+
+    def metrics(self):
+        with self._cond:
+            metrics = dict(self._metrics, queue_depth=len(self._queue),
+                           low_watermark=self.low_watermark, high_watermark=self.high_watermark)
+        metrics['breaker'] = self.breaker.stats()
+        return metrics
+
+    def _run(self):
+        filling = False
+        while True:
+            with self._cond:
+                while True:
+                    if not self._running:
+                        return
+                    depth = len(self._queue)
+                    if depth < self.low_watermark:
+                        filling = True
+                    elif depth >= self.high_watermark:
+                        filling = False
+                    # Keep probing while the circuit is not closed, even with a full buffer
+                    if filling or self.breaker.state != CLOSED:
+                        break
+                    self._cond.wait()
+
+            if not self.breaker.allow_request():
+                with self._cond:
+                    self._cond.wait(max(0.1, self.breaker.retry_after()))
+                continue
+
+            probing = self.breaker.state == HALF_OPEN
+            started = time.monotonic()
+            try:
+                results = self.client.fetch_batch(1 if probing else self.batch_size, probe=probing)
+            except Exception as e:
+                self._record_fetch(started, 0, failed=True)
+                logger.warning("Synthea %s failed: %s", 'probe' if probing else 'prefetch', e)
+                self.breaker.record_failure()
+                if self.breaker.state == CLOSED:
+                    with self._cond:
+                        self._cond.wait(self.retry_delay)
+                continue
+            self.breaker.record_success()
+            with self._cond:
+                self._queue.extend(results)
+            self._record_fetch(started, len(results))
+            if self.on_batch:
+                try:
+                    self.on_batch(results)
+                except Exception as e:
+                    logger.error("Error caching Synthea batch: %s", e)
+            logger.debug("Prefetched %d Synthea patients (depth=%d)", len(results), self.depth())
+
+    def _record_fetch(self, started, count, failed=False):
+        elapsed_ms = (time.monotonic() - started) * 1000.0
+        with self._cond:
+            m = self._metrics
+            if failed:
+                m['fetch_failures'] += 1
+                return
+            m['fetches'] += 1
+            m['patients_fetched'] += count
+            m['last_fetch_ms'] = round(elapsed_ms, 1)
+            m['avg_fetch_ms'] = round(elapsed_ms if m['avg_fetch_ms'] is None else 0.8 * m['avg_fetch_ms'] + 0.2 * elapsed_ms, 1)
+            m['max_fetch_ms'] = round(max(elapsed_ms, m['max_fetch_ms'] or 0.0), 1)
+
+_prefetcher = None
+_prefetcher_lock = Lock()
+
+# Local patient pool (see synthea_pool.py); AMBOSIM_SYNTHEA_POOL sets the default path
+_patient_pool = None
+_pool_offline = False
+_pool_served = 0
+
+def configure_patient_pool(path=None, offline=False, seed=None):
+    """Use a local NDJSON patient pool.
+
+    API responses are appended to the pool as they arrive, and the pool is sampled when
+    the prefetch buffer is empty. With offline=True the Synthea API is not used at all.
+    seed makes the sampled patients (and their ids) the same on every run.
+    Call before the first patient is generated.
+    """
+    global _patient_pool, _pool_offline
+    path = path or os.getenv('AMBOSIM_SYNTHEA_POOL')
+    _patient_pool = PatientPool(path, seed=seed) if path else None
+    _pool_offline = bool(offline and _patient_pool is not None)
+    if _patient_pool is not None:
+        logger.info("Using Synthea patient pool %s (%d patients%s)", path, len(_patient_pool), ', offline' if _pool_offline else '')
+    return _patient_pool
+
+def get_prefetcher():
+    """Shared prefetcher, started on first use.
+
+    Watermarks default to one and two batches and can be set with
+    AMBOSIM_SYNTHEA_LOW_WATERMARK / AMBOSIM_SYNTHEA_HIGH_WATERMARK. The circuit opens after
+    AMBOSIM_SYNTHEA_FAILURE_THRESHOLD consecutive failures and is probed every
+    AMBOSIM_SYNTHEA_RESET_TIMEOUT seconds.
+    """
+    global _prefetcher
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            batch_size = _get_prefetch_size()
+            _prefetcher = SyntheaPrefetcher(
+                SyntheaClient(),
+                batch_size=batch_size,
+                low_watermark=_env_int('AMBOSIM_SYNTHEA_LOW_WATERMARK', batch_size),
+                high_watermark=_env_int('AMBOSIM_SYNTHEA_HIGH_WATERMARK', 2 * batch_size),
+                breaker=CircuitBreaker(
+                    'synthea',
+                    failure_threshold=_env_int('AMBOSIM_SYNTHEA_FAILURE_THRESHOLD', 3),
+                    reset_timeout=_env_int('AMBOSIM_SYNTHEA_RESET_TIMEOUT', 10)
+                ),
+                on_batch=_patient_pool.extend if _patient_pool is not None else None
+            )
+            _prefetcher.start()
+        return _prefetcher
+
+def start_prefetcher():
+    """Start filling the prefetch buffer now (no-op when running offline from the pool)."""
+    return None if _pool_offline else get_prefetcher()
+
+def synthea_metrics():
+    """Queue depth and fetch latency of the shared prefetcher, plus pool usage."""
+    metrics = {} if _pool_offline else get_prefetcher().metrics()
+    if _patient_pool is not None:
+        metrics.update(pool_size=len(_patient_pool), pool_served=_pool_served, offline=_pool_offline)
+    return metrics
+
+# Name lists for fallback patients (built once, sampled with NumPy)
+MALE_GIVEN_NAMES = np.array(['John', 'Bob', 'Charlie', 'Michael', 'David', 'Chris', 'Daniel', 'James', 'Matthew', 'Andrew'])
+FEMALE_GIVEN_NAMES = np.array(['Jane', 'Alice', 'Emily', 'Sarah', 'Laura', 'Jessica', 'Emma', 'Olivia', 'Sophia', 'Isabella'])
+FAMILY_NAMES = np.array(['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez', 'Martinez',
+                         'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore', 'Jackson', 'Martin'])
+
+# Fallback ids are pat-<session prefix>-<sequence>: unique within a run and across runs
+FALLBACK_SESSION_PREFIX = uuid.uuid4().hex[:8]
+FALLBACK_BUFFER_SIZE = 256  # Patients generated per batch for generate_fallback_patient
+
+_fallback_sequence = itertools.count(1)
+_fallback_buffer = deque()
+_fallback_lock = Lock()
+_rng = np.random.default_rng()
+
+def generate_fallback_patients(n, rng=None):
+    """Generate n basic FHIR Patient resources at once.
+
+    Gender, names and birth dates (18 to 80 years old) are sampled as NumPy arrays; ids
+    come from a per-process session prefix and a monotonic sequence, so they never collide.
+    """
+    rng = rng or _rng
     current_year = datetime.now().year
-    year = random.randint(current_year - 80, current_year - 18)  # Between 18 and 80 years old
-    month = random.randint(1, 12)
-    # Handle different days per month
-    if month in [4, 6, 9, 11]:
-        day = random.randint(1, 30)
-    elif month == 2:
-        # Handle leap years
-        if year % 4 == 0 and (year % 100 != 0 or year % 400 == 0):
-            day = random.randint(1, 29)
-        else:
-            day = random.randint(1, 28)
-    else:
-        day = random.randint(1, 31)
-    
-    # Format date as YYYY-MM-DD
-    birthDate = f"{year}-{month:02d}-{day:02d}"
-    
-    # Create FHIR patient resource
-    fhir_patient = {
-        'resourceType': 'Patient',
-        'id': patient_id,
-        'name': [{
-            'given': [given_name],
-            'family': family_name
-        }],
-        'birthDate': birthDate,  # Use the random birthdate
-        'gender': gender,  # Add gender element
-        'identifier': [  # Add identifier element
-            {
-                'system': 'ambosim/fallback',
-                'value': patient_id
-            }
-        ]
-    }
-    
+    earliest = np.datetime64(f'{current_year - 80}-01-01')
+    span_days = int((np.datetime64(f'{current_year - 18}-12-31') - earliest).astype(int)) + 1
+
+    # NumPy generators are not thread-safe; sampling a batch is cheap enough to do under the lock
+    with _fallback_lock:
+        sequence = [next(_fallback_sequence) for _ in range(n)]
+        is_male = rng.random(n) < 0.5
+        given = np.where(
+            is_male,
+            MALE_GIVEN_NAMES[rng.integers(0, len(MALE_GIVEN_NAMES), n)],
+            FEMALE_GIVEN_NAMES[rng.integers(0, len(FEMALE_GIVEN_NAMES), n)]
+        )
+        family = FAMILY_NAMES[rng.integers(0, len(FAMILY_NAMES), n)]
+        birth_offsets = rng.integers(0, span_days, n)
+    birth_dates = np.datetime_as_string(earliest + birth_offsets.astype('timedelta64[D]'), unit='D')
+
+    patients = []
+    for seq, male, given_name, family_name, birth_date in zip(sequence, is_male, given.tolist(), family.tolist(), birth_dates.tolist()):
+        patient_id = f"pat-{FALLBACK_SESSION_PREFIX}-{seq}"
+        patients.append({
+            'resourceType': 'Patient',
+            'id': patient_id,
+            'name': [{
+                'given': [f"{given_name}{seq}"],
+                'family': f"{family_name}{seq}"
+            }],
+            'birthDate': birth_date,
+            'gender': 'male' if male else 'female',
+            'identifier': [
+                {
+                    'system': 'ambosim/fallback',
+                    'value': patient_id
+                }
+            ]
+        })
+    return patients
+
+def generate_fallback_patient(session_dir=None):
+    """Generate a basic patient with minimal FHIR resources (served from a pre-generated buffer)."""
+    with _fallback_lock:
+        fhir_patient = _fallback_buffer.popleft() if _fallback_buffer else None
+    if fhir_patient is None:
+        batch = generate_fallback_patients(FALLBACK_BUFFER_SIZE)
+        fhir_patient = batch.pop(0)
+        with _fallback_lock:
+            _fallback_buffer.extend(batch)
+    patient_id = fhir_patient['id']
+
     # If session_dir is provided, save the FHIR resource
     if session_dir:
         try:
@@ -112,7 +348,7 @@ def generate_fallback_patient(session_dir=None):
             with open(filepath, 'w') as f:
                 json.dump(fhir_patient, f, indent=2)
         except Exception as e:
-            logging.error(f"Error saving FHIR patient resource: {str(e)}")
+            logger.error("Error saving FHIR patient resource: %s", e)
     
     return {
         'patient': fhir_patient,
@@ -122,67 +358,35 @@ def generate_fallback_patient(session_dir=None):
     }
 
 def generate_fhir_resources(session_dir=None):
-    """Thread-safe function to generate FHIR resources using Synthea API."""
-    session = create_session()
+    """Thread-safe function to get a Synthea patient without waiting on the network.
 
-    # Only create output_dir if session_dir is provided
-    output_dir = session_dir if session_dir else None
+    Serves a patient from the background prefetch buffer, then from the local patient
+    pool; if neither has one the fallback patient is returned immediately.
+    """
+    global _pool_served
+    patient_data = None if _pool_offline else get_prefetcher().take()
+    if patient_data is None and _patient_pool is not None:
+        patient_data = _patient_pool.sample()
+        if patient_data is not None:
+            with _prefetcher_lock:
+                _pool_served += 1
+    if patient_data is None:
+        logger.info("No Synthea patient buffered; using fallback patient generation")
+        return generate_fallback_patient(session_dir)
 
-    try:
-        # Try to serve from prefetch queue first
-        with _prefetch_lock:
-            if _prefetch_queue:
-                bundled = _prefetch_queue.popleft()
-                patient_data = bundled
-            else:
-                patient_data = None
-
-        if patient_data is None:
-            with api_call_lock:
-                batch_size = _get_prefetch_size()
-                logging.info(f"Prefetching Synthea batch: size={batch_size} (session_dir={session_dir})")
-                response = session.post(
-                    f'http://localhost:5001/generate_patient_bundle?batch_size={batch_size}'
-                )
-                response.raise_for_status()
-                payload = response.json()
-
-                # Normalize payloads: single vs batch
-                results = []
-                if isinstance(payload, dict) and 'results' in payload:
-                    results = payload.get('results', [])
-                elif isinstance(payload, dict) and 'patient' in payload:
-                    results = [payload]
-
-                if not results:
-                    raise requests.exceptions.RequestException('Empty results from Synthea batch request')
-
-                # Take one for immediate return; enqueue the rest
-                patient_data = results[0]
-                if len(results) > 1:
-                    with _prefetch_lock:
-                        for item in results[1:]:
-                            _prefetch_queue.append(item)
-
-        # Save the FHIR patient resource if session_dir is provided (only for the one we return)
-        if session_dir and patient_data and 'patient' in patient_data:
-            try:
-                patient_dir = os.path.join(session_dir, 'patient')
-                os.makedirs(patient_dir, exist_ok=True)
-
-                patient_id = patient_data['patient']['id']
-                filename = f"patient_{patient_id}.json"
-                filepath = os.path.join(patient_dir, filename)
-                with open(filepath, 'w') as f:
-                    json.dump(patient_data['patient'], f, indent=2)
-                logging.info(f"Successfully saved patient {patient_id} to {filepath}")
-            except Exception as e:
-                logging.error(f"Error saving FHIR patient resource: {str(e)}")
-
-        return patient_data
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Error generating FHIR resources: {str(e)}")
-        logging.info("Using fallback patient generation")
-        return generate_fallback_patient(output_dir)
-    finally:
-        session.close()
\ No newline at end of file
+    # Save the FHIR patient resource if session_dir is provided (only for the one we return)
+    if session_dir and 'patient' in patient_data:
+        try:
+            patient_dir = os.path.join(session_dir, 'patient')
+            os.makedirs(patient_dir, exist_ok=True)
+
+            patient_id = patient_data['patient']['id']
+            filename = f"patient_{patient_id}.json"
+            filepath = os.path.join(patient_dir, filename)
+            with open(filepath, 'w') as f:
+                json.dump(patient_data['patient'], f, indent=2)
+            logger.info("Successfully saved patient %s to %s", patient_id, filepath)
+        except Exception as e:
+            logger.error("Error saving FHIR patient resource: %s", e)
+
+    return patient_data
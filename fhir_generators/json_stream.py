@@ -0,0 +1,214 @@
+import json
+
+_WHITESPACE = ' \t\r\n'
+_KINDS = {'{': 'object', '[': 'array', '"': 'string', 't': 'boolean', 'f': 'boolean', 'n': 'null'}
+_COMPATIBLE = {'integer': ('number',), 'number': ('number',)}
+
+class StreamAborted(ValueError):
+    """Raised by StreamingJSONParser.feed when the streamed JSON cannot become a valid document.
+
+    partial holds the complete items of the first array in the document received before the
+    abort (e.g. the first conditions of {"conditions": [...]}), so batched callers can keep them.
+    """
+
+    def __init__(self, reason, partial=None):
+        super().__init__(reason)
+        self.partial = partial or []
+
+class StreamIncomplete(StreamAborted):
+    """The stream ended (e.g. at the token limit) before the document was complete."""
+
+class _Frame:
+    __slots__ = ('kind', 'schema', 'state', 'key', 'seen', 'start')
+
+    def __init__(self, kind, schema, start):
+        self.kind = kind
+        self.schema = schema or {}
+        self.state = 'first'  # first, key, colon, value, next
+        self.key = None
+        self.seen = set()
+        self.start = start
+
+class StreamingJSONParser:
+    """Incremental structural check of a JSON document arriving in chunks.
+
+    feed() returns True as soon as the top-level value is complete (anything after it is
+    ignored, so the caller can stop the stream) and raises StreamAborted as soon as the
+    text can no longer match the schema: prose instead of JSON, an unexpected key, a value
+    of the wrong kind, a string outside its enum, a missing required key when an object
+    closes, or more than max_chars of output. Only structure is checked on the fly; value()
+    parses the finished document with json.loads.
+    """
+
+    def __init__(self, schema=None, max_chars=20000, max_preamble=200):
+        self.schema = schema or {}
+        self.max_chars = max_chars
+        self.max_preamble = max_preamble
+        self.done = False
+        self._buf = []
+        self._pos = 0  # Characters consumed, including the preamble
+        self._begin = None  # Offset of the top-level value in the text
+        self._stack = []
+        self._string = None  # (role, chars, enum) while inside a string
+        self._escape = False
+        self._scalar = False  # Inside a number or literal
+        self._outer = None  # The first array opened
+        self._items = []  # (start, end) of complete items of that array
+
+    def feed(self, chunk):
+        for ch in chunk:
+            if self.done:
+                break
+            self._buf.append(ch)
+            self._consume(ch)
+            self._pos += 1
+            if self._pos > self.max_chars:
+                self._abort(f"Output exceeded {self.max_chars} characters")
+        return self.done
+
+    def text(self):
+        if self._begin is None:
+            return ''
+        return ''.join(self._buf[self._begin:self._pos])
+
+    def value(self):
+        """The parsed document (raises ValueError if it is not complete)."""
+        if not self.done:
+            raise StreamIncomplete("Stream ended before the JSON document was complete", self.partial())
+        return json.loads(self.text())
+
+    def partial(self):
+        """Complete items of the first array in the document received so far, parsed."""
+        items = []
+        for start, end in self._items:
+            try:
+                items.append(json.loads(''.join(self._buf[start:end])))
+            except ValueError:
+                pass
+        return items
+
+    def _abort(self, reason):
+        raise StreamAborted(reason, self.partial())
+
+    def _consume(self, ch):
+        if self._string is not None:
+            self._consume_string(ch)
+            return
+        if self._scalar:
+            if ch not in _WHITESPACE and ch not in ',]}':
+                return
+            self._scalar = False
+            self._end_value()
+        if ch in _WHITESPACE:
+            return
+
+        if not self._stack:
+            if self._begin is None:
+                expected = '[' if self.schema.get('type') == 'array' else '{'
+                if ch == expected:
+                    self._begin = self._pos
+                    self._stack.append(_Frame(_KINDS[ch], self.schema, self._pos))
+                elif self._pos >= self.max_preamble:
+                    self._abort(f"No JSON {_KINDS[expected]} in the first {self.max_preamble} characters")
+            return
+
+        frame = self._stack[-1]
+        if frame.kind == 'object':
+            if frame.state in ('first', 'key'):
+                if ch == '"':
+                    self._string = ('key', [], None)
+                elif ch == '}' and frame.state == 'first':
+                    self._close(frame)
+                else:
+                    self._abort(f"Expected a key, got {ch!r}")
+            elif frame.state == 'colon':
+                if ch != ':':
+                    self._abort(f"Expected ':' after {frame.key!r}, got {ch!r}")
+                frame.state = 'value'
+            elif frame.state == 'value':
+                properties = frame.schema.get('properties', {})
+                self._start_value(ch, properties.get(frame.key))
+            else:
+                if ch == ',':
+                    frame.state = 'key'
+                elif ch == '}':
+                    self._close(frame)
+                else:
+                    self._abort(f"Expected ',' or '}}' after {frame.key!r}, got {ch!r}")
+        else:
+            if frame.state in ('first', 'value'):
+                if ch == ']' and frame.state == 'first':
+                    self._close(frame)
+                else:
+                    self._start_value(ch, frame.schema.get('items'))
+            else:
+                if ch == ',':
+                    frame.state = 'value'
+                elif ch == ']':
+                    self._close(frame)
+                else:
+                    self._abort(f"Expected ',' or ']', got {ch!r}")
+
+    def _consume_string(self, ch):
+        role, chars, enum = self._string
+        if self._escape:
+            self._escape = False
+            chars.append(ch)
+            return
+        if ch == '\\':
+            self._escape = True
+            return
+        if ch != '"':
+            chars.append(ch)
+            if enum is not None:
+                prefix = ''.join(chars)
+                if not any(option.startswith(prefix) for option in enum):
+                    self._abort(f"{prefix!r} is not one of {enum}")
+            return
+
+        self._string = None
+        value = ''.join(chars)
+        if role == 'key':
+            frame = self._stack[-1]
+            properties = frame.schema.get('properties')
+            if properties is not None and frame.schema.get('additionalProperties') is False and value not in properties:
+                self._abort(f"Unexpected key {value!r}")
+            frame.key = value
+            frame.seen.add(value)
+            frame.state = 'colon'
+        else:
+            if enum is not None and value not in enum:
+                self._abort(f"{value!r} is not one of {enum}")
+            self._end_value()
+
+    def _start_value(self, ch, schema):
+        kind = _KINDS.get(ch, 'number' if ch == '-' or ch.isdigit() else None)
+        if kind is None:
+            self._abort(f"Unexpected {ch!r} where a value should start")
+        expected = (schema or {}).get('type')
+        if expected and kind != expected and kind not in _COMPATIBLE.get(expected, ()):
+            self._abort(f"Expected {expected}, got {kind}")
+        if kind in ('object', 'array'):
+            self._stack.append(_Frame(kind, schema, self._pos))
+            if kind == 'array' and self._outer is None:
+                self._outer = self._stack[-1]
+        elif kind == 'string':
+            self._string = ('value', [], (schema or {}).get('enum'))
+        else:
+            self._scalar = True
+
+    def _close(self, frame):
+        if frame.kind == 'object':
+            missing = [key for key in frame.schema.get('required', []) if key not in frame.seen]
+            if missing:
+                self._abort(f"Object closed without {missing}")
+        self._stack.pop()
+        if self._stack and self._stack[-1] is self._outer:
+            self._items.append((frame.start, self._pos + 1))
+        self._end_value()
+
+    def _end_value(self):
+        if self._stack:
+            self._stack[-1].state = 'next'
+        else:
+            self.done = True
@@ -0,0 +1,247 @@
+import argparse
+import copy
+import hashlib
+import json
+import logging
+import os
+import random
+from collections import OrderedDict
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+# python3 -m fhir_generators.llm_cache stats --dir llm_cache
+# python3 -m fhir_generators.llm_cache prune --dir llm_cache --max-entries 1000
+
+MODES = ('off', 'record', 'replay', 'record_on_miss')
+
+def normalize_inputs(inputs):
+    """Canonical form of prompt inputs: strings are lower-cased with whitespace collapsed."""
+    normalized = {}
+    for name, value in (inputs or {}).items():
+        if isinstance(value, str):
+            value = ' '.join(value.split()).lower()
+        normalized[name] = value
+    return normalized
+
+def cache_key(model, template, version, inputs):
+    """Content address of a generation: sha256 of (model, template, template version, normalized inputs).
+
+    Ids and timestamps must not be part of inputs; they are re-stamped on replay.
+    """
+    material = json.dumps({
+        'model': model,
+        'template': template,
+        'version': version,
+        'inputs': normalize_inputs(inputs)
+    }, sort_keys=True)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+class LLMCache:
+    """On-disk cassette of LLM generations, one JSON file per key holding several variants.
+
+    Modes:
+      record          always call the LLM and add the output as a variant
+      replay          only serve recorded outputs; a miss returns None (callers fall back)
+      record_on_miss  serve a recorded variant once a key has variants_per_key of them,
+                      otherwise call the LLM and record the output
+
+    Each generation is assigned one of `slots` keys per input, so the same inputs (e.g. every
+    condition of one severity) are served from up to slots * variants_per_key recorded outputs
+    rather than variants_per_key. Replay chooses among the slots recorded for the inputs (replay
+    with the `slots` used for recording). Slots and replayed variants are drawn from a
+    random.Random seeded with `seed`, so a seeded run replays the same outputs in the same order.
+
+    Entries are evicted least-recently-used first when there are more than max_entries
+    files or they use more than max_bytes on disk.
+    """
+
+    def __init__(self, directory, mode='record_on_miss', variants_per_key=3, max_entries=5000, max_bytes=200 * 1024 * 1024,
+                 slots=32, seed=None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown LLM cache mode {mode!r} (expected one of {', '.join(MODES)})")
+        self.directory = directory
+        self.mode = mode
+        self.variants_per_key = max(1, variants_per_key)
+        self.slots = max(1, slots)
+        self._rng = random.Random(seed)
+        self._replaying = set()  # (model, template) already reported as replaying
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = Lock()
+        self._entries = OrderedDict()  # key -> size in bytes, least recently used first
+        self._total_bytes = 0
+        self._stats = {'hits': 0, 'misses': 0, 'recorded': 0, 'evicted': 0}
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _load(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                path = os.path.join(self.directory, name)
+                stat = os.stat(path)
+                files.append((stat.st_mtime, name[:-5], stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._total_bytes += size
+
+    def _read(self, key):
+        try:
+            with open(self._path(key), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("Discarding unreadable LLM cache entry %s: %s", key, e)
+            self._remove(key)
+            return None
+
+    def _remove(self, key):
+        size = self._entries.pop(key, 0)
+        self._total_bytes -= size
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _touch(self, key):
+        self._entries.move_to_end(key)
+        try:
+            os.utime(self._path(key))  # Persist recency for the next run
+        except OSError:
+            pass
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes):
+            key = next(iter(self._entries))
+            self._remove(key)
+            self._stats['evicted'] += 1
+
+    def lookup(self, key):
+        """A deep copy of a random recorded variant for key, or None."""
+        with self._lock:
+            if key not in self._entries:
+                return None
+            entry = self._read(key)
+            if not entry or not entry.get('variants'):
+                return None
+            self._touch(key)
+            return copy.deepcopy(self._rng.choice(entry['variants']))
+
+    def variant_count(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return 0
+            entry = self._read(key)
+            return len(entry.get('variants', [])) if entry else 0
+
+    def store(self, key, output, model=None, template=None, version=None, inputs=None):
+        """Add output as a variant of key (the oldest variant is dropped beyond variants_per_key)."""
+        with self._lock:
+            entry = self._read(key) if key in self._entries else None
+            if not entry:
+                entry = {'model': model, 'template': template, 'version': version,
+                         'inputs': normalize_inputs(inputs), 'variants': []}
+            entry['variants'] = (entry['variants'] + [output])[-self.variants_per_key:]
+            data = json.dumps(entry).encode('utf-8')
+            tmp_path = self._path(key) + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+            self._total_bytes += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._stats['recorded'] += 1
+            self._evict()
+
+    def _recorded_keys(self, model, template, version, inputs):
+        """Keys of the slots already recorded for inputs."""
+        keys = [cache_key(model, template, version, dict(inputs, slot=slot)) for slot in range(self.slots)]
+        with self._lock:
+            return [key for key in keys if key in self._entries]
+
+    def get_or_generate(self, model, template, version, inputs, generate, restamp):
+        """Serve or record a generation according to the cache mode.
+
+        generate() calls the LLM and returns the output (or None on failure).
+        restamp(output) rebinds a recorded output to the current ids and timestamps.
+        """
+        if self.mode == 'off':
+            return generate()
+        inputs = dict(inputs or {})
+        if self.mode == 'replay':
+            # Choose among the recorded slots: a freshly drawn one misses whenever it was never recorded
+            recorded = self._recorded_keys(model, template, version, inputs)
+            with self._lock:
+                key = self._rng.choice(recorded) if recorded else None
+            replay = True
+        else:
+            with self._lock:
+                inputs['slot'] = self._rng.randrange(self.slots)
+            key = cache_key(model, template, version, inputs)
+            replay = self.mode == 'record_on_miss' and self.variant_count(key) >= self.variants_per_key
+        if replay:
+            output = self.lookup(key) if key is not None else None
+            with self._lock:
+                self._stats['hits' if output is not None else 'misses'] += 1
+                first_replay = output is not None and (model, template) not in self._replaying
+                self._replaying.add((model, template))
+            if first_replay and self.mode == 'record_on_miss':
+                logger.info("LLM cache replaying recorded %s outputs for %s (up to %d per input: %d slots x %d variants; "
+                            "raise --llm-cache-slots for more variety)", template, model,
+                            self.slots * self.variants_per_key, self.slots, self.variants_per_key)
+            if output is not None:
+                return restamp(output)
+            if self.mode == 'replay':
+                logger.info("LLM cache miss in replay mode for %s/%s", template, model)
+                return None
+        elif self.mode == 'record_on_miss':
+            with self._lock:
+                self._stats['misses'] += 1
+        output = generate()
+        if output is not None:
+            self.store(key, copy.deepcopy(output), model=model, template=template, version=version, inputs=inputs)
+        return output
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, mode=self.mode, entries=len(self._entries), bytes=self._total_bytes)
+
+_cache = None
+
+def configure_llm_cache(directory=None, mode=None, **kwargs):
+    """Set the cache used by the generators; AMBOSIM_LLM_CACHE / AMBOSIM_LLM_CACHE_MODE are the defaults."""
+    global _cache
+    directory = directory or os.getenv('AMBOSIM_LLM_CACHE')
+    mode = mode or os.getenv('AMBOSIM_LLM_CACHE_MODE', 'record_on_miss')
+    _cache = LLMCache(directory, mode=mode, **kwargs) if directory and mode != 'off' else None
+    if _cache is not None:
+        logger.info("LLM cache at %s (mode=%s, %d entries)", directory, mode, len(_cache._entries))
+    return _cache
+
+def get_llm_cache():
+    return _cache
+
+def cached_generation(model, template, version, inputs, generate, restamp):
+    """Run generate() through the configured cache, or directly when no cache is configured."""
+    if _cache is None:
+        return generate()
+    return _cache.get_or_generate(model, template, version, inputs, generate, restamp)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Inspect or prune the LLM cassette cache')
+    parser.add_argument('command', choices=['stats', 'prune'])
+    parser.add_argument('--dir', default=os.getenv('AMBOSIM_LLM_CACHE', 'llm_cache'),
+                        help='Cache directory (default: $AMBOSIM_LLM_CACHE or llm_cache)')
+    parser.add_argument('--max-entries', type=int, default=5000)
+    parser.add_argument('--max-mb', type=float, default=200)
+    args = parser.parse_args()
+
+    cache = LLMCache(args.dir, max_entries=args.max_entries, max_bytes=int(args.max_mb * 1024 * 1024))
+    if args.command == 'prune':
+        with cache._lock:
+            cache._evict()
+    print(json.dumps(cache.stats()))
@@ -0,0 +1,260 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+import httpx
+import ollama
+
+from fhir_generators import llm_metrics
+from fhir_generators.json_stream import StreamingJSONParser, StreamAborted, StreamIncomplete
+from fhir_generators.llm_router import LLMRouter, NoEndpointAvailable, load_router_config
+
+logger = logging.getLogger(__name__)
+
+# Timeout for a single LLM call when no deadline is set (seconds; AMBOSIM_LLM_TIMEOUT)
+DEFAULT_TIMEOUT = float(os.getenv('AMBOSIM_LLM_TIMEOUT', '120'))
+# Pass JSON schemas to Ollama's structured output mode; 0 sends format='json' instead (servers before 0.5)
+STRUCTURED_OUTPUT = os.getenv('AMBOSIM_LLM_STRUCTURED', '1') != '0'
+# How long Ollama keeps a model (and its prompt-prefix KV cache) loaded after a call, e.g. '30m' (AMBOSIM_LLM_KEEP_ALIVE)
+KEEP_ALIVE = os.getenv('AMBOSIM_LLM_KEEP_ALIVE') or None
+# Workers for hedged calls (each hedged call runs the model and its smaller stand-in side by side)
+HEDGE_WORKERS = 8
+
+class LLMDeadlineExceeded(Exception):
+    """Raised when an LLM call would start after its deadline."""
+
+class HedgeCancelled(Exception):
+    """Raised in the losing call of a hedged pair once the other one returned a document."""
+
+_local = threading.local()
+# Single default endpoint unless configured (--llm-endpoints / AMBOSIM_LLM_ENDPOINTS)
+_router = load_router_config(os.environ['AMBOSIM_LLM_ENDPOINTS']) if os.getenv('AMBOSIM_LLM_ENDPOINTS') else LLMRouter()
+_hedge_pool = None
+_hedge_pool_lock = threading.Lock()
+
+def configure_router(router):
+    """Route every later LLM call through router and start its endpoint health checks."""
+    global _router
+    _router = router
+    router.start_health_checks()
+
+def get_router():
+    return _router
+
+@contextmanager
+def request_deadline(deadline):
+    """Bound every LLM call made by this thread inside the block by a time.monotonic() deadline.
+
+    Used by the LLM scheduler so generators need no timeout parameters of their own.
+    """
+    previous = getattr(_local, 'deadline', None)
+    _local.deadline = deadline
+    try:
+        yield
+    finally:
+        _local.deadline = previous
+
+def current_timeout():
+    """Seconds left for an LLM call made by this thread now."""
+    deadline = getattr(_local, 'deadline', None)
+    if deadline is None:
+        return DEFAULT_TIMEOUT
+    return deadline - time.monotonic()
+
+def _routed(model, call):
+    """call(client) on the least-loaded endpoint serving model, failing over to the next one
+    when an endpoint is unreachable, times out or returns a server error."""
+    tried = []
+    last_error = None
+    while True:
+        timeout = current_timeout()
+        if timeout <= 0:
+            raise LLMDeadlineExceeded(f"Deadline passed before calling {model}")
+        try:
+            endpoint = _router.acquire(model, timeout, exclude=tried)
+        except NoEndpointAvailable:
+            if last_error is not None:
+                raise last_error from None
+            raise
+        timeout = current_timeout()  # acquire() may have waited for a free slot
+        if timeout <= 0:
+            _router.release(endpoint)
+            raise LLMDeadlineExceeded(f"Deadline passed while waiting for an endpoint for {model}")
+        try:
+            result = call(endpoint.client(timeout))
+        except Exception as e:
+            failed = _router.is_endpoint_failure(e)
+            _router.release(endpoint, failed=failed)
+            if not failed:
+                raise
+            logger.warning("LLM endpoint %s failed for %s (%s); trying another endpoint", endpoint.name, model, e)
+            tried.append(endpoint)
+            last_error = e
+            _router.record_failover()
+            continue
+        _router.release(endpoint)
+        return result
+
+def generate(model, prompt, generator=None, **kwargs):
+    """ollama.generate on a routed endpoint, with a timeout taken from the current request deadline."""
+    if current_timeout() <= 0:
+        llm_metrics.record_call(model, generator, 0.0, failure='deadline')
+        raise LLMDeadlineExceeded(f"Deadline passed before calling {model}")
+    if KEEP_ALIVE is not None:
+        kwargs.setdefault('keep_alive', KEEP_ALIVE)
+    started = time.monotonic()
+    try:
+        response = _routed(model, lambda client: client.generate(model=model, prompt=prompt, **kwargs))
+    except Exception as e:
+        llm_metrics.record_call(model, generator, (time.monotonic() - started) * 1000.0, failure=classify_failure(e))
+        raise
+    timings = _server_timings(response)
+    llm_metrics.record_call(model, generator, (time.monotonic() - started) * 1000.0,
+                            prompt_tokens=timings.get('prompt_eval_count'), completion_tokens=timings.get('eval_count'),
+                            prompt_eval_ms=timings.get('prompt_eval_ms'), eval_ms=timings.get('eval_ms'))
+    return response
+
+def classify_failure(error):
+    """Failure category (see llm_metrics.FAILURE_CATEGORIES) of an exception raised by an LLM call."""
+    if isinstance(error, LLMDeadlineExceeded):
+        return 'deadline'
+    if isinstance(error, StreamIncomplete):
+        return 'truncated'
+    if isinstance(error, StreamAborted):
+        return 'schema_violation'
+    if isinstance(error, ValueError):
+        return 'json_parse'
+    if isinstance(error, httpx.TimeoutException):
+        return 'timeout'
+    if isinstance(error, (httpx.ConnectError, ConnectionError)):
+        return 'connection'
+    if isinstance(error, ollama.ResponseError):
+        return 'server_error'
+    return 'error'
+
+def stream_json(model, prompt, schema, max_chars=20000, cancel=None, **kwargs):
+    """Generate a JSON document constrained to schema, parsing the streamed response as it arrives.
+
+    The stream is closed as soon as the document is complete, or as soon as it can no longer
+    match the schema (StreamAborted, carrying any complete items of its first array), or
+    when the cancel event is set (HedgeCancelled).
+    Returns (document, timings): ttft_ms and total_ms measured here, plus Ollama's
+    prompt_eval_count / prompt_eval_ms / eval_count / eval_ms when the final chunk arrived.
+    """
+    if KEEP_ALIVE is not None:
+        kwargs.setdefault('keep_alive', KEEP_ALIVE)
+
+    def call(client):
+        parser = StreamingJSONParser(schema, max_chars=max_chars)
+        timings = {'ttft_ms': None, 'total_ms': None}
+        started = time.monotonic()
+        stream = client.generate(model=model, prompt=prompt, format=schema if STRUCTURED_OUTPUT else 'json',
+                                 stream=True, **kwargs)
+        try:
+            trailing = 0
+            for chunk in stream:
+                if cancel is not None and cancel.is_set():
+                    raise HedgeCancelled(f"{model} call lost the hedge")
+                text = chunk['response']
+                if text and timings['ttft_ms'] is None:
+                    timings['ttft_ms'] = (time.monotonic() - started) * 1000.0
+                if not parser.done:
+                    parser.feed(text)
+                elif text.strip():
+                    break  # The model kept going after the document
+                else:
+                    # Wait a couple of chunks for the final one, which carries the server timings
+                    trailing += 1
+                    if trailing > 2:
+                        break
+                if chunk.get('done'):
+                    timings.update(_server_timings(chunk))
+                    break
+        except StreamAborted as e:
+            logger.warning("Aborted %s generation after %d characters: %s", model, len(parser.text()), e)
+            raise
+        finally:
+            stream.close()  # Disconnecting stops the generation on the server
+        timings['total_ms'] = (time.monotonic() - started) * 1000.0
+        return parser.value(), timings
+
+    return _routed(model, call)
+
+def _server_timings(chunk):
+    timings = {}
+    for name in ('prompt_eval_count', 'eval_count'):
+        if chunk.get(name) is not None:
+            timings[name] = chunk.get(name)
+    for name in ('prompt_eval_duration', 'eval_duration'):
+        if chunk.get(name) is not None:
+            timings[name.replace('_duration', '_ms')] = chunk.get(name) / 1e6
+    return timings
+
+def generate_json(model, prompt, schema, max_chars=20000, generator=None, **kwargs):
+    """stream_json() returning only the document; every call is recorded in llm_metrics.
+
+    When the router has a hedge model for model and model's recent p95 latency for this
+    generator exceeds the time left before the deadline, the smaller model is asked too
+    and the first valid document wins.
+    """
+    hedge_model = _hedge_model(model, generator)
+    if hedge_model is not None:
+        return _hedged_generate_json(model, hedge_model, prompt, schema, max_chars, generator, **kwargs)
+    return _generate_json(model, prompt, schema, max_chars, generator, **kwargs)
+
+def _generate_json(model, prompt, schema, max_chars, generator, cancel=None, **kwargs):
+    started = time.monotonic()
+    try:
+        document, timings = stream_json(model, prompt, schema, max_chars=max_chars, cancel=cancel, **kwargs)
+    except HedgeCancelled:
+        raise
+    except Exception as e:
+        llm_metrics.record_call(model, generator, (time.monotonic() - started) * 1000.0, failure=classify_failure(e))
+        raise
+    llm_metrics.record_call(model, generator, timings['total_ms'], ttft_ms=timings['ttft_ms'],
+                            prompt_tokens=timings.get('prompt_eval_count'), completion_tokens=timings.get('eval_count'),
+                            prompt_eval_ms=timings.get('prompt_eval_ms'), eval_ms=timings.get('eval_ms'))
+    return document
+
+def _hedge_model(model, generator):
+    hedge_model = _router.hedge.get(model)
+    if hedge_model is None or not _router.serves(hedge_model):
+        return None
+    p95 = llm_metrics.metrics.latency_percentile(model, generator, 0.95)
+    if p95 is None or p95 <= current_timeout() * 1000.0:
+        return None
+    return hedge_model
+
+def _hedge_executor():
+    global _hedge_pool
+    with _hedge_pool_lock:
+        if _hedge_pool is None:
+            _hedge_pool = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix='llm-hedge')
+        return _hedge_pool
+
+def _hedged_generate_json(model, hedge_model, prompt, schema, max_chars, generator, **kwargs):
+    deadline = time.monotonic() + current_timeout()
+    cancel = threading.Event()
+
+    def run(name):
+        with request_deadline(deadline):  # Worker threads do not see this thread's deadline
+            return _generate_json(name, prompt, schema, max_chars, generator, cancel=cancel, **kwargs)
+
+    pool = _hedge_executor()
+    futures = {pool.submit(run, model): model, pool.submit(run, hedge_model): hedge_model}
+    logger.debug("Hedging %s with %s for %s", model, hedge_model, generator)
+    error = None
+    for future in as_completed(futures):
+        try:
+            document = future.result()
+        except Exception as e:
+            error = error if isinstance(e, HedgeCancelled) else e
+            continue
+        cancel.set()  # The other call stops at its next streamed chunk
+        _router.record_hedge(won=futures[future] == hedge_model)
+        return document
+    _router.record_hedge(won=False)
+    raise error
@@ -0,0 +1,204 @@
+import bisect
+import logging
+import math
+from collections import deque
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the latency histogram buckets (ms); the last bucket is +Inf
+LATENCY_BUCKETS_MS = (100, 250, 500, 1000, 2500, 5000, 10000, 20000, 30000, 60000, 120000)
+# Recent calls kept per model and generator for percentiles
+RESERVOIR_SIZE = 1000
+
+FAILURE_CATEGORIES = (
+    'timeout',              # HTTP timeout talking to Ollama
+    'connection',           # Ollama unreachable
+    'server_error',         # Ollama returned an error (e.g. unknown model)
+    'deadline',             # Request deadline passed before the call
+    'schema_violation',     # Streamed output went off-schema and was aborted
+    'truncated',            # Stream ended before the document was complete
+    'json_parse',           # Output was not valid JSON
+    'wrong_resource_type',  # Valid JSON but not the requested FHIR resource
+    'missing_fields',       # Required FHIR fields missing
+    'error'                 # Anything else
+)
+
+def _percentile(values, q):
+    """Nearest-rank percentile: the smallest value with at least q of the values at or below it."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[max(0, math.ceil(q * len(ordered)) - 1)], 1)
+
+class _Series:
+    __slots__ = ('calls', 'completed', 'failures', 'invalid', 'served', 'fallbacks', 'latencies', 'ttfts',
+                 'buckets', 'latency_sum_ms', 'prompt_tokens', 'completion_tokens', 'prompt_eval_ms', 'eval_ms')
+
+    def __init__(self):
+        self.calls = 0
+        self.completed = 0
+        self.failures = {}  # Calls that raised, by category
+        self.invalid = {}  # Completed calls whose output failed validation, by category
+        self.served = 0
+        self.fallbacks = 0
+        self.latencies = deque(maxlen=RESERVOIR_SIZE)
+        self.ttfts = deque(maxlen=RESERVOIR_SIZE)
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.latency_sum_ms = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.prompt_eval_ms = 0.0
+        self.eval_ms = 0.0
+
+    def all_failures(self):
+        failures = dict(self.failures)
+        for category, count in self.invalid.items():
+            failures[category] = failures.get(category, 0) + count
+        return failures
+
+    def summary(self):
+        failed = sum(self.failures.values())
+        invalid = sum(self.invalid.values())
+        needed = self.served + self.fallbacks
+        return {
+            'calls': self.calls,
+            'completed': self.completed,
+            'valid': self.completed - invalid,
+            'failures': self.all_failures(),
+            'failure_rate': round((failed + invalid) / self.calls, 3) if self.calls else None,
+            'fallback_rate': round(self.fallbacks / needed, 3) if needed else None,
+            'served': self.served,
+            'fallbacks': self.fallbacks,
+            'latency_ms': {'p50': _percentile(self.latencies, 0.50), 'p95': _percentile(self.latencies, 0.95),
+                           'p99': _percentile(self.latencies, 0.99)},
+            'ttft_ms': {'p50': _percentile(self.ttfts, 0.50), 'p95': _percentile(self.ttfts, 0.95)},
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'prompt_tokens_per_s': round(self.prompt_tokens / (self.prompt_eval_ms / 1000.0), 1) if self.prompt_eval_ms else None,
+            'tokens_per_s': round(self.completion_tokens / (self.eval_ms / 1000.0), 1) if self.eval_ms else None
+        }
+
+class LLMMetrics:
+    """Per model and generator LLM call telemetry.
+
+    record_call() is called by llm_client for every call (latency, tokens, or the failure
+    category of the exception), record_invalid() by generators when a completed call's
+    output fails validation, and record_result() by the simulator each time it needed a
+    resource and got it from the LLM or had to use its fallback.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._series = {}
+
+    def _get(self, model, generator):
+        key = (model, generator or 'other')
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _Series()
+        return series
+
+    def record_call(self, model, generator, latency_ms, ttft_ms=None, prompt_tokens=None, completion_tokens=None,
+                    prompt_eval_ms=None, eval_ms=None, failure=None):
+        with self._lock:
+            s = self._get(model, generator)
+            s.calls += 1
+            if failure is not None:
+                s.failures[failure] = s.failures.get(failure, 0) + 1
+                return
+            s.completed += 1
+            s.latencies.append(latency_ms)
+            s.latency_sum_ms += latency_ms
+            s.buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, latency_ms)] += 1
+            if ttft_ms is not None:
+                s.ttfts.append(ttft_ms)
+            if prompt_tokens is not None and prompt_eval_ms:
+                s.prompt_tokens += prompt_tokens
+                s.prompt_eval_ms += prompt_eval_ms
+            if completion_tokens is not None and eval_ms:
+                s.completion_tokens += completion_tokens
+                s.eval_ms += eval_ms
+
+    def record_invalid(self, model, generator, category):
+        with self._lock:
+            s = self._get(model, generator)
+            s.invalid[category] = s.invalid.get(category, 0) + 1
+
+    def record_result(self, model, generator, fallback):
+        with self._lock:
+            s = self._get(model, generator)
+            if fallback:
+                s.fallbacks += 1
+            else:
+                s.served += 1
+
+    def latency_percentile(self, model, generator, q, min_samples=20):
+        """Recent latency percentile (ms) of completed calls, or None with fewer than min_samples."""
+        with self._lock:
+            series = self._series.get((model, generator or 'other'))
+            if series is None or len(series.latencies) < min_samples:
+                return None
+            return _percentile(series.latencies, q)
+
+    def snapshot(self):
+        """{model: {generator: summary}} with percentiles, token rates, failures and fallback rate."""
+        with self._lock:
+            stats = {}
+            for (model, generator), series in self._series.items():
+                stats.setdefault(model, {})[generator] = series.summary()
+            return stats
+
+    def prometheus(self, prefix='ambosim_llm'):
+        """The metrics in Prometheus text exposition format."""
+        lines = [
+            f"# HELP {prefix}_requests_total LLM calls by outcome (ok or failure category).",
+            f"# TYPE {prefix}_requests_total counter",
+        ]
+        with self._lock:
+            series = sorted(self._series.items())
+            for (model, generator), s in series:
+                labels = f'model="{_escape(model)}",generator="{_escape(generator)}"'
+                lines.append(f'{prefix}_requests_total{{{labels},outcome="ok"}} {s.completed - sum(s.invalid.values())}')
+                for category, count in sorted(s.all_failures().items()):
+                    lines.append(f'{prefix}_requests_total{{{labels},outcome="{category}"}} {count}')
+            lines += [f"# HELP {prefix}_latency_ms Latency of completed LLM calls.", f"# TYPE {prefix}_latency_ms histogram"]
+            for (model, generator), s in series:
+                labels = f'model="{_escape(model)}",generator="{_escape(generator)}"'
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS_MS + ('+Inf',), s.buckets):
+                    cumulative += count
+                    lines.append(f'{prefix}_latency_ms_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'{prefix}_latency_ms_sum{{{labels}}} {round(s.latency_sum_ms, 1)}')
+                lines.append(f'{prefix}_latency_ms_count{{{labels}}} {s.completed}')
+            for name, attr, help_text in (
+                ('prompt_tokens_total', 'prompt_tokens', 'Prompt tokens evaluated.'),
+                ('completion_tokens_total', 'completion_tokens', 'Tokens generated.'),
+                ('eval_seconds_total', 'eval_ms', 'Server time spent generating tokens.'),
+                ('served_total', 'served', 'Resources served from LLM output.'),
+                ('fallbacks_total', 'fallbacks', 'Resources that fell back to the non-LLM generator.'),
+            ):
+                lines += [f"# HELP {prefix}_{name} {help_text}", f"# TYPE {prefix}_{name} counter"]
+                for (model, generator), s in series:
+                    value = getattr(s, attr)
+                    if attr == 'eval_ms':
+                        value = round(value / 1000.0, 3)
+                    lines.append(f'{prefix}_{name}{{model="{_escape(model)}",generator="{_escape(generator)}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+metrics = LLMMetrics()
+
+def record_call(model, generator, latency_ms, **kwargs):
+    metrics.record_call(model, generator, latency_ms, **kwargs)
+
+def record_invalid(model, generator, category):
+    metrics.record_invalid(model, generator, category)
+
+def record_result(model, generator, fallback):
+    metrics.record_result(model, generator, fallback)
+
+def llm_metrics_snapshot():
+    return metrics.snapshot()
@@ -0,0 +1,204 @@
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+
+import httpx
+import ollama
+
+from fhir_generators.circuit_breaker import CircuitBreaker, CLOSED
+
+logger = logging.getLogger(__name__)
+
+# Endpoint pool file (or inline JSON) given with --llm-endpoints / AMBOSIM_LLM_ENDPOINTS:
+# {
+#   "endpoints": [
+#     {"url": "http://ollama-1:11434", "models": ["llama3.1:8b", "gemma2:2b"], "concurrency": 2},
+#     {"url": "http://ollama-2:11434", "concurrency": 1}
+#   ],
+#   "hedge": {"llama3.1:8b": "gemma2:2b"},
+#   "health_interval": 10
+# }
+# An endpoint without "models" serves whatever its /api/tags lists.
+
+MIN_CLIENT_TIMEOUT = 1.0  # Seconds; shortest httpx timeout given to an endpoint client
+
+class NoEndpointAvailable(ConnectionError):
+    """No healthy endpoint serves the model (or none freed up before the deadline)."""
+
+def _model_names(name):
+    return {name, name[:-len(':latest')] if name.endswith(':latest') else f"{name}:latest"}
+
+class Endpoint:
+    """One Ollama host: the models it serves, how many calls it takes at once, and its health."""
+
+    def __init__(self, url=None, models=None, concurrency=None, failure_threshold=3, reset_timeout=15.0):
+        self.url = url  # None: the ollama library default (OLLAMA_HOST)
+        self.name = url or os.getenv('OLLAMA_HOST', 'default')
+        self.models = set(models) if models else None
+        self.discovered = None  # Models listed by /api/tags
+        self.concurrency = concurrency
+        self.outstanding = 0
+        self.breaker = CircuitBreaker(f"LLM endpoint {self.name}", failure_threshold=failure_threshold,
+                                      reset_timeout=reset_timeout)
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+        self.metrics = {'requests': 0, 'failures': 0}
+
+    def serves(self, model):
+        models = self.models if self.models is not None else self.discovered
+        return models is None or bool(_model_names(model) & models)
+
+    def has_capacity(self):
+        return self.concurrency is None or self.outstanding < self.concurrency
+
+    def client(self, timeout):
+        # ollama.Client fixes its httpx timeout at construction, so calls share one pooled
+        # client per step of a sqrt(2) ladder (1, 1.41, 2, 2.83, 4, ... s): a few clients per
+        # endpoint rather than one per second of remaining deadline. Rounded down, so the
+        # request deadline still bounds the call (never below MIN_CLIENT_TIMEOUT)
+        key = 2 ** (math.floor(2 * math.log2(max(timeout, MIN_CLIENT_TIMEOUT))) / 2)
+        with self._clients_lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = self._clients[key] = ollama.Client(host=self.url, timeout=key)
+            return client
+
+    def check_health(self, timeout=3.0):
+        """GET /api/tags: records the result on the breaker and refreshes discovered models."""
+        host = self.url or os.getenv('OLLAMA_HOST') or 'http://127.0.0.1:11434'
+        if '://' not in host:
+            host = f"http://{host}"
+        try:
+            response = httpx.get(f"{host.rstrip('/')}/api/tags", timeout=timeout)
+            response.raise_for_status()
+            names = set()
+            for entry in response.json().get('models', []):
+                for key in ('name', 'model'):
+                    if entry.get(key):
+                        names |= _model_names(entry[key])
+            self.discovered = names or None
+        except Exception as e:
+            logger.debug("Health check of %s failed: %s", self.name, e)
+            self.breaker.record_failure()
+            return False
+        self.breaker.record_success()
+        return True
+
+    def stats(self):
+        return dict(self.metrics, url=self.name, outstanding=self.outstanding, concurrency=self.concurrency,
+                    state=self.breaker.state, models=sorted(self.models or self.discovered or []))
+
+class LLMRouter:
+    """Routes each LLM call to the healthy endpoint serving its model with the fewest outstanding calls.
+
+    acquire() waits (up to the call's timeout) while every such endpoint is at its concurrency
+    limit. Endpoints whose circuit breaker is open are skipped until a health check or a
+    trial call succeeds. hedge maps a model to a smaller one to race against it when the
+    model's observed p95 latency would miss the request deadline.
+    """
+
+    def __init__(self, endpoints=None, hedge=None, health_interval=10.0):
+        self.endpoints = list(endpoints) if endpoints else [Endpoint()]
+        self.hedge = dict(hedge or {})
+        self.health_interval = health_interval
+        self._cond = threading.Condition()
+        self._health_thread = None
+        self.metrics = {'failovers': 0, 'hedged': 0, 'hedge_wins': 0}
+
+    def start_health_checks(self):
+        if self._health_thread is not None or not self.health_interval:
+            return
+        self._health_thread = threading.Thread(target=self._health_loop, name='llm-health', daemon=True)
+        self._health_thread.start()
+
+    def _health_loop(self):
+        while True:
+            for endpoint in self.endpoints:
+                endpoint.check_health()
+            with self._cond:
+                self._cond.notify_all()  # A recovered endpoint may unblock waiting calls
+            time.sleep(self.health_interval)
+
+    def serves(self, model, exclude=()):
+        return any(e.serves(model) and e not in exclude for e in self.endpoints)
+
+    def capacity(self):
+        """Total concurrency across endpoints (None if any endpoint is unlimited)."""
+        if any(e.concurrency is None for e in self.endpoints):
+            return None
+        return sum(e.concurrency for e in self.endpoints)
+
+    def acquire(self, model, timeout, exclude=()):
+        """Reserve the least-loaded healthy endpoint for model; release() it when the call is done."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                candidates = [e for e in self.endpoints if e not in exclude and e.serves(model)]
+                if not candidates:
+                    raise NoEndpointAvailable(f"No LLM endpoint serves {model}")
+                healthy = [e for e in candidates if e.breaker.state == CLOSED] or \
+                          [e for e in candidates if e.breaker.allow_request()]
+                if not healthy:
+                    raise NoEndpointAvailable(f"All LLM endpoints for {model} are down")
+                free = [e for e in healthy if e.has_capacity()]
+                if free:
+                    least = min(e.outstanding for e in free)
+                    endpoint = random.choice([e for e in free if e.outstanding == least])
+                    endpoint.outstanding += 1
+                    endpoint.metrics['requests'] += 1
+                    return endpoint
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise NoEndpointAvailable(f"No LLM endpoint for {model} had capacity in time")
+                self._cond.wait(remaining)
+
+    def release(self, endpoint, failed=False):
+        with self._cond:
+            endpoint.outstanding -= 1
+            if failed:
+                endpoint.metrics['failures'] += 1
+            self._cond.notify_all()
+        if failed:
+            endpoint.breaker.record_failure()
+        else:
+            endpoint.breaker.record_success()
+
+    def record_failover(self):
+        with self._cond:
+            self.metrics['failovers'] += 1
+
+    def record_hedge(self, won):
+        with self._cond:
+            self.metrics['hedged'] += 1
+            if won:
+                self.metrics['hedge_wins'] += 1
+
+    @staticmethod
+    def is_endpoint_failure(error):
+        """Errors that say something about the endpoint rather than the model's output."""
+        if isinstance(error, ollama.ResponseError):
+            return getattr(error, 'status_code', 0) >= 500
+        return isinstance(error, (httpx.TransportError, ConnectionError)) and not isinstance(error, NoEndpointAvailable)
+
+    def stats(self):
+        with self._cond:
+            return dict(self.metrics, endpoints=[e.stats() for e in self.endpoints], hedge=dict(self.hedge))
+
+def load_router_config(source):
+    """LLMRouter from a JSON file path or inline JSON (see the format at the top of this module)."""
+    if os.path.exists(source):
+        with open(source, 'r') as f:
+            config = json.load(f)
+    else:
+        config = json.loads(source)
+    if isinstance(config, list):
+        config = {'endpoints': config}
+    endpoints = [Endpoint(url=entry['url'], models=entry.get('models'), concurrency=entry.get('concurrency'))
+                 for entry in config.get('endpoints', [])]
+    if not endpoints:
+        raise ValueError("LLM endpoint config lists no endpoints")
+    return LLMRouter(endpoints, hedge=config.get('hedge'), health_interval=config.get('health_interval', 10.0))
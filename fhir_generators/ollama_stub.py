@@ -0,0 +1,166 @@
+import argparse
+import json
+import logging
+import re
+import sys
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+# Stand-in Ollama server for exercising the generators without a GPU:
+# python3 -m fhir_generators.ollama_stub --port 11435 --prompt-ms 2 --token-ms 10
+# OLLAMA_HOST=http://localhost:11435 python3 -m fhir_generators.prompt_bench --llm-model stub
+
+_TOKEN = re.compile(r'\w+|[^\w\s]|\s+')
+
+def sample_from_schema(schema):
+    """A minimal document matching schema: first enum value, 'stub' strings, minItems items."""
+    kind = schema.get('type')
+    if 'enum' in schema:
+        return schema['enum'][0]
+    if kind == 'object':
+        return {key: sample_from_schema(value) for key, value in schema.get('properties', {}).items()}
+    if kind == 'array':
+        return [sample_from_schema(schema.get('items', {})) for _ in range(max(1, schema.get('minItems', 1)))]
+    if kind == 'integer':
+        return 1
+    if kind == 'number':
+        return 1.0
+    if kind == 'boolean':
+        return True
+    return 'stub'
+
+class PrefixCacheModel:
+    """One model slot: requests run one at a time and reuse the KV cache of the longest
+    common token prefix with the previous prompt, like a single llama.cpp slot."""
+
+    def __init__(self, prompt_ms, token_ms):
+        self.prompt_ms = prompt_ms
+        self.token_ms = token_ms
+        self.lock = Lock()
+        self.cached = []
+
+    def evaluate_prompt(self, prompt):
+        """Simulate prompt processing; returns (tokens, tokens evaluated, seconds)."""
+        tokens = _TOKEN.findall(prompt)
+        shared = 0
+        for cached, token in zip(self.cached, tokens):
+            if cached != token:
+                break
+            shared += 1
+        evaluated = max(1, len(tokens) - shared)  # The last token is always re-evaluated
+        seconds = evaluated * self.prompt_ms / 1000.0
+        time.sleep(seconds)
+        self.cached = tokens
+        return len(tokens), evaluated, seconds
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, prompt_ms=2.0, token_ms=10.0, chars_per_token=4):
+        super().__init__(address, StubHandler)
+        self.prompt_ms = prompt_ms
+        self.token_ms = token_ms
+        self.chars_per_token = chars_per_token
+        self.models = {}
+        self.models_lock = Lock()
+
+    def handle_error(self, request, client_address):
+        # Clients close streams early on purpose; anything else is still reported
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+    def model(self, name):
+        with self.models_lock:
+            if name not in self.models:
+                self.models[name] = PrefixCacheModel(self.prompt_ms, self.token_ms)
+            return self.models[name]
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+    def _send_json(self, payload, status=200):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/api/version':
+            self._send_json({'version': '0.0.0-stub'})
+        elif self.path == '/api/tags':
+            self._send_json({'models': [{'name': name, 'model': name} for name in self.server.models]})
+        else:
+            self._send_json({'error': 'not found'}, status=404)
+
+    def do_POST(self):
+        if self.path != '/api/generate':
+            self._send_json({'error': 'not found'}, status=404)
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        name = request.get('model', 'stub')
+        schema = request.get('format')
+        output = json.dumps(sample_from_schema(schema)) if isinstance(schema, dict) else '{"response": "stub"}'
+        step = self.server.chars_per_token
+        pieces = [output[i:i + step] for i in range(0, len(output), step)]
+
+        model = self.server.model(name)
+        with model.lock:
+            started = time.monotonic()
+            prompt_tokens, evaluated, prompt_seconds = model.evaluate_prompt(request.get('prompt', ''))
+            if not request.get('stream', True):
+                time.sleep(len(pieces) * model.token_ms / 1000.0)
+                self._send_json(self._final(name, output, evaluated, prompt_seconds, len(pieces), started))
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            try:
+                for piece in pieces:
+                    self._write_chunk({'model': name, 'created_at': _now(), 'response': piece, 'done': False})
+                    time.sleep(model.token_ms / 1000.0)
+                self._write_chunk(self._final(name, '', evaluated, prompt_seconds, len(pieces), started))
+                self.wfile.write(b'0\r\n\r\n')
+            except (BrokenPipeError, ConnectionResetError):
+                logger.debug("Client closed the %s stream early", name)
+                self.close_connection = True
+
+    def _write_chunk(self, payload):
+        data = json.dumps(payload).encode('utf-8') + b'\n'
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+    def _final(self, name, response, evaluated, prompt_seconds, eval_count, started):
+        total = time.monotonic() - started
+        return {
+            'model': name, 'created_at': _now(), 'response': response, 'done': True, 'done_reason': 'stop',
+            'prompt_eval_count': evaluated, 'prompt_eval_duration': int(prompt_seconds * 1e9),
+            'eval_count': eval_count, 'eval_duration': int((total - prompt_seconds) * 1e9),
+            'total_duration': int(total * 1e9), 'load_duration': 0
+        }
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Stand-in Ollama server that simulates prompt-prefix KV caching')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--prompt-ms', type=float, default=2.0, help='Milliseconds per prompt token not in the prefix cache')
+    parser.add_argument('--token-ms', type=float, default=10.0, help='Milliseconds per generated token')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = StubServer((args.host, args.port), prompt_ms=args.prompt_ms, token_ms=args.token_ms)
+    logger.info("Ollama stub listening on http://%s:%d", args.host, args.port)
+    server.serve_forever()
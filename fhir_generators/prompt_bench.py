@@ -0,0 +1,91 @@
+import argparse
+import json
+import logging
+import statistics
+import uuid
+from datetime import datetime, timezone
+
+from fhir_generators import llm_client
+from fhir_generators.generate_condition import condition_prompt, condition_schema
+from fhir_generators.generate_encounter_ed_presentation import encounter_prompt, encounter_schema
+
+logger = logging.getLogger(__name__)
+
+# Time-to-first-token with and without prompt-prefix reuse, per model and prompt template:
+# python3 -m fhir_generators.prompt_bench --llm-model gemma:2b --llm-model llama3.1:8b --runs 5
+
+SEVERITIES = ('Mild', 'Moderate', 'Severe')
+DESCRIPTIONS = (
+    'Acute appendicitis - Severity: Severe',
+    'Ankle sprain - Severity: Mild',
+    'Community acquired pneumonia - Severity: Moderate',
+)
+
+def _prompts(template, i):
+    now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    if template == 'condition':
+        return condition_prompt(str(uuid.uuid4()), 'bench-patient', now, SEVERITIES[i % len(SEVERITIES)]), condition_schema()
+    return encounter_prompt(str(uuid.uuid4()), 'bench-patient', 'bench-condition', 'bench-practitioner', 'bench-organization',
+                            now, DESCRIPTIONS[i % len(DESCRIPTIONS)]), encounter_schema()
+
+def _run(model, template, runs, cold):
+    samples = []
+    for i in range(runs):
+        prompt, schema = _prompts(template, i)
+        if cold:
+            # A unique first line defeats prefix reuse, as if the variables came first
+            prompt = f"Request {uuid.uuid4()}\n{prompt}"
+        try:
+            _, timings = llm_client.stream_json(model, prompt, schema)
+        except Exception as e:
+            logger.warning("%s %s run failed: %s", model, template, e)
+            continue
+        samples.append(timings)
+    return samples
+
+def _median(samples, name):
+    values = [s[name] for s in samples if s.get(name) is not None]
+    return round(statistics.median(values), 1) if values else None
+
+def bench(models, templates, runs):
+    """Median TTFT for prefix-reusing prompts vs. prompts with a unique first line, per model and template."""
+    report = []
+    for model in models:
+        for template in templates:
+            _run(model, template, 1, cold=False)  # Prime the prefix cache and load the model
+            warm = _run(model, template, runs, cold=False)
+            cold = _run(model, template, runs, cold=True)
+            row = {
+                'model': model, 'template': template, 'runs': runs,
+                'cold_ttft_ms': _median(cold, 'ttft_ms'), 'warm_ttft_ms': _median(warm, 'ttft_ms'),
+                'cold_prompt_eval_ms': _median(cold, 'prompt_eval_ms'), 'warm_prompt_eval_ms': _median(warm, 'prompt_eval_ms'),
+                'cold_prompt_tokens': _median(cold, 'prompt_eval_count'), 'warm_prompt_tokens': _median(warm, 'prompt_eval_count')
+            }
+            if row['cold_ttft_ms'] is not None and row['warm_ttft_ms'] is not None:
+                row['ttft_saving_ms'] = round(row['cold_ttft_ms'] - row['warm_ttft_ms'], 1)
+                row['ttft_saving_pct'] = round(100.0 * row['ttft_saving_ms'] / row['cold_ttft_ms'], 1) if row['cold_ttft_ms'] else None
+            report.append(row)
+    return report
+
+def format_report(report):
+    lines = [f"{'model':<20} {'template':<10} {'cold TTFT':>10} {'warm TTFT':>10} {'saving':>16} {'prompt tokens (cold/warm)':>26}"]
+    for row in report:
+        saving = (f"{row['ttft_saving_ms']:.0f} ms ({row['ttft_saving_pct']:.0f}%)"
+                  if row.get('ttft_saving_pct') is not None else 'n/a')
+        tokens = f"{row['cold_prompt_tokens']}/{row['warm_prompt_tokens']}"
+        lines.append(f"{row['model']:<20} {row['template']:<10} {row['cold_ttft_ms'] or 0:>8.0f}ms "
+                     f"{row['warm_ttft_ms'] or 0:>8.0f}ms {saving:>16} {tokens:>26}")
+    return "\n".join(lines)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the time-to-first-token saving of prompt-prefix reuse')
+    parser.add_argument('--llm-model', action='append', help='Ollama model to measure (repeatable; default: gemma:2b)')
+    parser.add_argument('--template', action='append', choices=['condition', 'encounter'],
+                        help='Prompt template to measure (repeatable; default: both)')
+    parser.add_argument('--runs', type=int, default=5, help='Calls per model, template and mode (default: 5)')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    report = bench(args.llm_model or ['gemma:2b'], args.template or ['condition', 'encounter'], max(1, args.runs))
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
@@ -0,0 +1,191 @@
+import argparse
+import json
+import logging
+import mmap
+import os
+import random
+import uuid
+from array import array
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+# python3 -m fhir_generators.synthea_pool harvest --count 500 --pool synthea_pool.ndjson
+# python3 -m fhir_generators.synthea_pool stats --pool synthea_pool.ndjson
+
+def _replace_id(value, old, new):
+    """Copy of a JSON value with every occurrence of old inside strings replaced by new."""
+    if isinstance(value, str):
+        return value.replace(old, new) if old in value else value
+    if isinstance(value, dict):
+        return {k: _replace_id(v, old, new) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_replace_id(v, old, new) for v in value]
+    return value
+
+class PatientPool:
+    """Append-only pool of Synthea patient bundles for offline and repeatable runs.
+
+    Bundles are stored one per line in an NDJSON file. A sidecar ``.idx`` file holds
+    the byte offsets of the line boundaries (uint64), so any bundle can be read from
+    the memory-mapped data file with a single slice: O(1) random sampling, no parsing
+    of the rest of the pool. Sampling draws the bundle and its new id from a random.Random
+    seeded with seed, so a seeded pool serves the same sequence of patients on every run.
+    """
+
+    def __init__(self, path, seed=None):
+        self.path = path
+        self.index_path = path + '.idx'
+        self._lock = Lock()
+        self._rng = random.Random(seed)
+        self._offsets = array('Q')
+        self._mmap = None
+        self._mapped_size = 0
+        self._load_index()
+
+    def __len__(self):
+        return max(0, len(self._offsets) - 1)
+
+    def _load_index(self):
+        if not os.path.exists(self.path):
+            open(self.path, 'ab').close()
+        data_size = os.path.getsize(self.path)
+        offsets = array('Q')
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'rb') as f:
+                offsets.frombytes(f.read())
+        if not offsets or offsets[-1] > data_size or not self._at_line_start(offsets[-1]):
+            offsets = self._scan_offsets()
+        elif offsets[-1] < data_size:
+            # Data written after the index was saved (e.g. an interrupted append): index the
+            # complete lines that follow, dropping only a partial last one
+            offsets = self._scan_offsets(offsets)
+        self._offsets = offsets
+        self._write_index()
+
+    def _at_line_start(self, offset):
+        if offset == 0:
+            return True
+        with open(self.path, 'rb') as f:
+            f.seek(offset - 1)
+            return f.read(1) == b'\n'
+
+    def _scan_offsets(self, offsets=None):
+        """Offset index of the NDJSON file, keeping only complete lines: rebuilt from the start,
+        or continued after the last offset of an index that lags the data."""
+        offsets = offsets or array('Q', [0])
+        indexed = len(offsets) - 1
+        with open(self.path, 'rb') as f:
+            position = offsets[-1]
+            f.seek(position)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                position += len(line)
+                offsets.append(position)
+        with open(self.path, 'r+b') as f:
+            f.truncate(offsets[-1])
+        logger.info("Rebuilt patient pool index for %s (%d bundles, %d newly indexed)", self.path, len(offsets) - 1,
+                    len(offsets) - 1 - indexed)
+        return offsets
+
+    def _write_index(self):
+        with open(self.index_path, 'wb') as f:
+            self._offsets.tofile(f)
+
+    def _remap(self):
+        size = self._offsets[-1]
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if size:
+            with open(self.path, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._mapped_size = size
+
+    def _read(self, i):
+        start, end = self._offsets[i], self._offsets[i + 1]
+        if end > self._mapped_size:
+            self._remap()
+        return self._mmap[start:end]
+
+    def extend(self, bundles):
+        """Append bundles (dicts with a 'patient' resource); returns the number added."""
+        added = 0
+        with self._lock:
+            with open(self.path, 'ab') as data, open(self.index_path, 'ab') as index:
+                for bundle in bundles:
+                    if not isinstance(bundle, dict) or not (bundle.get('patient') or {}).get('id'):
+                        continue
+                    line = json.dumps(bundle, separators=(',', ':')).encode('utf-8') + b'\n'
+                    data.write(line)
+                    self._offsets.append(self._offsets[-1] + len(line))
+                    index.write(self._offsets[-1:].tobytes())
+                    added += 1
+        return added
+
+    def get(self, i):
+        with self._lock:
+            raw = self._read(i)
+        return json.loads(raw)
+
+    def sample(self, rng=None):
+        """A random pooled bundle re-identified with a fresh patient id, or None if the pool is empty.
+
+        The source id is replaced everywhere in the bundle (resource ids and references),
+        so the same pooled patient can be used many times in one session. Both the bundle
+        and the id come from rng (default: the pool's seeded generator).
+        """
+        rng = rng or self._rng
+        with self._lock:
+            if len(self) == 0:
+                return None
+            raw = self._read(rng.randrange(len(self)))
+            patient_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        bundle = json.loads(raw)
+        return _replace_id(bundle, bundle['patient']['id'], patient_id)
+
+    def stats(self):
+        with self._lock:
+            return {'path': self.path, 'bundles': len(self), 'bytes': self._offsets[-1]}
+
+    def close(self):
+        with self._lock:
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
+            self._mapped_size = 0
+
+def harvest(pool, count, batch_size=10):
+    """Fetch bundles from the Synthea API until the pool has grown by count."""
+    from fhir_generators.generate_synthea_patient import SyntheaClient
+
+    client = SyntheaClient()
+    added = 0
+    try:
+        while added < count:
+            results = client.fetch_batch(min(batch_size, count - added))
+            added += pool.extend(results)
+            print(f"Harvested {added}/{count} (pool size {len(pool)})")
+    finally:
+        client.close()
+    return added
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Manage the local Synthea patient pool')
+    parser.add_argument('command', choices=['harvest', 'stats', 'sample', 'reindex'])
+    parser.add_argument('--pool', default=os.getenv('AMBOSIM_SYNTHEA_POOL', 'synthea_pool.ndjson'),
+                        help='Path to the pool NDJSON file (default: $AMBOSIM_SYNTHEA_POOL or synthea_pool.ndjson)')
+    parser.add_argument('--count', type=int, default=100, help='Number of patients to harvest')
+    parser.add_argument('--batch-size', type=int, default=10, help='Patients per Synthea API request')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for sample (default: unseeded)')
+    args = parser.parse_args()
+
+    if args.command == 'reindex' and os.path.exists(args.pool + '.idx'):
+        os.remove(args.pool + '.idx')
+    pool = PatientPool(args.pool, seed=args.seed)
+    if args.command == 'harvest':
+        harvest(pool, args.count, args.batch_size)
+    elif args.command == 'sample':
+        print(json.dumps(pool.sample(), indent=2))
+    print(json.dumps(pool.stats()))
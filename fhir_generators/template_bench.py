@@ -0,0 +1,120 @@
+import argparse
+import json
+import timeit
+
+from fhir_generators.fhir_template import compile_template
+
+# Cost of building (and serializing) the fallback resources from compiled templates,
+# against the hand-written dict literals they replaced:
+# python3 -m fhir_generators.template_bench --number 20000
+
+NOW = '2024-01-01T00:00:00Z'
+CONDITION_SLOTS = {
+    'condition_id': 'bench-condition', 'clinical_status_code': 'active', 'clinical_status_display': 'Active',
+    'verification_status_code': 'confirmed', 'verification_status_display': 'Confirmed',
+    'category_code': 'encounter-diagnosis', 'category_display': 'Encounter Diagnosis',
+    'severity_code': '6736007', 'severity_display': 'Moderate',
+    'condition_code': '25064002', 'condition_display': 'Headache', 'patient_id': 'bench-patient',
+    'onset_date': NOW, 'recorded_date': NOW, 'note_text': 'Patient presents with Headache'
+}
+ENCOUNTER_SLOTS = {
+    'encounter_id': 'bench-encounter', 'encounter_status': 'finished', 'encounter_class_code': 'EMER',
+    'encounter_class_display': 'emergency', 'encounter_type_display': 'Emergency visit',
+    'service_type_display': 'Emergency Medicine', 'priority_display': 'Urgent', 'patient_id': 'bench-patient',
+    'encounter_start_date': NOW, 'reason_display': 'Emergency presentation', 'condition_id': 'bench-condition',
+    'condition_display': 'Acute condition', 'diagnosis_rank': 1, 'procedure_display': 'Blood test'
+}
+DISCHARGE_SLOTS = {'encounter_id': 'bench-encounter', 'encounter_start_date': NOW, 'encounter_end_date': NOW}
+
+def literal_condition(s):
+    return {
+        "resourceType": "Condition",
+        "id": s['condition_id'],
+        "clinicalStatus": {"coding": [{"system": "http://terminology.hl7.org/CodeSystem/condition-clinical",
+                                       "code": s['clinical_status_code'], "display": s['clinical_status_display']}]},
+        "verificationStatus": {"coding": [{"system": "http://terminology.hl7.org/CodeSystem/condition-ver-status",
+                                           "code": s['verification_status_code'], "display": s['verification_status_display']}]},
+        "category": [{"coding": [{"system": "http://terminology.hl7.org/CodeSystem/condition-category",
+                                  "code": s['category_code'], "display": s['category_display']}]}],
+        "severity": {"coding": [{"system": "http://snomed.info/sct", "code": s['severity_code'], "display": s['severity_display']}]},
+        "code": {"coding": [{"system": "http://snomed.info/sct", "code": s['condition_code'], "display": s['condition_display']}]},
+        "subject": {"reference": f"Patient/{s['patient_id']}"},
+        "onsetDateTime": s['onset_date'],
+        "recordedDate": s['recorded_date'],
+        "note": [{"text": s['note_text']}]
+    }
+
+def literal_encounter(s):
+    return {
+        "resourceType": "Encounter",
+        "id": s['encounter_id'],
+        "status": s['encounter_status'],
+        "class": {"system": "http://terminology.hl7.org/CodeSystem/v3-ActCode",
+                  "code": s['encounter_class_code'], "display": s['encounter_class_display']},
+        "type": [{"coding": [{"system": "http://snomed.info/sct", "display": s['encounter_type_display']}]}],
+        "serviceType": {"coding": [{"system": "http://snomed.info/sct", "display": s['service_type_display']}]},
+        "priority": {"coding": [{"system": "http://terminology.hl7.org/CodeSystem/v3-ActPriority", "display": s['priority_display']}]},
+        "subject": {"reference": f"Patient/{s['patient_id']}"},
+        "period": {"start": s['encounter_start_date']},
+        "reasonCode": [{"coding": [{"system": "http://snomed.info/sct", "display": s['reason_display']}]}],
+        "diagnosis": [{"condition": {"reference": f"Condition/{s['condition_id']}", "display": s['condition_display']},
+                       "rank": s['diagnosis_rank']}],
+        "procedure": [{"display": s['procedure_display']}]
+    }
+
+def literal_discharge(s):
+    return {
+        "resourceType": "Encounter",
+        "id": s['encounter_id'],
+        "status": "completed",
+        "hospitalization": {
+            "dischargeDisposition": {
+                "coding": [{"system": "http://terminology.hl7.org/CodeSystem/discharge-disposition",
+                            "code": "home", "display": "Discharged to home"}],
+                "text": "Patient discharged to home after treatment"
+            }
+        },
+        "period": {"start": s['encounter_start_date'], "end": s['encounter_end_date']}
+    }
+
+CASES = (
+    ('condition', literal_condition, CONDITION_SLOTS),
+    ('encounter', literal_encounter, ENCOUNTER_SLOTS),
+    ('encounter_discharge', literal_discharge, DISCHARGE_SLOTS),
+)
+
+def _best_us(fn, number, repeat):
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number * 1e6
+
+def bench(number, repeat=5):
+    """Per-call microseconds to build each resource and to build + serialize it (indent=2, as saved)."""
+    report = []
+    for name, literal, slots in CASES:
+        template = compile_template(name)
+        if template.fill(slots) != literal(slots) or template.render(slots, indent=2) != json.dumps(literal(slots), indent=2):
+            raise AssertionError(f"{name}: template output differs from the literal")
+        row = {
+            'resource': name,
+            'literal_build_us': _best_us(lambda: literal(slots), number, repeat),
+            'fill_us': _best_us(lambda: template.fill(slots), number, repeat),
+            'literal_dumps_us': _best_us(lambda: json.dumps(literal(slots), indent=2), number, repeat),
+            'fill_dumps_us': _best_us(lambda: json.dumps(template.fill(slots), indent=2), number, repeat),
+            'render_us': _best_us(lambda: template.render(slots, indent=2), number, repeat)
+        }
+        report.append({key: round(value, 2) if isinstance(value, float) else value for key, value in row.items()})
+    return report
+
+def format_report(report):
+    lines = [f"{'resource':<20} {'literal':>9} {'fill':>9} {'literal+dumps':>14} {'fill+dumps':>11} {'render':>9}"]
+    for row in report:
+        lines.append(f"{row['resource']:<20} {row['literal_build_us']:>7.2f}us {row['fill_us']:>7.2f}us "
+                     f"{row['literal_dumps_us']:>12.2f}us {row['fill_dumps_us']:>9.2f}us {row['render_us']:>7.2f}us")
+    return "\n".join(lines)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare compiled FHIR templates with hand-written resource literals')
+    parser.add_argument('--number', type=int, default=20000, help='Calls per timing (default: 20000)')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    args = parser.parse_args()
+    report = bench(max(1, args.number))
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
@@ -0,0 +1,60 @@
+import json
+import logging
+import uuid
+from collections import OrderedDict
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+class AttachmentStore:
+    """Bounded LRU cache of log attachment payloads, served to the UI on demand.
+
+    Log entries only carry ``{'id', 'label'}`` references; the JSON body is fetched over
+    HTTP when the user clicks an attachment. When an entry is evicted from memory and its
+    payload was written to the session export, the file path is remembered so the body can
+    still be served from disk; the path_capacity most recently evicted paths are kept.
+    """
+
+    def __init__(self, capacity=500, path_capacity=10000):
+        self.capacity = capacity
+        self.path_capacity = path_capacity
+        self._entries = OrderedDict()  # id -> (label, payload, path)
+        self._evicted_paths = OrderedDict()  # id -> path of the exported JSON file, oldest first
+        self._lock = Lock()
+
+    def put(self, label, payload, path=None):
+        """Cache a payload and return the lightweight reference sent to clients."""
+        attachment_id = uuid.uuid4().hex
+        with self._lock:
+            self._entries[attachment_id] = (label, payload, path)
+            while len(self._entries) > self.capacity:
+                evicted_id, (_, _, evicted_path) = self._entries.popitem(last=False)
+                if evicted_path:
+                    self._evicted_paths[evicted_id] = evicted_path
+            while len(self._evicted_paths) > self.path_capacity:
+                self._evicted_paths.popitem(last=False)
+        return {'id': attachment_id, 'label': label}
+
+    def get(self, attachment_id):
+        """Return the payload for an attachment id, or None if it is no longer available."""
+        with self._lock:
+            entry = self._entries.get(attachment_id)
+            if entry is not None:
+                self._entries.move_to_end(attachment_id)
+                return entry[1]
+            path = self._evicted_paths.get(attachment_id)
+            if path:
+                self._evicted_paths.move_to_end(attachment_id)
+        if not path:
+            return None
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning("Attachment %s could not be read from %s: %s", attachment_id, path, e)
+            return None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._evicted_paths.clear()
@@ -0,0 +1,190 @@
+import logging
+import time
+from threading import Lock, Thread
+
+logger = logging.getLogger(__name__)
+
+# Log channels rendered by the UI (one log card each)
+LOG_CHANNELS = ('patient', 'ambulance', 'hospital')
+
+# Socket.IO rooms the batches go to. Clients start in DEFAULT_ROOM (everything in one batch);
+# a subscription replaces it with the rooms of what the client renders.
+DEFAULT_ROOM = 'all'
+STATS_ROOM = 'stats'  # Extras (LLM, Synthea, warm pool, work queue stats)
+
+def log_room(channel):
+    return f'logs:{channel}'
+
+def state_room(view):
+    """Room of a state view: 'all', 'hospital:<id>' or 'region:<name>' (see state_fn)."""
+    return f'state:{view}'
+
+class BatchEmitter:
+    """Coalesce log entries and state changes into one 'batch_update' message per room and broadcast tick.
+
+    Producers (log_event, the movement loop, hospital queues, socket handlers) only record
+    what changed; a single broadcaster thread builds the state snapshots and emits at most
+    once per tick, so simulation threads never block on Socket.IO. state_fn(view) returns a
+    snapshot already encoded, so one encoding serves every client of the room.
+
+    Only rooms with members get a batch, and a state view is built once per tick however
+    many rooms and clients use it: DEFAULT_ROOM gets the whole batch below, a log room only
+    its channel, STATS_ROOM only the extras and a state room only its view's 'state'.
+    set_rooms() records which rooms a client is in (the caller joins the Socket.IO rooms).
+
+    Batch payload:
+        {
+            'logs': {'patient': [newest, ..., oldest_new], ...},  # only new entries
+            'logs_reset': ['patient', ...],                       # channels to clear first
+            'log_capacity': 50,
+            'state': '{...}',                                     # only if state changed (JSON text or MessagePack bytes)
+            '<extra>': {...}                                      # e.g. request_counts
+        }
+    """
+
+    def __init__(self, emit_fn, state_fn, rate_hz=20, log_capacity=50):
+        self._emit = emit_fn
+        self._state_fn = state_fn
+        self.rate_hz = rate_hz
+        self.log_capacity = log_capacity
+        self._lock = Lock()
+        self._pending_logs = {channel: [] for channel in LOG_CHANNELS}
+        self._reset_channels = set()
+        self._state_dirty = False
+        self._last_states = {}
+        self._extras = {}
+        self._client_rooms = {}
+        self._room_members = {}
+        self._thread = None
+        self._running = False
+
+    def add_log(self, channel, entry):
+        """Queue a new log entry for the given channel."""
+        with self._lock:
+            pending = self._pending_logs.setdefault(channel, [])
+            pending.append(entry)
+            # Clients only keep log_capacity entries, so never send more than that
+            if len(pending) > self.log_capacity:
+                del pending[0]
+
+    def reset_logs(self, channels=LOG_CHANNELS):
+        """Tell clients to clear the given log channels on the next flush."""
+        with self._lock:
+            for channel in channels:
+                self._pending_logs[channel] = []
+                self._reset_channels.add(channel)
+
+    def mark_state_dirty(self):
+        """Request a state snapshot on the next flush."""
+        self._state_dirty = True
+
+    def set_extra(self, key, value):
+        """Send the latest value for a side channel (e.g. request counts) on the next flush."""
+        with self._lock:
+            self._extras[key] = value
+
+    def set_rooms(self, client_id, rooms):
+        """Replace a client's rooms. Returns (rooms to leave, rooms to join)."""
+        rooms = frozenset(rooms)
+        with self._lock:
+            old = self._client_rooms.pop(client_id, frozenset())
+            if rooms:
+                self._client_rooms[client_id] = rooms
+            for room in old - rooms:
+                self._room_members[room] -= 1
+                if not self._room_members[room]:
+                    del self._room_members[room]
+            for room in rooms - old:
+                self._room_members[room] = self._room_members.get(room, 0) + 1
+        return old - rooms, rooms - old
+
+    def remove_client(self, client_id):
+        self.set_rooms(client_id, ())
+
+    def build_batches(self):
+        """Drain pending work into [(room, batch payload)], empty if nothing changed."""
+        with self._lock:
+            logs = {channel: list(reversed(entries)) for channel, entries in self._pending_logs.items() if entries}
+            for channel in logs:
+                self._pending_logs[channel] = []
+            reset_channels = sorted(self._reset_channels)
+            self._reset_channels.clear()
+            extras = self._extras
+            self._extras = {}
+            state_dirty = self._state_dirty
+            self._state_dirty = False
+            rooms = sorted(self._room_members)
+
+        if not (logs or reset_channels or extras or state_dirty):
+            return []
+
+        states = {}
+
+        def state(view):
+            if view not in states:
+                states[view] = self._state_fn(view)
+            return states[view]
+
+        batches = []
+        for room in rooms:
+            if room == DEFAULT_ROOM:
+                batch = dict(extras)
+                if logs or reset_channels:
+                    batch['logs'] = logs
+                    batch['logs_reset'] = reset_channels
+                    batch['log_capacity'] = self.log_capacity
+                if state_dirty:
+                    batch['state'] = state('all')
+            elif room == STATS_ROOM:
+                batch = dict(extras)
+            elif room.startswith('logs:'):
+                channel = room[len('logs:'):]
+                batch = {}
+                if channel in logs or channel in reset_channels:
+                    batch = {'logs': {channel: logs.get(channel, [])}, 'log_capacity': self.log_capacity,
+                             'logs_reset': [channel] if channel in reset_channels else []}
+            elif room.startswith('state:'):
+                batch = {'state': state(room[len('state:'):])} if state_dirty else {}
+            else:
+                batch = {}
+            if batch:
+                batches.append((room, batch))
+        if state_dirty:
+            # Views nobody watched this tick are rebuilt on demand (current_state)
+            self._last_states = states
+        return batches
+
+    def current_state(self, view='all'):
+        """The last broadcast snapshot of a view if nothing changed since, else a new one (e.g. for a connecting client)."""
+        state = self._last_states.get(view)
+        if state is None or self._state_dirty:
+            state = self._state_fn(view)
+        return state
+
+    def flush(self):
+        """Emit pending changes, one message per room. Returns True if anything was sent."""
+        batches = self.build_batches()
+        for room, batch in batches:
+            self._emit('batch_update', batch, room)
+        return bool(batches)
+
+    def start(self):
+        """Start the broadcaster thread."""
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = Thread(target=self._run, name='batch-emitter', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+
+    def _run(self):
+        while self._running:
+            started = time.monotonic()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("Error flushing batched emissions: %s", e)
+            interval = 1.0 / max(0.1, float(self.rate_hz))
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
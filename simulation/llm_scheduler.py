@@ -0,0 +1,183 @@
+import heapq
+import itertools
+import logging
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from threading import Condition, Lock, Thread
+
+from fhir_generators.llm_client import request_deadline
+
+logger = logging.getLogger(__name__)
+
+# Priority classes: lower runs first
+PRIORITY_ENCOUNTER = 0  # A patient is already in treatment
+PRIORITY_CONDITION = 1  # A patient is arriving
+PRIORITY_BACKGROUND = 2  # Warm pool and other speculative work
+
+PRIORITY_NAMES = {PRIORITY_ENCOUNTER: 'encounter', PRIORITY_CONDITION: 'condition', PRIORITY_BACKGROUND: 'background'}
+
+class LLMQueueFull(Exception):
+    """Raised by submit() when a model's queue is at max_queue."""
+
+class LLMRequestCancelled(Exception):
+    """Set on a request's future when it is dropped before running (cancelled or past its deadline)."""
+
+class _Request:
+    __slots__ = ('future', 'fn', 'args', 'kwargs', 'priority', 'deadline', 'cancel_if', 'enqueued')
+
+    def __init__(self, fn, args, kwargs, priority, deadline, cancel_if):
+        self.future = Future()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.deadline = deadline
+        self.cancel_if = cancel_if
+        self.enqueued = time.monotonic()
+
+class _ModelQueue:
+    """Priority queue and worker threads for one model."""
+
+    def __init__(self, model, concurrency):
+        self.model = model
+        self.concurrency = concurrency
+        self.heap = []
+        self.cond = Condition()
+        self.running = 0
+        self.metrics = {
+            'submitted': 0, 'completed': 0, 'failed': 0, 'expired': 0, 'cancelled': 0, 'rejected': 0,
+            'avg_wait_ms': None, 'max_wait_ms': 0.0, 'avg_run_ms': None
+        }
+
+class LLMScheduler:
+    """Runs LLM calls on per-model worker threads, by priority, with deadlines and cancellation.
+
+    Each model gets `concurrency` workers (so one slow model cannot starve another) and a
+    priority queue bounded at max_queue. A request is dropped without calling the LLM if
+    its deadline passes or cancel_if() becomes true while it waits. While running, every
+    call made through fhir_generators.llm_client is bounded by the request deadline.
+    """
+
+    def __init__(self, default_concurrency=1, concurrency=None, max_queue=100, default_timeout=120.0):
+        self.default_concurrency = default_concurrency
+        self.concurrency = dict(concurrency or {})
+        self.max_queue = max_queue
+        self.default_timeout = default_timeout
+        self._queues = {}
+        self._lock = Lock()
+        self._seq = itertools.count()
+
+    def _queue(self, model):
+        with self._lock:
+            queue = self._queues.get(model)
+            if queue is None:
+                queue = self._queues[model] = _ModelQueue(model, max(1, self.concurrency.get(model, self.default_concurrency)))
+                for i in range(queue.concurrency):
+                    Thread(target=self._worker, args=(queue,), name=f'llm-{model}-{i}', daemon=True).start()
+            return queue
+
+    def submit(self, model, fn, *args, priority=PRIORITY_CONDITION, timeout=None, cancel_if=None, **kwargs):
+        """Queue fn(*args, **kwargs) for model and return a Future for its result."""
+        queue = self._queue(model)
+        deadline = time.monotonic() + (self.default_timeout if timeout is None else timeout)
+        request = _Request(fn, args, kwargs, priority, deadline, cancel_if)
+        with queue.cond:
+            if len(queue.heap) >= self.max_queue:
+                queue.metrics['rejected'] += 1
+                raise LLMQueueFull(f"LLM queue for {model} is full ({self.max_queue})")
+            queue.metrics['submitted'] += 1
+            heapq.heappush(queue.heap, (priority, deadline, next(self._seq), request))
+            queue.cond.notify()
+        return request.future
+
+    def call(self, model, fn, *args, priority=PRIORITY_CONDITION, timeout=None, cancel_if=None, **kwargs):
+        """Submit and wait for the result; returns None if the request is rejected, dropped, times out or fails."""
+        timeout = self.default_timeout if timeout is None else timeout
+        try:
+            future = self.submit(model, fn, *args, priority=priority, timeout=timeout, cancel_if=cancel_if, **kwargs)
+        except LLMQueueFull as e:
+            logger.warning(str(e))
+            return None
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            future.cancel()
+            logger.warning("LLM %s request for %s timed out after %.0fs", PRIORITY_NAMES.get(priority, priority), model, timeout)
+        except LLMRequestCancelled as e:
+            logger.info(str(e))
+        except Exception as e:
+            logger.error("LLM request for %s failed: %s", model, e)
+        return None
+
+    def _worker(self, queue):
+        while True:
+            with queue.cond:
+                while not queue.heap:
+                    queue.cond.wait()
+                _, _, _, request = heapq.heappop(queue.heap)
+                waited_ms = (time.monotonic() - request.enqueued) * 1000.0
+                m = queue.metrics
+                m['avg_wait_ms'] = round(waited_ms if m['avg_wait_ms'] is None else 0.8 * m['avg_wait_ms'] + 0.2 * waited_ms, 1)
+                m['max_wait_ms'] = round(max(m['max_wait_ms'], waited_ms), 1)
+
+            reason = self._drop_reason(request)
+            if reason:
+                with queue.cond:
+                    queue.metrics[reason] += 1
+                if request.future.set_running_or_notify_cancel():
+                    request.future.set_exception(LLMRequestCancelled(
+                        f"LLM {PRIORITY_NAMES.get(request.priority, request.priority)} request for {queue.model} {reason} before it ran"))
+                continue
+            if not request.future.set_running_or_notify_cancel():
+                with queue.cond:
+                    queue.metrics['cancelled'] += 1
+                continue
+
+            with queue.cond:
+                queue.running += 1
+            started = time.monotonic()
+            try:
+                with request_deadline(request.deadline):
+                    result = request.fn(*request.args, **request.kwargs)
+            except Exception as e:
+                outcome = 'failed'
+                request.future.set_exception(e)
+            else:
+                outcome = 'completed'
+                request.future.set_result(result)
+            run_ms = (time.monotonic() - started) * 1000.0
+            with queue.cond:
+                queue.running -= 1
+                m = queue.metrics
+                m[outcome] += 1
+                m['avg_run_ms'] = round(run_ms if m['avg_run_ms'] is None else 0.8 * m['avg_run_ms'] + 0.2 * run_ms, 1)
+
+    @staticmethod
+    def _drop_reason(request):
+        if request.future.cancelled():
+            return 'cancelled'
+        if time.monotonic() >= request.deadline:
+            return 'expired'
+        if request.cancel_if is not None:
+            try:
+                if request.cancel_if():
+                    return 'cancelled'
+            except Exception:
+                pass
+        return None
+
+    def stats(self):
+        """Per-model queue depth, running count, outcomes and wait/run times, plus totals."""
+        with self._lock:
+            queues = list(self._queues.values())
+        models = {}
+        totals = {'queued': 0, 'running': 0, 'submitted': 0, 'completed': 0, 'failed': 0, 'expired': 0, 'cancelled': 0, 'rejected': 0}
+        for queue in queues:
+            with queue.cond:
+                entry = dict(queue.metrics, queued=len(queue.heap), running=queue.running, concurrency=queue.concurrency)
+            models[queue.model] = entry
+            for key in totals:
+                totals[key] += entry[key]
+        waits = [(e['avg_wait_ms'], e['submitted']) for e in models.values() if e['avg_wait_ms'] is not None]
+        totals['avg_wait_ms'] = round(sum(w * n for w, n in waits) / max(1, sum(n for _, n in waits)), 1) if waits else None
+        return dict(totals, models=models)
@@ -0,0 +1,125 @@
+import atexit
+import copy
+import json
+import logging
+import queue
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+class LazyQueueHandler(QueueHandler):
+    """QueueHandler that leaves everything but the message to the background listener thread.
+
+    The message is rendered here, on the calling thread, because its arguments (live dicts,
+    lazy_json of a resource another thread is changing) are only safe to read now; the record
+    was created only because its level is enabled, so disabled debug calls still cost nothing.
+    The traceback is rendered here too. Timestamps, the line layout or JSON and the file and
+    console writes happen on the listener.
+    """
+
+    _traceback_formatter = logging.Formatter()
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = record.exc_text or self._traceback_formatter.formatException(record.exc_info)
+            record.exc_info = None  # Tracebacks hold frames (and their locals) alive
+        return record
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, category (logger name), message and any extras."""
+
+    _RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+            'level': record.levelname,
+            'category': record.name,
+            'message': record.getMessage(),
+            'thread': record.threadName
+        }
+        # Structured fields passed via logger.info(..., extra={...})
+        for key, value in vars(record).items():
+            if key not in self._RESERVED and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_text or record.exc_info:
+            entry['exc_info'] = record.exc_text or self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class lazy_json:
+    """Wrap an object so it is only serialized if the log record is actually emitted.
+
+    logger.debug("Condition: %s", lazy_json(condition_dict))
+    """
+
+    __slots__ = ('obj', 'indent')
+
+    def __init__(self, obj, indent=None):
+        self.obj = obj
+        self.indent = indent
+
+    def __str__(self):
+        try:
+            return json.dumps(self.obj, indent=self.indent, default=str)
+        except Exception:
+            return repr(self.obj)
+
+_listener = None
+_handlers = []
+
+def parse_category_levels(items):
+    """Parse ['fhir_generators=DEBUG', 'ambosim.hospital=WARNING'] into {name: level}."""
+    levels = {}
+    for item in items or []:
+        name, sep, level = str(item).partition('=')
+        if not sep or not name.strip():
+            raise ValueError(f"Expected CATEGORY=LEVEL, got {item!r}")
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+def configure_logging(log_file='simulation.log', level='INFO', json_format=False, category_levels=None):
+    """Route all logging through a queue drained by a background writer thread.
+
+    Callers only enqueue records; the file and console handlers run on the listener
+    thread. category_levels maps logger names (e.g. 'ambosim', 'fhir_generators') to
+    levels. Calling this again replaces the previous configuration, closing its handlers.
+    """
+    global _listener, _handlers
+    shutdown_logging()
+
+    formatter = JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.insert(0, logging.FileHandler(log_file))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(LazyQueueHandler(log_queue))
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    for name, category_level in (category_levels or {}).items():
+        logging.getLogger(name).setLevel(category_level)
+
+    _handlers = handlers
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+def shutdown_logging():
+    """Drain queued records, stop the writer thread and close its handlers."""
+    global _listener, _handlers
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    for handler in _handlers:
+        handler.close()
+    _handlers = []
+
+atexit.register(shutdown_logging)
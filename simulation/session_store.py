@@ -0,0 +1,357 @@
+import argparse
+import json
+import logging
+import os
+import queue
+import sqlite3
+import sys
+from datetime import datetime, timezone
+from threading import Thread
+
+from simulation.sinks import EventSink
+
+logger = logging.getLogger(__name__)
+
+# python3 -m simulation.session_store fhir_export/session_20251015_220108/session.sqlite patient pat-1234
+# python3 -m simulation.session_store session.sqlite events --type ramping --hospital 2
+# python3 -m simulation.session_store session.sqlite import fhir_export/session_20251015_220108
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts TEXT,
+    event_type TEXT,
+    category TEXT,
+    patient_ref TEXT,
+    hospital_id INTEGER,
+    ambulance_id INTEGER,
+    message TEXT,
+    payload TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_events_patient ON events (patient_ref, ts);
+CREATE INDEX IF NOT EXISTS idx_events_type ON events (event_type, ts);
+CREATE INDEX IF NOT EXISTS idx_events_hospital ON events (hospital_id, ts);
+CREATE INDEX IF NOT EXISTS idx_events_ambulance ON events (ambulance_id, ts);
+CREATE INDEX IF NOT EXISTS idx_events_ts ON events (ts);
+
+CREATE TABLE IF NOT EXISTS resources (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts TEXT,
+    resource_type TEXT,
+    resource_id TEXT,
+    patient_ref TEXT,
+    payload TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_resources_patient ON resources (patient_ref, ts);
+CREATE INDEX IF NOT EXISTS idx_resources_type ON resources (resource_type, ts);
+CREATE INDEX IF NOT EXISTS idx_resources_id ON resources (resource_id);
+CREATE INDEX IF NOT EXISTS idx_resources_ts ON resources (ts);
+"""
+
+_STOP = object()
+
+def _now_iso():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def normalize_patient_ref(value):
+    """Accept 'pat-1234' or 'Patient/pat-1234' and return 'Patient/pat-1234'."""
+    if not value:
+        return None
+    value = str(value)
+    return value if value.startswith('Patient/') else f"Patient/{value}"
+
+def _hospital_id_from_payload(payload):
+    for key in ('hospitalId', 'toHospitalId'):
+        value = payload.get(key)
+        if isinstance(value, int):
+            return value
+    # Discharge events only carry a location reference (Location/hospital{id})
+    location = payload.get('location')
+    ref = location.get('reference') if isinstance(location, dict) else None
+    if isinstance(ref, str) and ref.startswith('Location/hospital'):
+        try:
+            return int(ref[len('Location/hospital'):])
+        except ValueError:
+            return None
+    return None
+
+def _patient_ref_from_resource(resource_type, resource):
+    if resource.get('resourceType') == 'Patient' or resource_type == 'patient':
+        return normalize_patient_ref(resource.get('id'))
+    subject = resource.get('subject')
+    if isinstance(subject, dict):
+        return normalize_patient_ref(subject.get('reference'))
+    return None
+
+def _resource_timestamp(resource):
+    period = resource.get('period') if isinstance(resource.get('period'), dict) else {}
+    return period.get('end') or period.get('start') or resource.get('recordedDate') or _now_iso()
+
+class SessionStore(EventSink):
+    """Embedded SQLite index of the simulation's events and FHIR resources.
+
+    Writes are queued and committed in batches by a background writer thread so the
+    simulation threads never wait on disk. Events are indexed by patient reference,
+    event type, hospital id, ambulance id and timestamp; resources by patient reference,
+    resource type, id and timestamp.
+    """
+
+    def __init__(self, path, batch_size=200):
+        self.path = path
+        self.batch_size = batch_size
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+        self._queue = queue.Queue()
+        self._writer = Thread(target=self._write_loop, name='session-store-writer', daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    # --- writes -------------------------------------------------------------
+
+    def write_event(self, payload, category=None, message=None):
+        """Queue an event payload (a dict with 'eventType') for indexing."""
+        if not isinstance(payload, dict):
+            return
+        ambulance = payload.get('ambulance') if isinstance(payload.get('ambulance'), dict) else {}
+        patient = payload.get('patient') if isinstance(payload.get('patient'), dict) else {}
+        row = (
+            payload.get('timestamp') or _now_iso(),
+            str(payload.get('eventType', 'event')).lower(),
+            category,
+            normalize_patient_ref(patient.get('reference')),
+            _hospital_id_from_payload(payload),
+            ambulance.get('id'),
+            message,
+            json.dumps(payload)
+        )
+        self._queue.put(('event', row))
+
+    def write_resource(self, resource_type, resource, patient_ref=None):
+        """Queue a FHIR resource for indexing. patient_ref overrides the resource's subject."""
+        if not isinstance(resource, dict):
+            return
+        row = (
+            _resource_timestamp(resource),
+            resource_type.lower(),
+            resource.get('id'),
+            normalize_patient_ref(patient_ref) or _patient_ref_from_resource(resource_type, resource),
+            json.dumps(resource)
+        )
+        self._queue.put(('resource', row))
+
+    def flush(self):
+        """Block until every queued write has been committed."""
+        self._queue.join()
+
+    def close(self):
+        self._queue.put(_STOP)
+        self._writer.join(timeout=10)
+
+    def _write_loop(self):
+        conn = self._connect()
+        try:
+            while True:
+                item = self._queue.get()
+                items = [item]
+                # Drain whatever else is waiting so it is committed in one transaction
+                while len(items) < self.batch_size:
+                    try:
+                        items.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                stop = any(i is _STOP for i in items)
+                writes = [i for i in items if i is not _STOP]
+                events = [row for kind, row in writes if kind == 'event']
+                resources = [row for kind, row in writes if kind == 'resource']
+                try:
+                    with conn:
+                        if events:
+                            conn.executemany(
+                                'INSERT INTO events (ts, event_type, category, patient_ref, hospital_id, ambulance_id, message, payload) '
+                                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', events)
+                        if resources:
+                            conn.executemany(
+                                'INSERT INTO resources (ts, resource_type, resource_id, patient_ref, payload) '
+                                'VALUES (?, ?, ?, ?, ?)', resources)
+                except Exception as e:
+                    logger.error("Error writing to session store: %s", e)
+                finally:
+                    for _ in items:
+                        self._queue.task_done()
+                if stop:
+                    return
+        finally:
+            conn.close()
+
+    # --- queries ------------------------------------------------------------
+
+    def _query(self, sql, params):
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        try:
+            rows = conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+        results = []
+        for row in rows:
+            item = dict(row)
+            item['payload'] = json.loads(item['payload']) if item.get('payload') else None
+            results.append(item)
+        return results
+
+    def query_events(self, patient=None, event_type=None, hospital_id=None, ambulance_id=None,
+                     since=None, until=None, limit=None):
+        """Return events matching all given filters, oldest first."""
+        clauses, params = [], []
+        if patient:
+            clauses.append('patient_ref = ?')
+            params.append(normalize_patient_ref(patient))
+        if event_type:
+            clauses.append('event_type = ?')
+            params.append(event_type.lower())
+        if hospital_id is not None:
+            clauses.append('hospital_id = ?')
+            params.append(int(hospital_id))
+        if ambulance_id is not None:
+            clauses.append('ambulance_id = ?')
+            params.append(int(ambulance_id))
+        if since:
+            clauses.append('ts >= ?')
+            params.append(since)
+        if until:
+            clauses.append('ts <= ?')
+            params.append(until)
+        sql = 'SELECT seq, ts, event_type, category, patient_ref, hospital_id, ambulance_id, message, payload FROM events'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY ts, seq'
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(int(limit))
+        return self._query(sql, params)
+
+    def query_resources(self, patient=None, resource_type=None, resource_id=None, limit=None):
+        """Return resources matching all given filters, oldest first."""
+        clauses, params = [], []
+        if patient:
+            clauses.append('patient_ref = ?')
+            params.append(normalize_patient_ref(patient))
+        if resource_type:
+            clauses.append('resource_type = ?')
+            params.append(resource_type.lower())
+        if resource_id:
+            clauses.append('resource_id = ?')
+            params.append(resource_id)
+        sql = 'SELECT seq, ts, resource_type, resource_id, patient_ref, payload FROM resources'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY ts, seq'
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(int(limit))
+        return self._query(sql, params)
+
+    def patient_timeline(self, patient):
+        """Everything that happened to a patient: events and resources merged in time order."""
+        items = [dict(item, kind='event') for item in self.query_events(patient=patient)]
+        items += [dict(item, kind='resource') for item in self.query_resources(patient=patient)]
+        items.sort(key=lambda item: (item.get('ts') or '', item['kind'], item['seq']))
+        return items
+
+    def stats(self):
+        conn = self._connect()
+        try:
+            return {
+                'events': dict(conn.execute('SELECT event_type, COUNT(*) FROM events GROUP BY event_type').fetchall()),
+                'resources': dict(conn.execute('SELECT resource_type, COUNT(*) FROM resources GROUP BY resource_type').fetchall())
+            }
+        finally:
+            conn.close()
+
+    # --- backfill -----------------------------------------------------------
+
+    def import_session_dir(self, session_dir):
+        """Index an existing fhir_export session directory. Returns the number of files read."""
+        count = 0
+        for root, _, files in os.walk(session_dir):
+            rel = os.path.relpath(root, session_dir).split(os.sep)
+            for filename in sorted(files):
+                if not filename.endswith('.json'):
+                    continue
+                try:
+                    with open(os.path.join(root, filename), 'r') as f:
+                        data = json.load(f)
+                except Exception as e:
+                    logger.warning("Skipping unreadable file %s: %s", filename, e)
+                    continue
+                if rel[0] == 'event':
+                    self.write_event(data)
+                elif rel[0] != '.':
+                    self.write_resource(rel[0], data)
+                count += 1
+        self.flush()
+        return count
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Query an ambo_sim session store')
+    parser.add_argument('db', help='Path to the session store (SQLite file)')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_patient = sub.add_parser('patient', help='Timeline of everything that happened to a patient')
+    p_patient.add_argument('patient_id')
+
+    p_events = sub.add_parser('events', help='Filter events')
+    p_events.add_argument('--type', dest='event_type')
+    p_events.add_argument('--patient')
+    p_events.add_argument('--hospital', type=int)
+    p_events.add_argument('--ambulance', type=int)
+    p_events.add_argument('--since')
+    p_events.add_argument('--until')
+    p_events.add_argument('--limit', type=int)
+
+    p_resources = sub.add_parser('resources', help='Filter FHIR resources')
+    p_resources.add_argument('--type', dest='resource_type')
+    p_resources.add_argument('--patient')
+    p_resources.add_argument('--id', dest='resource_id')
+    p_resources.add_argument('--limit', type=int)
+
+    p_import = sub.add_parser('import', help='Index an existing fhir_export session directory')
+    p_import.add_argument('session_dir')
+
+    sub.add_parser('stats', help='Counts per event and resource type')
+
+    args = parser.parse_args(argv)
+    if args.command != 'import' and not os.path.exists(args.db):
+        print(f"Session store not found: {args.db}")
+        return 1
+    store = SessionStore(args.db)
+    try:
+        if args.command == 'patient':
+            results = store.patient_timeline(args.patient_id)
+        elif args.command == 'events':
+            results = store.query_events(patient=args.patient, event_type=args.event_type,
+                                         hospital_id=args.hospital, ambulance_id=args.ambulance,
+                                         since=args.since, until=args.until, limit=args.limit)
+        elif args.command == 'resources':
+            results = store.query_resources(patient=args.patient, resource_type=args.resource_type,
+                                            resource_id=args.resource_id, limit=args.limit)
+        elif args.command == 'import':
+            count = store.import_session_dir(args.session_dir)
+            print(f"Indexed {count} files from {args.session_dir} into {args.db}")
+            return 0
+        else:
+            print(json.dumps(store.stats(), indent=2))
+            return 0
+        for item in results:
+            print(json.dumps(item))
+        return 0
+    finally:
+        store.close()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,200 @@
+import json
+import logging
+from abc import ABC, abstractmethod
+import queue
+import time
+from collections import defaultdict
+from threading import Lock, Thread
+
+logger = logging.getLogger(__name__)
+
+# Event types are renamed on persistence (directory names and topic names), see save_event_payload
+EVENT_TYPE_RENAMES = {
+    'location': 'hospital_location',
+    'redirect': 'ambulance_redirect'
+}
+
+def event_save_type(event_type):
+    """Persistence name for an event type, e.g. 'location' -> 'hospital_location'."""
+    event_type = str(event_type or 'event').lower()
+    return EVENT_TYPE_RENAMES.get(event_type, event_type)
+
+def resource_topic(resource_type):
+    """Topic for a FHIR resource type, matching the kafka_producer topics (patient, condition, ...)."""
+    return resource_type.lower()
+
+def event_topic(event_type):
+    """Topic for an event payload, matching the kafka_producer topics (event_ramping, ...)."""
+    return f"event_{event_save_type(event_type)}"
+
+def _patient_key(payload):
+    """Partition key: the patient id, so each patient's messages stay ordered."""
+    ref = None
+    if isinstance(payload.get('patient'), dict):
+        ref = payload['patient'].get('reference')
+    elif isinstance(payload.get('subject'), dict):
+        ref = payload['subject'].get('reference')
+    elif payload.get('resourceType') == 'Patient':
+        ref = payload.get('id')
+    return str(ref).split('/')[-1] if ref else None
+
+class EventSink(ABC):
+    """Destination that receives every FHIR resource and event as the simulation produces them."""
+
+    @abstractmethod
+    def write_resource(self, resource_type, resource, patient_ref=None):
+        pass
+
+    @abstractmethod
+    def write_event(self, payload, category=None, message=None):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+class TopicSink(EventSink):
+    """Publishes resources and events to topics named like the existing Kafka topics.
+
+    publish() only enqueues; a background thread sends messages in batches of up to
+    batch_size, waiting at most linger_ms for a batch to fill. on_delivery(topic, key, error)
+    is called for every message once the broker acknowledges it (error is None) or fails.
+    """
+
+    def __init__(self, topic_prefix='', batch_size=100, linger_ms=5, on_delivery=None):
+        self.topic_prefix = topic_prefix
+        self.batch_size = batch_size
+        self.linger_ms = linger_ms
+        self.on_delivery = on_delivery
+        self._queue = queue.Queue()
+        self._counts_lock = Lock()
+        self._counts = {'published': 0, 'delivered': 0, 'failed': 0}
+        self._running = True
+        self._sender = Thread(target=self._send_loop, name=f'{type(self).__name__}-sender', daemon=True)
+        self._sender.start()
+
+    def write_resource(self, resource_type, resource, patient_ref=None):
+        key = str(patient_ref).split('/')[-1] if patient_ref else _patient_key(resource)
+        self.publish(resource_topic(resource_type), resource, key=key)
+
+    def write_event(self, payload, category=None, message=None):
+        self.publish(event_topic(payload.get('eventType')), payload, key=_patient_key(payload))
+
+    def publish(self, topic, value, key=None):
+        with self._counts_lock:
+            self._counts['published'] += 1
+        self._queue.put((self.topic_prefix + topic, key, json.dumps(value).encode('utf-8')))
+
+    def stats(self):
+        with self._counts_lock:
+            return dict(self._counts, queued=self._queue.qsize())
+
+    def flush(self):
+        """Block until every published message has been handed to the broker."""
+        self._queue.join()
+
+    def close(self):
+        self.flush()
+        self._running = False
+
+    def _delivered(self, topic, key, error=None):
+        with self._counts_lock:
+            self._counts['failed' if error else 'delivered'] += 1
+        if error:
+            logger.error("Delivery to topic %s failed: %s", topic, error)
+        if self.on_delivery:
+            try:
+                self.on_delivery(topic, key, error)
+            except Exception as e:
+                logger.error("Error in delivery callback: %s", e)
+
+    def _send_loop(self):
+        while self._running:
+            try:
+                batch = [self._queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.linger_ms / 1000.0
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._send_batch(batch)
+            except Exception as e:
+                for topic, key, _ in batch:
+                    self._delivered(topic, key, e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    @abstractmethod
+    def _send_batch(self, messages):
+        """Send a list of (topic, key, value_bytes); call self._delivered for each message."""
+
+class KafkaSink(TopicSink):
+    """Publishes directly to a Kafka-compatible broker using kafka-python."""
+
+    def __init__(self, broker='localhost:9092', **kwargs):
+        try:
+            from kafka import KafkaProducer
+        except ImportError as e:
+            raise RuntimeError("KafkaSink requires kafka-python (pip install kafka-python)") from e
+        self.producer = KafkaProducer(
+            bootstrap_servers=[broker],
+            max_request_size=40485760,  # Match broker config from docker-compose
+            api_version=(3, 5, 1),
+            linger_ms=kwargs.get('linger_ms', 5)
+        )
+        super().__init__(**kwargs)
+
+    def _send_batch(self, messages):
+        for topic, key, value in messages:
+            future = self.producer.send(topic, key=key.encode('utf-8') if key else None, value=value)
+            future.add_callback(lambda _, t=topic, k=key: self._delivered(t, k))
+            future.add_errback(lambda err, t=topic, k=key: self._delivered(t, k, err))
+        self.producer.flush()
+
+    def close(self):
+        super().close()
+        self.producer.close()
+
+class InMemoryBroker:
+    """Local stand-in for a Kafka broker: topics are in-memory lists of (key, value) messages."""
+
+    def __init__(self):
+        self._topics = defaultdict(list)
+        self._lock = Lock()
+
+    def append(self, topic, key, value):
+        with self._lock:
+            self._topics[topic].append((key, value))
+            return len(self._topics[topic]) - 1
+
+    def topics(self):
+        with self._lock:
+            return sorted(self._topics)
+
+    def messages(self, topic, decode=True):
+        """Messages on a topic in publish order; values are JSON-decoded unless decode=False."""
+        with self._lock:
+            messages = list(self._topics.get(topic, []))
+        if not decode:
+            return messages
+        return [(key, json.loads(value)) for key, value in messages]
+
+class InMemorySink(TopicSink):
+    """TopicSink that delivers to an InMemoryBroker (for tests and local runs without Kafka)."""
+
+    def __init__(self, broker=None, **kwargs):
+        self.broker = broker or InMemoryBroker()
+        super().__init__(**kwargs)
+
+    def _send_batch(self, messages):
+        for topic, key, value in messages:
+            self.broker.append(topic, key, value)
+            self._delivered(topic, key)
@@ -0,0 +1,150 @@
+import functools
+import json
+
+_MISSING = object()
+
+@functools.lru_cache(maxsize=None)
+def _json_key(key):
+    return json.dumps(key) + ':'
+
+class JSONCodec:
+    """State fragments as compact JSON text."""
+    name = 'json'
+
+    def encode(self, value):
+        if type(value) is int:  # Per-frame wait times
+            return str(value)
+        return json.dumps(value, separators=(',', ':'))
+
+    def extend(self, fragment, pairs):
+        """An encoded object with (key, encoded value) pairs added."""
+        # One join, so large values (discharged lists) are copied once per snapshot
+        parts = [fragment[:-1]]
+        for key, value in pairs:
+            parts += (',', _json_key(key), value)
+        parts.append('}')
+        return ''.join(parts)
+
+    def object(self, pairs):
+        parts = ['{']
+        for key, value in pairs:
+            parts += (_json_key(key), value, ',')
+        if pairs:
+            parts.pop()
+        parts.append('}')
+        return ''.join(parts)
+
+    def join(self, fragments):
+        """Body of an array of encoded items (see array())."""
+        return ','.join(fragments)
+
+    def concat(self, body, more):
+        return f'{body},{more}' if body and more else body or more
+
+    def array(self, body, count):
+        return f'[{body}]'
+
+class MessagePackCodec:
+    """State fragments as MessagePack bytes (needs the msgpack package).
+
+    Arrays and maps are a header followed by their encoded items, so cached fragments are
+    joined without re-encoding them. Entity maps have fewer than 16 keys (a one-byte header).
+    """
+    name = 'msgpack'
+
+    def __init__(self):
+        try:
+            import msgpack
+        except ImportError as e:
+            raise RuntimeError("MessagePack state frames require msgpack (pip install msgpack)") from e
+        self._packb = msgpack.packb
+
+    def encode(self, value):
+        return self._packb(value)
+
+    def extend(self, fragment, pairs):
+        count = (fragment[0] & 0x0f) + len(pairs)
+        if fragment[0] & 0xf0 != 0x80 or count > 15:
+            raise ValueError("MessagePackCodec.extend needs a map of fewer than 16 keys")
+        parts = [bytes((0x80 | count,)), fragment[1:]]
+        for key, value in pairs:
+            parts += (self._packb(key), value)
+        return b''.join(parts)
+
+    def object(self, pairs):
+        parts = [self._header(len(pairs), 0x80, b'\xde', b'\xdf')]
+        for key, value in pairs:
+            parts += (self._packb(key), value)
+        return b''.join(parts)
+
+    def join(self, fragments):
+        return b''.join(fragments)
+
+    def concat(self, body, more):
+        return body + more
+
+    def array(self, body, count):
+        return self._header(count, 0x90, b'\xdc', b'\xdd') + body
+
+    @staticmethod
+    def _header(count, fix, marker16, marker32):
+        if count < 16:
+            return bytes((fix | count,))
+        if count < 0x10000:
+            return marker16 + count.to_bytes(2, 'big')
+        return marker32 + count.to_bytes(4, 'big')
+
+CODECS = {'json': JSONCodec, 'msgpack': MessagePackCodec}
+
+class Tracked:
+    """Mixin for simulation entities serialized into the state snapshot.
+
+    Assigning a different value to one of state_fields bumps state_version, so the entity's
+    cached fragment is only re-encoded after it changed. In-place changes the setter cannot
+    see (appending to a list field) call touch().
+    """
+    state_fields = frozenset()
+
+    def __setattr__(self, name, value):
+        d = self.__dict__
+        changed = name in self.state_fields and d.get(name, _MISSING) != value
+        d[name] = value
+        if changed:
+            # After the assignment: a fragment built from the old value gets a stale version
+            d['state_version'] = d.get('state_version', 0) + 1
+
+    def touch(self):
+        d = self.__dict__
+        d['state_version'] = d.get('state_version', 0) + 1
+
+    def state_fragment(self, build, codec, depends=None):
+        """build(self) encoded with codec, reused while the entity (and depends, e.g. the patient
+        an ambulance carries) is unchanged."""
+        d = self.__dict__
+        version = (d.get('state_version', 0), depends.__dict__.get('state_version', 0) if depends is not None else None,
+                   codec.name)
+        cached = d.get('_state_fragment')
+        if cached is None or cached[0] != version:
+            cached = d['_state_fragment'] = (version, codec.encode(build(self)))
+        return cached[1]
+
+class AppendOnlyFragments:
+    """Encoded array of a list that only grows (e.g. discharged patients): new items are
+    encoded once and appended to the cached body."""
+
+    def __init__(self):
+        self._codec = None
+        self._count = 0
+        self._body = None
+        self._array = None
+
+    def array(self, items, encode_item, codec):
+        count = len(items)
+        if codec is not self._codec or count < self._count:  # Replaced by a shorter list; start over
+            self._codec, self._count, self._body = codec, 0, codec.join([])
+            self._array = codec.array(self._body, 0)
+        if count > self._count:
+            self._body = codec.concat(self._body, codec.join([encode_item(item) for item in items[self._count:count]]))
+            self._count = count
+            self._array = codec.array(self._body, count)
+        return self._array
@@ -0,0 +1,120 @@
+import logging
+import random
+import time
+from collections import deque
+from threading import Condition, Thread
+
+logger = logging.getLogger(__name__)
+
+class WarmPool:
+    """Pre-generated items kept per bucket between low and high watermarks.
+
+    Background producer threads call produce(bucket) whenever a bucket drops below
+    low_watermark and keep filling it up to high_watermark (the emptiest bucket first).
+    take() never blocks: it returns an item or None, and callers use their fallback.
+    Without a bucket it draws one by weights (uniform by default), so the mix of items
+    handed out follows the weights rather than whichever buckets happen to be filled.
+    If produce_many(bucket, count) is given it is called instead, with the number of items
+    the bucket is short of, and returns a list of up to that many items.
+    """
+
+    def __init__(self, name, produce, buckets, low_watermark=2, high_watermark=5, workers=1, retry_delay=2.0, produce_many=None,
+                 weights=None):
+        self.name = name
+        self.produce = produce
+        self.produce_many = produce_many
+        self.buckets = list(buckets)
+        self.weights = list(weights) if weights is not None else [1] * len(self.buckets)
+        if len(self.weights) != len(self.buckets):
+            raise ValueError(f"{name}: {len(self.weights)} weights for {len(self.buckets)} buckets")
+        self.low_watermark = low_watermark
+        self.high_watermark = max(low_watermark + 1, high_watermark)
+        self.workers = workers
+        self.retry_delay = retry_delay
+        self._items = {bucket: deque() for bucket in self.buckets}
+        self._filling = set()  # Buckets being refilled towards the high watermark
+        self._in_flight = {bucket: 0 for bucket in self.buckets}
+        self._cond = Condition()
+        self._running = False
+        self._metrics = {'produced': 0, 'produce_failures': 0, 'taken': 0, 'misses': 0, 'avg_produce_ms': None}
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        for i in range(self.workers):
+            Thread(target=self._run, name=f'{self.name}-producer-{i}', daemon=True).start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+    def take(self, bucket=None):
+        """Pop an item from bucket (or from one drawn by weights), or None if it is empty."""
+        with self._cond:
+            if bucket is None:
+                bucket = random.choices(self.buckets, weights=self.weights)[0]
+            item = self._items[bucket].popleft() if bucket in self._items and self._items[bucket] else None
+            self._metrics['taken' if item is not None else 'misses'] += 1
+            self._cond.notify_all()
+            return item
+
+    def depth(self):
+        with self._cond:
+            return sum(len(items) for items in self._items.values())
+
+    def metrics(self):
+        with self._cond:
+            return dict(self._metrics,
+                        depth={str(b): len(items) for b, items in self._items.items()},
+                        low_watermark=self.low_watermark, high_watermark=self.high_watermark)
+
+    def _next_bucket(self):
+        """Emptiest bucket that needs items, counting items already being produced."""
+        best = None
+        for bucket in self.buckets:
+            level = len(self._items[bucket]) + self._in_flight[bucket]
+            if level < self.low_watermark:
+                self._filling.add(bucket)
+            elif level >= self.high_watermark:
+                self._filling.discard(bucket)
+            if bucket in self._filling and (best is None or level < best[0]):
+                best = (level, bucket)
+        return best[1] if best else None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and (bucket := self._next_bucket()) is None:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                count = 1
+                if self.produce_many is not None:
+                    count = max(1, self.high_watermark - len(self._items[bucket]) - self._in_flight[bucket])
+                self._in_flight[bucket] += count
+
+            started = time.monotonic()
+            try:
+                items = self.produce_many(bucket, count) if self.produce_many is not None else [self.produce(bucket)]
+            except Exception as e:
+                logger.error("Error producing %s item for %s: %s", self.name, bucket, e)
+                items = [None]
+            produced = [item for item in items or [] if item is not None]
+            elapsed_ms = (time.monotonic() - started) * 1000.0
+
+            with self._cond:
+                self._in_flight[bucket] -= count
+                m = self._metrics
+                if not produced:
+                    m['produce_failures'] += 1
+                if produced:
+                    self._items[bucket].extend(produced)
+                    m['produced'] += len(produced)
+                    item_ms = elapsed_ms / len(produced)
+                    m['avg_produce_ms'] = round(item_ms if m['avg_produce_ms'] is None else 0.8 * m['avg_produce_ms'] + 0.2 * item_ms, 1)
+                    self._cond.notify_all()
+                elif self._running:
+                    self._cond.wait(self.retry_delay)
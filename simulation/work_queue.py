@@ -0,0 +1,158 @@
+import logging
+import time
+from collections import deque
+from threading import Condition, Thread
+
+logger = logging.getLogger(__name__)
+
+# What submit() does when the queue is at max_queue
+OVERFLOW_DEGRADE = 'degrade'  # Run fallback(*args, **kwargs) in the submitting thread instead
+OVERFLOW_DROP = 'drop'        # Discard the task
+OVERFLOW_BLOCK = 'block'      # Wait up to block_timeout for room, then discard
+OVERFLOW_POLICIES = (OVERFLOW_DEGRADE, OVERFLOW_DROP, OVERFLOW_BLOCK)
+
+class _Task:
+    __slots__ = ('fn', 'args', 'kwargs', 'enqueued')
+
+    def __init__(self, fn, args, kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.enqueued = time.monotonic()
+
+class BoundedExecutor:
+    """Worker threads for one workload with a bounded FIFO queue and an overflow policy.
+
+    Unlike ThreadPoolExecutor the backlog cannot grow without limit: once max_queue tasks
+    are waiting, submit() applies the overflow policy (degrade, drop or block). Tasks that
+    waited longer than max_age seconds are not run either: with a fallback they are
+    degraded on the worker, otherwise dropped. Stale work is worth less than fresh work
+    when the simulation clock keeps moving.
+    """
+
+    def __init__(self, name, workers=2, max_queue=100, overflow=OVERFLOW_DROP, fallback=None,
+                 max_age=None, block_timeout=5.0):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow!r} (expected one of {', '.join(OVERFLOW_POLICIES)})")
+        if overflow == OVERFLOW_DEGRADE and fallback is None:
+            raise ValueError(f"{name}: the degrade policy needs a fallback")
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.fallback = fallback
+        self.max_age = max_age
+        self.block_timeout = block_timeout
+        self._queue = deque()
+        self._cond = Condition()
+        self._threads = []
+        self._running = 0
+        self._shutdown = False
+        self._metrics = {
+            'submitted': 0, 'completed': 0, 'failed': 0, 'degraded': 0, 'dropped': 0, 'stale': 0, 'blocked': 0,
+            'avg_wait_ms': None, 'max_wait_ms': 0.0, 'avg_run_ms': None
+        }
+
+    def start(self):
+        with self._cond:
+            if self._threads:
+                return
+            self._threads = [Thread(target=self._worker, name=f'{self.name}-{i}', daemon=True) for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs); returns False if the task was dropped (overflow or shutdown)."""
+        self.start()
+        with self._cond:
+            if self._shutdown:
+                logger.debug("Skipped %s task submission during shutdown", self.name)
+                return False
+            if len(self._queue) >= self.max_queue and self.overflow == OVERFLOW_BLOCK:
+                self._metrics['blocked'] += 1
+                deadline = time.monotonic() + self.block_timeout
+                while len(self._queue) >= self.max_queue and not self._shutdown:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            if len(self._queue) < self.max_queue and not self._shutdown:
+                self._metrics['submitted'] += 1
+                self._queue.append(_Task(fn, args, kwargs))
+                self._cond.notify_all()
+                return True
+            degrade = self.overflow == OVERFLOW_DEGRADE and not self._shutdown
+            self._metrics['degraded' if degrade else 'dropped'] += 1
+            backlog = len(self._queue)
+        if not degrade:
+            logger.warning("%s queue full (%d waiting); dropped task", self.name, backlog)
+            return False
+        logger.info("%s queue full (%d waiting); running the fallback instead", self.name, backlog)
+        self._run_fallback(args, kwargs)
+        return True
+
+    def shutdown(self, wait=True):
+        """Stop accepting tasks; with wait, let the workers finish the queued ones first."""
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+            threads = list(self._threads)
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def _run_fallback(self, args, kwargs):
+        try:
+            self.fallback(*args, **kwargs)
+        except Exception as e:
+            logger.error("Error in %s fallback: %s", self.name, e, exc_info=True)
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._shutdown:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                task = self._queue.popleft()
+                self._cond.notify_all()  # Wake submitters blocked on a full queue
+                waited = time.monotonic() - task.enqueued
+                m = self._metrics
+                m['avg_wait_ms'] = round(waited * 1000.0 if m['avg_wait_ms'] is None else 0.8 * m['avg_wait_ms'] + 0.2 * waited * 1000.0, 1)
+                m['max_wait_ms'] = round(max(m['max_wait_ms'], waited * 1000.0), 1)
+                stale = self.max_age is not None and waited > self.max_age
+                if stale:
+                    m['stale'] += 1
+                    if self.fallback is not None:
+                        m['degraded'] += 1
+                    else:
+                        m['dropped'] += 1
+                        continue
+                self._running += 1
+
+            started = time.monotonic()
+            outcome = None  # Stale tasks were already counted as degraded
+            if stale:
+                self._run_fallback(task.args, task.kwargs)
+            else:
+                try:
+                    task.fn(*task.args, **task.kwargs)
+                    outcome = 'completed'
+                except Exception as e:
+                    logger.error("Error in %s task: %s", self.name, e, exc_info=True)
+                    outcome = 'failed'
+            run_ms = (time.monotonic() - started) * 1000.0
+            with self._cond:
+                self._running -= 1
+                m = self._metrics
+                if outcome:
+                    m[outcome] += 1
+                m['avg_run_ms'] = round(run_ms if m['avg_run_ms'] is None else 0.8 * m['avg_run_ms'] + 0.2 * run_ms, 1)
+
+    def stats(self):
+        """Backlog, age of the oldest waiting task, outcomes and wait/run times."""
+        with self._cond:
+            oldest = self._queue[0].enqueued if self._queue else None
+            return dict(self._metrics, queued=len(self._queue), running=self._running, workers=self.workers,
+                        max_queue=self.max_queue, overflow=self.overflow,
+                        oldest_age_ms=round((time.monotonic() - oldest) * 1000.0, 1) if oldest is not None else 0.0)
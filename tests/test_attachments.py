@@ -0,0 +1,18 @@
+import json
+
+from simulation.attachments import AttachmentStore
+
+def test_evicted_payload_is_served_from_its_export(tmp_path):
+    path = tmp_path / 'condition.json'
+    path.write_text(json.dumps({'id': 'c1'}))
+    store = AttachmentStore(capacity=1)
+    ref = store.put('Condition', {'id': 'c1'}, path=str(path))
+    store.put('Other', {'id': 'x'})
+    assert store.get(ref['id']) == {'id': 'c1'}
+
+def test_remembered_paths_are_bounded(tmp_path):
+    store = AttachmentStore(capacity=2, path_capacity=3)
+    refs = [store.put('Condition', {'n': i}, path=str(tmp_path / f'{i}.json')) for i in range(10)]
+    assert len(store._entries) == 2
+    assert list(store._evicted_paths) == [ref['id'] for ref in refs[5:8]]
+    assert store.get(refs[0]['id']) is None
@@ -0,0 +1,34 @@
+import pytest
+
+from fhir_generators.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+def _fail():
+    raise ConnectionError('down')
+
+def test_opens_after_consecutive_failures_and_recovers():
+    transitions = []
+    breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=0.0,
+                             on_state_change=lambda name, old, new: transitions.append(new))
+    breaker.record_failure()
+    breaker.record_success()  # Resets the count
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.allow_request()  # reset_timeout passed: one trial
+    assert breaker.state == HALF_OPEN
+    breaker.record_failure()  # The trial failing re-opens at once
+    assert breaker.state == OPEN
+    assert breaker.call(lambda: 'ok') == 'ok'
+    assert transitions == [OPEN, HALF_OPEN, OPEN, HALF_OPEN, CLOSED]
+    assert breaker.stats() == {'state': CLOSED, 'consecutive_failures': 0, 'open_count': 2}
+
+def test_open_circuit_rejects_calls_until_the_timeout():
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=60.0,
+                             on_state_change=lambda *args: 1 / 0)  # Callback errors are logged, not raised
+    with pytest.raises(ConnectionError):
+        breaker.call(_fail)
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: 'never')
+    assert not breaker.allow_request()
+    assert 59.0 < breaker.retry_after() <= 60.0
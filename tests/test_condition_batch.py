@@ -0,0 +1,68 @@
+import re
+
+import pytest
+
+from fhir_generators import generate_condition as gc
+from fhir_generators.generate_condition import AdaptiveBatchSize, configure_condition_batching, generate_conditions_batch
+from fhir_generators.json_stream import StreamAborted
+
+def _condition(condition_id):
+    return {'resourceType': 'Condition', 'id': condition_id, 'clinicalStatus': {}, 'verificationStatus': {}, 'severity': {},
+            'category': [], 'code': {'text': 'Chest pain'}, 'subject': {}, 'note': 'observed'}
+
+class StubLLM:
+    """generate_json stand-in: respond(ids) gives the items for the ids a prompt assigns."""
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.requests = []
+
+    def __call__(self, model, prompt, schema, **kwargs):
+        ids = re.findall(r'^\s+\d+\. "id": "([^"]+)"', prompt, re.M)
+        self.requests.append(ids)
+        return {'conditions': self.respond(ids)}
+
+@pytest.fixture
+def llm(monkeypatch):
+    configure_condition_batching(maximum=4, target_seconds=60.0)  # Fresh batch sizes (start at 2)
+
+    def install(respond):
+        stub = StubLLM(respond)
+        monkeypatch.setattr(gc.llm_client, 'generate_json', stub)
+        return stub
+    return install
+
+def test_partial_batches_are_salvaged_and_only_missing_items_re_requested(llm):
+    def respond(ids):
+        if len(ids) > 1:  # Cut off after the first item
+            raise StreamAborted('too long', partial=[_condition(ids[0]), {'resourceType': 'Condition', 'id': ids[1]}])
+        return [_condition('made-up-id')]  # Id not assigned: matched by position
+    stub = llm(respond)
+    conditions = generate_conditions_batch(['p1', 'p2', 'p3'], llm_model='stub-partial')
+    assert [c['subject']['reference'] for c in conditions] == ['Patient/p1', 'Patient/p2', 'Patient/p3']
+    assert [len(ids) for ids in stub.requests] == [2, 1, 1]
+    assert stub.requests[2] == [stub.requests[0][1]]  # The lost item, asked for again
+    assert conditions[1]['note'] == [{'text': 'observed'}]
+
+def test_gives_up_after_max_attempts(llm):
+    stub = llm(lambda ids: [])
+    assert generate_conditions_batch(['p1', 'p2', 'p3'], llm_model='stub-empty', max_attempts=2) == [None, None, None]
+    # The empty first batch halves the size, so the second round asks one at a time
+    assert [len(ids) for ids in stub.requests] == [2, 1, 1, 1, 1]
+
+def test_batch_size_grows_on_fast_complete_calls_and_shrinks_on_losses():
+    sizer = AdaptiveBatchSize(initial=2, maximum=4, target_seconds=10)
+    sizer.record(2, 2, 1.0)
+    sizer.record(3, 3, 1.0)
+    sizer.record(4, 4, 1.0)
+    assert sizer.size == 4  # Capped at maximum
+    sizer.record(1, 0, 1.0)
+    assert sizer.size == 4  # Re-requests of a few items do not count
+    sizer.record(4, 1, 1.0)
+    assert sizer.size == 2  # Fewer than half usable
+    sizer.record(2, 2, 12.0)
+    assert sizer.size == 1  # Over the latency target
+    sizer.record(1, 0, 1.0)
+    assert sizer.size == 1
+    stats = sizer.stats()
+    assert (stats['calls'], stats['requested'], stats['valid']) == (7, 17, 12)
@@ -0,0 +1,57 @@
+from simulation.emitter import DEFAULT_ROOM, STATS_ROOM, BatchEmitter, log_room, state_room
+
+def _emitter():
+    built, emitted = [], []
+
+    def state_fn(view):
+        built.append(view)
+        return f'state of {view}'
+
+    return BatchEmitter(lambda event, data, room: emitted.append((room, data)), state_fn), built, emitted
+
+def test_set_rooms_reports_changes_and_counts_members():
+    emitter, _, _ = _emitter()
+    assert emitter.set_rooms('a', [DEFAULT_ROOM]) == (frozenset(), {DEFAULT_ROOM})
+    emitter.set_rooms('b', [DEFAULT_ROOM])
+    assert emitter.set_rooms('a', [STATS_ROOM, log_room('patient')]) == ({DEFAULT_ROOM}, {STATS_ROOM, log_room('patient')})
+    emitter.remove_client('b')
+    emitter.remove_client('unknown')
+    assert emitter._room_members == {STATS_ROOM: 1, log_room('patient'): 1}
+
+def test_batches_only_for_rooms_with_members():
+    emitter, built, _ = _emitter()
+    for client, rooms in [('all', [DEFAULT_ROOM]), ('stats', [STATS_ROOM]), ('patients', [log_room('patient')]),
+                          ('west', [state_room('region:west')]), ('west2', [state_room('region:west')])]:
+        emitter.set_rooms(client, rooms)
+    emitter.add_log('patient', 'p1')
+    emitter.add_log('patient', 'p2')
+    emitter.add_log('hospital', 'h1')
+    emitter.set_extra('request_counts', {'n': 1})
+    emitter.mark_state_dirty()
+    batches = dict(emitter.build_batches())
+    assert batches[DEFAULT_ROOM] == {'request_counts': {'n': 1}, 'logs': {'patient': ['p2', 'p1'], 'hospital': ['h1']},
+                                     'logs_reset': [], 'log_capacity': 50, 'state': 'state of all'}
+    assert batches[STATS_ROOM] == {'request_counts': {'n': 1}}
+    assert batches[log_room('patient')] == {'logs': {'patient': ['p2', 'p1']}, 'log_capacity': 50, 'logs_reset': []}
+    assert batches[state_room('region:west')] == {'state': 'state of region:west'}
+    assert sorted(built) == ['all', 'region:west']  # One build per view, however many clients
+    assert emitter.build_batches() == []
+
+def test_quiet_rooms_get_nothing_and_state_is_reused():
+    emitter, built, emitted = _emitter()
+    emitter.set_rooms('a', [log_room('ambulance'), state_room('all')])
+    emitter.add_log('patient', 'p1')
+    assert not emitter.flush()
+    emitter.mark_state_dirty()
+    assert emitter.flush()
+    assert emitted == [(state_room('all'), {'state': 'state of all'})]
+    assert emitter.current_state() == 'state of all'
+    assert emitter.current_state('region:east') == 'state of region:east'
+    assert built == ['all', 'region:east']
+
+def test_reset_reaches_log_rooms():
+    emitter, _, _ = _emitter()
+    emitter.set_rooms('a', [log_room('patient')])
+    emitter.reset_logs()
+    assert emitter.build_batches() == [(log_room('patient'), {'logs': {'patient': []}, 'log_capacity': 50,
+                                                              'logs_reset': ['patient']})]
@@ -0,0 +1,46 @@
+import json
+import re
+from datetime import date
+
+import numpy as np
+
+from fhir_generators.generate_synthea_patient import generate_fallback_patient, generate_fallback_patients
+
+def _shape(value):
+    """Keys and value types of a JSON value, without the values."""
+    if isinstance(value, dict):
+        return {key: _shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_shape(item) for item in value]
+    return type(value).__name__
+
+def _without_sequence(patient):
+    """The sampled part of a patient: ids and name suffixes come from the sequence."""
+    name = patient['name'][0]
+    return (patient['gender'], patient['birthDate'], re.sub(r'\d+$', '', name['given'][0]), re.sub(r'\d+$', '', name['family']))
+
+def test_ids_are_unique_across_batches():
+    ids = [p['id'] for p in generate_fallback_patients(300) + generate_fallback_patients(300)]
+    ids.append(generate_fallback_patient()['patient']['id'])
+    assert len(set(ids)) == len(ids)
+
+def test_seeded_batches_are_reproducible():
+    first = generate_fallback_patients(50, rng=np.random.default_rng(5))
+    second = generate_fallback_patients(50, rng=np.random.default_rng(5))
+    assert [_without_sequence(p) for p in first] == [_without_sequence(p) for p in second]
+    assert {p['gender'] for p in first} == {'male', 'female'}
+
+def test_batch_patients_have_the_single_patient_shape(tmp_path):
+    patient = generate_fallback_patients(1)[0]
+    seq = patient['id'].rsplit('-', 1)[1]
+    assert _shape(patient) == {'resourceType': 'str', 'id': 'str', 'name': [{'given': ['str'], 'family': 'str'}],
+                               'birthDate': 'str', 'gender': 'str', 'identifier': [{'system': 'str', 'value': 'str'}]}
+    assert patient['identifier'] == [{'system': 'ambosim/fallback', 'value': patient['id']}]
+    assert patient['name'][0]['given'][0].endswith(seq) and patient['name'][0]['family'].endswith(seq)
+    assert 18 <= date.today().year - int(patient['birthDate'][:4]) <= 80
+
+    result = generate_fallback_patient(str(tmp_path))
+    assert _shape(result['patient']) == _shape(patient)
+    assert result['fhir_resources'] == {'patient': result['patient']}
+    saved = tmp_path / 'patient' / f"patient_{result['patient']['id']}.json"
+    assert json.loads(saved.read_text()) == result['patient']
@@ -0,0 +1,38 @@
+import json
+
+from fhir_generators.fhir_template import compile_template
+
+ENCOUNTER = compile_template('encounter')
+
+def test_render_matches_json_dumps_of_fill():
+    slots = {'encounter_id': 'e1', 'patient_id': 'pé"1', 'condition_id': 'c1', 'diagnosis_rank': 1,
+             'encounter_type_display': 'Emergency visit'}
+    for indent in (None, 2):
+        assert ENCOUNTER.render(slots, indent=indent) == json.dumps(ENCOUNTER.fill(slots), indent=indent)
+
+def test_int_slot_whole_and_embedded():
+    # diagnosis_rank fills a whole value; patient_id and condition_id are embedded in references
+    resource = ENCOUNTER.fill(encounter_id=5, patient_id=5, condition_id=2.5, diagnosis_rank=5)
+    assert resource['id'] == 5
+    assert resource['subject'] == {'reference': 'Patient/5'}
+    assert resource['diagnosis'][0]['condition'] == {'reference': 'Condition/2.5'}
+    assert resource['diagnosis'][0]['rank'] == 5
+    assert json.loads(ENCOUNTER.render(encounter_id=5, patient_id=5, condition_id=2.5, diagnosis_rank=5)) == resource
+
+def test_non_string_embedded_values_use_str():
+    rendered = json.loads(ENCOUNTER.render(patient_id=True, encounter_id='e'))
+    assert rendered['subject'] == {'reference': 'Patient/True'}
+    assert ENCOUNTER.fill(patient_id=True, encounter_id='e')['subject'] == rendered['subject']
+
+def test_missing_slots_drop_their_parts():
+    resource = ENCOUNTER.fill(encounter_id='e1', patient_id='p1', condition_display='Acute condition')
+    assert 'class' not in resource
+    assert resource['diagnosis'] == [{'condition': {'display': 'Acute condition'}}]
+    # None counts as missing, for fill and render alike
+    assert ENCOUNTER.fill(encounter_id='e1', patient_id=None) == {'resourceType': 'Encounter', 'id': 'e1'}
+    assert json.loads(ENCOUNTER.render(encounter_id='e1', patient_id=None)) == {'resourceType': 'Encounter', 'id': 'e1'}
+
+def test_fill_returns_fresh_containers():
+    first = ENCOUNTER.fill(encounter_id='e1', patient_id='p1')
+    first['subject']['reference'] = 'changed'
+    assert ENCOUNTER.fill(encounter_id='e1', patient_id='p1')['subject'] == {'reference': 'Patient/p1'}
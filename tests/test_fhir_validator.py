@@ -0,0 +1,50 @@
+import pytest
+
+from fhir_generators.fhir_validator import FHIRValidator, ResourceRejected
+
+ENCOUNTER = FHIRValidator('encounter', required=('id', 'period.start', 'type.coding.display'),
+                          defaults={'status': 'unknown', 'type.coding.display': 'Emergency'})
+
+def _encounter(**fields):
+    return dict({'resourceType': 'Encounter', 'id': 'e1', 'status': 'in-progress', 'period': {'start': '2024-01-01T00:00:00'},
+                 'type': [{'coding': [{'system': 'http://snomed.info/sct', 'display': 'ED visit'}]}]}, **fields)
+
+def test_valid_resource_passes_unchanged():
+    resource = _encounter(extra={'kept': True})
+    assert ENCOUNTER.validate(resource) == (resource, [])
+    assert resource['extra'] == {'kept': True}
+
+@pytest.mark.parametrize('resource', [None, ['Encounter'], {'resourceType': 'Condition'}, {'id': 'e1'}])
+def test_rejects_non_objects_and_other_resource_types(resource):
+    with pytest.raises(ResourceRejected):
+        ENCOUNTER.validate(resource)
+
+def test_wrong_shapes_are_normalized_and_reported():
+    resource, errors = ENCOUNTER.validate(_encounter(
+        status=3, diagnosis=[{'condition': 'Condition/c1', 'rank': '1'}],
+        serviceType={'coding': {'code': 'x', 'display': 'ED'}}, priority='urgent'))
+    assert resource['status'] == '3'
+    assert resource['diagnosis'] == [{'rank': 1}]
+    assert resource['serviceType']['coding'] == [{'code': 'x', 'display': 'ED'}]
+    assert 'priority' not in resource
+    assert errors == ['status: expected string, got int',
+                      'serviceType.coding: expected array, got object',
+                      'priority: expected object, got str',
+                      'diagnosis[0].condition: expected object, got str',
+                      'diagnosis[0].rank: expected number, got str']
+
+def test_missing_required_values_get_defaults_or_are_reported():
+    resource = _encounter(type=[{'coding': [{'code': '50849002'}]}], status=None)
+    del resource['id'], resource['period']
+    resource, errors = ENCOUNTER.validate(resource)
+    assert resource['status'] == 'unknown'
+    assert resource['type'][0]['coding'][0]['display'] == 'Emergency'
+    assert errors == ['id: missing', 'status: expected string, got NoneType', 'period: missing']
+
+def test_empty_and_fixed_value_mismatches():
+    resource, errors = ENCOUNTER.validate(_encounter(
+        location=[], type=[{'coding': [{'system': 'http://loinc.org', 'display': 'ED visit'}]}]))
+    assert 'location' not in resource
+    assert resource['type'][0]['coding'][0]['system'] == 'http://loinc.org'  # Reported, but kept
+    assert "location: empty" in errors
+    assert "type[0].coding[0].system: expected 'http://snomed.info/sct', got 'http://loinc.org'" in errors
@@ -0,0 +1,48 @@
+import pytest
+
+from fhir_generators.json_stream import StreamAborted, StreamIncomplete, StreamingJSONParser
+
+SCHEMA = {
+    'type': 'object', 'additionalProperties': False, 'required': ['conditions'],
+    'properties': {'conditions': {'type': 'array', 'items': {
+        'type': 'object', 'required': ['severity'],
+        'properties': {'severity': {'type': 'string', 'enum': ['Mild', 'Severe']}, 'rank': {'type': 'integer'}}}}}
+}
+
+def _feed(text, chunk=3, **kwargs):
+    parser = StreamingJSONParser(SCHEMA, **kwargs)
+    for i in range(0, len(text), chunk):
+        if parser.feed(text[i:i + chunk]):
+            break
+    return parser
+
+def test_document_after_preamble_completes_and_ignores_the_rest():
+    parser = _feed('Sure:\n{"conditions": [{"severity": "Mild", "rank": -1, "note": "say \\"hi\\""}]} and more')
+    assert parser.done
+    assert parser.value() == {'conditions': [{'severity': 'Mild', 'rank': -1, 'note': 'say "hi"'}]}
+
+@pytest.mark.parametrize('text, reason', [
+    ('I cannot help with that request. ' * 10, 'No JSON object'),
+    ('{"diagnosis": []}', 'Unexpected key'),
+    ('{"conditions": {"severity": "Mild"}}', 'Expected array, got object'),
+    ('{"conditions": [{"severity": "Moderate"}]}', "is not one of"),
+    ('{"conditions": [{"rank": 1}]}', 'Object closed without'),
+    ('{"conditions": [{"severity": "Mild", "rank": "1"}]}', 'Expected integer, got string'),
+])
+def test_aborts_as_soon_as_the_schema_cannot_match(text, reason):
+    with pytest.raises(StreamAborted, match=reason):
+        _feed(text)
+
+def test_abort_keeps_complete_items():
+    with pytest.raises(StreamAborted) as info:
+        _feed('{"conditions": [{"severity": "Severe"}, {"severity": "Mild"}, {"severity": "Bad"}]}')
+    assert info.value.partial == [{'severity': 'Severe'}, {'severity': 'Mild'}]
+
+def test_truncated_stream_is_incomplete():
+    parser = _feed('{"conditions": [{"severity": "Mild"}, {"sever')
+    assert not parser.done
+    with pytest.raises(StreamIncomplete) as info:
+        parser.value()
+    assert info.value.partial == [{'severity': 'Mild'}]
+    with pytest.raises(StreamAborted, match='exceeded 10 characters'):
+        _feed('{"conditions": []}', max_chars=10)
@@ -0,0 +1,39 @@
+from fhir_generators.llm_cache import LLMCache
+
+def _generations(cache, count):
+    """Outputs served for count identical requests; generate() returns a new number each call."""
+    calls = []
+
+    def generate():
+        calls.append(len(calls))
+        return {'n': calls[-1]}
+    outputs = [cache.get_or_generate('model', 'condition', 1, {'severity': 'mild'}, generate, lambda o: o)['n']
+               for _ in range(count)]
+    return outputs, len(calls)
+
+def test_identical_inputs_spread_over_slots(tmp_path):
+    cache = LLMCache(str(tmp_path), variants_per_key=2, slots=8, seed=1)
+    outputs, calls = _generations(cache, 200)
+    # Every slot records its own variants before replaying, so far more than 2 outputs are used
+    assert calls == 16
+    assert len(set(outputs)) == 16
+
+def test_seeded_replay_is_repeatable(tmp_path):
+    recorded, _ = _generations(LLMCache(str(tmp_path), variants_per_key=2, slots=4, seed=7), 50)
+    first, calls = _generations(LLMCache(str(tmp_path), mode='replay', slots=4, seed=3), 30)
+    second, _ = _generations(LLMCache(str(tmp_path), mode='replay', slots=4, seed=3), 30)
+    assert calls == 0
+    assert first == second
+    assert set(first) <= set(recorded)
+
+def test_replay_miss_returns_none(tmp_path):
+    cache = LLMCache(str(tmp_path), mode='replay')
+    assert cache.get_or_generate('model', 'condition', 1, {}, lambda: {'n': 1}, lambda o: o) is None
+    assert cache.stats()['misses'] == 1
+
+def test_replay_serves_only_recorded_slots(tmp_path):
+    recorded, calls = _generations(LLMCache(str(tmp_path), mode='record', seed=1), 5)
+    assert calls == 5
+    replayed, calls = _generations(LLMCache(str(tmp_path), mode='replay', seed=2), 50)
+    assert calls == 0
+    assert set(replayed) <= set(recorded)
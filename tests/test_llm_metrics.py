@@ -0,0 +1,47 @@
+from fhir_generators.llm_metrics import LLMMetrics, _percentile
+
+def test_percentiles_use_the_nearest_rank():
+    values = list(range(100, 0, -1))  # 1..100, unordered
+    assert (_percentile(values, 0.50), _percentile(values, 0.95), _percentile(values, 0.99)) == (50, 95, 99)
+    assert _percentile([7.26], 0.01) == 7.3
+    assert _percentile([], 0.5) is None
+
+def _metrics():
+    metrics = LLMMetrics()
+    for latency in range(1, 101):
+        metrics.record_call('llama3.1:8b', 'condition', latency * 10.0, prompt_tokens=100, completion_tokens=50,
+                            prompt_eval_ms=50.0, eval_ms=500.0)
+    metrics.record_call('llama3.1:8b', 'condition', 900.0, failure='timeout')
+    metrics.record_call('llama3.1:8b', 'condition', 0.0, failure='deadline')
+    metrics.record_invalid('llama3.1:8b', 'condition', 'missing_fields')
+    metrics.record_invalid('llama3.1:8b', 'condition', 'timeout')
+    for fallback in (False, False, False, True):
+        metrics.record_result('llama3.1:8b', 'condition', fallback=fallback)
+    return metrics
+
+def test_snapshot_counts_failures_and_fallbacks():
+    summary = _metrics().snapshot()['llama3.1:8b']['condition']
+    assert summary['latency_ms'] == {'p50': 500.0, 'p95': 950.0, 'p99': 990.0}
+    assert summary['failures'] == {'timeout': 2, 'deadline': 1, 'missing_fields': 1}
+    assert (summary['calls'], summary['completed'], summary['valid']) == (102, 100, 98)
+    assert summary['failure_rate'] == round(4 / 102, 3)
+    assert (summary['served'], summary['fallbacks'], summary['fallback_rate']) == (3, 1, 0.25)
+    assert (summary['prompt_tokens_per_s'], summary['tokens_per_s']) == (2000.0, 100.0)
+
+def test_prometheus_text():
+    metrics = _metrics()
+    metrics.record_call('quote"model', None, 50.0)
+    lines = metrics.prometheus().splitlines()
+    labels = 'model="llama3.1:8b",generator="condition"'
+    for line in (f'ambosim_llm_requests_total{{{labels},outcome="ok"}} 98',
+                 f'ambosim_llm_requests_total{{{labels},outcome="timeout"}} 2',
+                 f'ambosim_llm_latency_ms_bucket{{{labels},le="100"}} 10',
+                 f'ambosim_llm_latency_ms_bucket{{{labels},le="+Inf"}} 100',
+                 f'ambosim_llm_latency_ms_count{{{labels}}} 100',
+                 f'ambosim_llm_latency_ms_sum{{{labels}}} 50500.0',
+                 f'ambosim_llm_eval_seconds_total{{{labels}}} 50.0',
+                 f'ambosim_llm_fallbacks_total{{{labels}}} 1',
+                 'ambosim_llm_requests_total{model="quote\\"model",generator="other",outcome="ok"} 1',
+                 '# TYPE ambosim_llm_latency_ms histogram'):
+        assert line in lines
+    assert metrics.prometheus().endswith('\n')
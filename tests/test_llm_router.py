@@ -0,0 +1,26 @@
+import pytest
+
+from fhir_generators.llm_router import MIN_CLIENT_TIMEOUT, Endpoint, LLMRouter, NoEndpointAvailable
+
+def test_client_reused_across_shrinking_deadline():
+    endpoint = Endpoint('http://llm:11434')
+    for remaining in range(600, 0, -1):
+        client = endpoint.client(remaining / 10)
+        # Never longer than the time left (down to the floor), and no more than ~30% shorter
+        assert 0.7 * remaining / 10 <= client._client.timeout.read <= max(remaining / 10, MIN_CLIENT_TIMEOUT)
+    assert len(endpoint._clients) <= 12
+    assert endpoint.client(6.0) is endpoint.client(5.7)
+    assert endpoint.client(33.0)._client.timeout.read < 33.0
+
+def test_acquire_prefers_least_loaded_and_respects_concurrency():
+    busy = Endpoint('http://a:11434', models=['m'], concurrency=1)
+    idle = Endpoint('http://b:11434', models=['m'], concurrency=1)
+    router = LLMRouter([busy, idle], health_interval=0)
+    busy.outstanding = 1
+    assert router.acquire('m', 0.1) is idle
+    with pytest.raises(NoEndpointAvailable):
+        router.acquire('m', 0.05)
+    router.release(idle)
+    assert router.acquire('m', 0.1) is idle
+    with pytest.raises(NoEndpointAvailable):
+        router.acquire('other', 0.1)
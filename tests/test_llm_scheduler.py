@@ -0,0 +1,59 @@
+import threading
+import time
+
+import pytest
+
+from fhir_generators.llm_client import current_timeout
+from simulation.llm_scheduler import (LLMScheduler, LLMQueueFull, LLMRequestCancelled,
+                                      PRIORITY_BACKGROUND, PRIORITY_CONDITION, PRIORITY_ENCOUNTER)
+
+def _blocked(scheduler, model='m'):
+    """Occupy the model's only worker until the returned event is set."""
+    started, release = threading.Event(), threading.Event()
+    scheduler.submit(model, lambda: (started.set(), release.wait(5)))
+    assert started.wait(5)
+    return release
+
+def test_runs_by_priority_then_deadline():
+    scheduler = LLMScheduler(default_concurrency=1)
+    release = _blocked(scheduler)
+    order = []
+    futures = [scheduler.submit('m', order.append, name, priority=priority, timeout=timeout)
+               for name, priority, timeout in [('background', PRIORITY_BACKGROUND, 10), ('late condition', PRIORITY_CONDITION, 10),
+                                               ('early condition', PRIORITY_CONDITION, 5), ('encounter', PRIORITY_ENCOUNTER, 10)]]
+    release.set()
+    for future in futures:
+        future.result(5)
+    assert order == ['encounter', 'early condition', 'late condition', 'background']
+
+def test_expired_and_cancelled_requests_are_not_run():
+    scheduler = LLMScheduler(default_concurrency=1)
+    release = _blocked(scheduler)
+    ran = []
+    expired = scheduler.submit('m', ran.append, 'expired', timeout=0.01)
+    cancelled = scheduler.submit('m', ran.append, 'cancelled', cancel_if=lambda: True)
+    time.sleep(0.05)
+    release.set()
+    for future in (expired, cancelled):
+        with pytest.raises(LLMRequestCancelled):
+            future.result(5)
+    assert ran == []
+    stats = scheduler.stats()
+    assert (stats['expired'], stats['cancelled']) == (1, 1)
+
+def test_full_queue_rejects_and_call_returns_none():
+    scheduler = LLMScheduler(default_concurrency=1, max_queue=1)
+    release = _blocked(scheduler)
+    scheduler.submit('m', lambda: None)
+    with pytest.raises(LLMQueueFull):
+        scheduler.submit('m', lambda: None)
+    assert scheduler.call('m', lambda: 'never') is None
+    release.set()
+    assert scheduler.stats()['rejected'] == 2
+
+def test_call_runs_under_the_request_deadline():
+    scheduler = LLMScheduler()
+    remaining = scheduler.call('m', current_timeout, timeout=2.0)
+    assert 0 < remaining <= 2.0
+    assert scheduler.call('m', lambda: 1 / 0) is None
+    assert scheduler.stats()['models']['m']['failed'] == 1
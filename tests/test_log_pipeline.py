@@ -0,0 +1,46 @@
+import json
+import logging
+
+from simulation.log_pipeline import configure_logging, shutdown_logging, lazy_json
+
+def test_message_is_rendered_when_logged(tmp_path):
+    log_file = tmp_path / 'sim.log'
+    configure_logging(log_file=str(log_file), level='INFO')
+    try:
+        resource = {'status': 'arrived'}
+        logging.getLogger('test').info("Encounter %s", lazy_json(resource))
+        resource['status'] = 'changed after logging'
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            logging.getLogger('test').error("Failed", exc_info=True)
+    finally:
+        shutdown_logging()
+    text = log_file.read_text()
+    assert 'Encounter {"status": "arrived"}' in text
+    assert 'changed after logging' not in text
+    assert 'ValueError: boom' in text
+
+def test_json_lines_keep_tracebacks(tmp_path):
+    log_file = tmp_path / 'sim.log'
+    configure_logging(log_file=str(log_file), level='INFO', json_format=True)
+    try:
+        try:
+            raise KeyError('id')
+        except KeyError:
+            logging.getLogger('ambosim.test').exception("Lookup failed for %s", 'p1')
+    finally:
+        shutdown_logging()
+    entry = json.loads(log_file.read_text().splitlines()[-1])
+    assert entry['message'] == 'Lookup failed for p1'
+    assert entry['category'] == 'ambosim.test'
+    assert "KeyError: 'id'" in entry['exc_info']
+
+def test_reconfiguring_closes_previous_handlers(tmp_path):
+    listener = configure_logging(log_file=str(tmp_path / 'first.log'))
+    first_file = next(h for h in listener.handlers if isinstance(h, logging.FileHandler))
+    configure_logging(log_file=str(tmp_path / 'second.log'))
+    try:
+        assert first_file.stream is None  # FileHandler.close() drops its stream
+    finally:
+        shutdown_logging()
@@ -0,0 +1,55 @@
+import pytest
+
+import app
+from fhir_generators.generate_synthea_patient import generate_fallback_patient
+
+@pytest.fixture
+def world(monkeypatch):
+    """One house, no patients, nothing persisted and no LLM."""
+    monkeypatch.setattr(app, 'patients', [])
+    monkeypatch.setattr(app, 'houses', [app.House(0, 50, 50)])
+    monkeypatch.setattr(app, 'OUTPUT_FHIR', False)
+    monkeypatch.setattr(app, 'event_sinks', [])
+    monkeypatch.setattr(app, 'USE_LLM', False)
+    monkeypatch.setattr(app, 'patient_event_log', [])
+    return app.houses[0]
+
+def _registered(house):
+    return app.register_patient(house, generate_fallback_patient())
+
+def test_registration_places_a_provisional_patient(world):
+    patient = _registered(world)
+    assert app.patients == [patient] and world.patient_ids == [patient.id]
+    assert patient.condition is not None and not patient.condition_locked
+    assert app.patient_event_log == []  # Logged once the condition is final
+
+def test_finalize_keeps_the_provisional_condition_once_locked(world):
+    patient = _registered(world)
+    provisional = patient.condition
+    patient.condition_locked = True  # Treatment started
+    app.finalize_patient(patient, app.generate_fallback_condition(patient.id, persist=False))
+    assert patient.condition is provisional
+    assert 'Patient Generated' in app.patient_event_log[0]['text']
+
+def test_finalize_swaps_in_the_enriched_condition(world):
+    patient = _registered(world)
+    enriched = app.generate_fallback_condition(patient.id, persist=False)
+    app.finalize_patient(patient, enriched, encounter_template={'resourceType': 'Encounter'})
+    assert patient.condition is enriched and patient.condition_locked
+    assert patient.encounter_template == {'resourceType': 'Encounter'}
+
+def test_enrichment_overflow_finalizes_the_patient(world, monkeypatch):
+    monkeypatch.setattr(app.enrichment_executor, 'max_queue', 0)  # Every submission overflows
+    monkeypatch.setattr(app.enrichment_executor, 'overflow', 'degrade')
+    degraded = app.enrichment_executor.stats()['degraded']
+    app.generate_random_patient()
+    patient, = app.patients
+    assert patient.condition_locked
+    assert app.enrichment_executor.stats()['degraded'] == degraded + 1
+    assert app.patient_event_log[0]['text'].count(patient.id) == 1
+
+def test_removed_patients_are_not_finalized(world):
+    patient = _registered(world)
+    app.patients.remove(patient)
+    app.finalize_patient(patient)
+    assert not patient.condition_locked and app.patient_event_log == []
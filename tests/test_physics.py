@@ -0,0 +1,55 @@
+import json
+import time
+
+import pytest
+
+import app
+from simulation.emitter import DEFAULT_ROOM, BatchEmitter
+from simulation.state_cache import JSONCodec
+
+@pytest.fixture
+def ambulance(monkeypatch):
+    ambulance = app.Ambulance(0, 100, 100)
+    monkeypatch.setattr(app, 'ambulances', [ambulance])
+    monkeypatch.setattr(app, 'houses', [])
+    monkeypatch.setattr(app, 'hospitals', [])
+    monkeypatch.setattr(app, 'STATE_CODEC', JSONCodec())
+    return ambulance
+
+def _broadcasts(physics_hz, seconds=0.6, broadcast_hz=5):
+    """Frames sent while ambulance 0 moves at physics_hz ticks per second."""
+    frames = []
+    emitter = BatchEmitter(lambda event, data, room: frames.append(data['state']), app.get_state, rate_hz=broadcast_hz)
+    emitter.set_rooms('client', [DEFAULT_ROOM])
+    emitter.start()
+    ambulance = app.ambulances[0]
+    ambulance.target = (10000, 100)
+    ended = time.monotonic() + seconds
+    while time.monotonic() < ended:
+        ambulance.move_to(*ambulance.target, app.AMBULANCE_SPEED / physics_hz)
+        emitter.mark_state_dirty()
+        time.sleep(1.0 / physics_hz)
+    emitter.stop()
+    return frames
+
+def test_broadcast_rate_does_not_follow_the_physics_rate(ambulance):
+    for physics_hz in (20, 100):
+        frames = _broadcasts(physics_hz)
+        assert 2 <= len(frames) <= 4  # 5 Hz for 0.6 s, however often the state changed
+
+def test_speed_does_not_depend_on_the_physics_rate(ambulance):
+    for physics_hz in (10, 20, 50):
+        ambulance.x, ambulance.y = 0, 0
+        for _ in range(physics_hz):  # One simulated second
+            ambulance.move_to(1000, 30, app.AMBULANCE_SPEED / physics_hz)
+        assert (round(ambulance.x, 6), ambulance.y) == (app.AMBULANCE_SPEED, 30)  # Stops on the target axis
+
+def test_ambulance_fragments_carry_velocity_and_target(ambulance):
+    state = json.loads(app.get_state())['ambulances'][0]
+    assert (state['vx'], state['vy'], state['target']) == (0, 0, None)
+    ambulance.target = (50, 300)
+    state = json.loads(app.get_state())['ambulances'][0]
+    assert (state['vx'], state['vy'], state['target']) == (-app.AMBULANCE_SPEED, app.AMBULANCE_SPEED, [50, 300])
+    ambulance.move_to(50, 300, 1000)
+    state = json.loads(app.get_state())['ambulances'][0]
+    assert (state['x'], state['y'], state['vx'], state['vy']) == (50, 300, 0, 0)  # Arrived: no dead reckoning past it
@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+from simulation.session_store import SessionStore
+
+@pytest.fixture
+def store(tmp_path):
+    store = SessionStore(str(tmp_path / 'session.db'))
+    yield store
+    store.close()
+
+def test_events_are_indexed_by_patient_hospital_and_ambulance(store):
+    store.write_event({'eventType': 'Pickup', 'timestamp': '2024-01-01T00:00:01Z', 'patient': {'reference': 'Patient/p1'},
+                       'ambulance': {'id': 3}})
+    store.write_event({'eventType': 'Discharge', 'timestamp': '2024-01-01T00:00:03Z', 'patient': {'reference': 'p1'},
+                       'location': {'reference': 'Location/hospital2'}}, category='hospital', message='discharged')
+    store.write_event({'eventType': 'Pickup', 'timestamp': '2024-01-01T00:00:02Z', 'patient': {'reference': 'Patient/p2'},
+                       'toHospitalId': 1})
+    store.write_event('not a payload')
+    store.flush()
+    assert [e['patient_ref'] for e in store.query_events(event_type='PICKUP')] == ['Patient/p1', 'Patient/p2']
+    discharge, = store.query_events(patient='p1', hospital_id=2)
+    assert (discharge['category'], discharge['message'], discharge['payload']['eventType']) == ('hospital', 'discharged', 'Discharge')
+    assert store.query_events(ambulance_id=3)[0]['ts'] == '2024-01-01T00:00:01Z'
+    assert len(store.query_events(since='2024-01-01T00:00:02Z', limit=1)) == 1
+    assert store.stats()['events'] == {'pickup': 2, 'discharge': 1}
+
+def test_timeline_merges_resources_and_events(store):
+    store.write_resource('Patient', {'resourceType': 'Patient', 'id': 'p1'})
+    store.write_resource('condition', {'resourceType': 'Condition', 'id': 'c1', 'subject': {'reference': 'Patient/p1'},
+                                       'recordedDate': '2024-01-01T00:00:00Z'})
+    store.write_resource('encounter', {'resourceType': 'Encounter', 'id': 'e1', 'period': {'start': '2024-01-01T00:00:05Z'}},
+                         patient_ref='p1')
+    store.write_event({'eventType': 'Pickup', 'timestamp': '2024-01-01T00:00:01Z', 'patient': {'reference': 'Patient/p1'}})
+    store.flush()
+    timeline = [(item['kind'], item.get('resource_type') or item.get('event_type')) for item in store.patient_timeline('p1')]
+    assert timeline[:3] == [('resource', 'condition'), ('event', 'pickup'), ('resource', 'encounter')]
+    assert ('resource', 'patient') in timeline
+    assert store.query_resources(resource_id='e1')[0]['patient_ref'] == 'Patient/p1'
+
+def test_import_session_dir(store, tmp_path):
+    session = tmp_path / 'fhir_export' / 'session_1'
+    (session / 'condition').mkdir(parents=True)
+    (session / 'event').mkdir()
+    (session / 'condition' / 'c1.json').write_text(json.dumps({'resourceType': 'Condition', 'id': 'c1',
+                                                               'subject': {'reference': 'Patient/p1'}}))
+    (session / 'event' / 'e.json').write_text(json.dumps({'eventType': 'Arrival', 'patient': {'reference': 'Patient/p1'}}))
+    (session / 'event' / 'broken.json').write_text('{')
+    assert store.import_session_dir(str(session)) == 2
+    assert store.stats() == {'events': {'arrival': 1}, 'resources': {'condition': 1}}
@@ -0,0 +1,68 @@
+import threading
+
+import pytest
+
+from simulation.sinks import EventSink, InMemoryBroker, InMemorySink, TopicSink, event_topic
+
+def test_sinks_must_implement_the_writes():
+    with pytest.raises(TypeError):
+        EventSink()
+    with pytest.raises(TypeError):
+        TopicSink()
+
+def test_topic_routing_and_keys():
+    broker = InMemoryBroker()
+    sink = InMemorySink(broker, topic_prefix='sim.')
+    sink.write_resource('Condition', {'resourceType': 'Condition', 'id': 'c1', 'subject': {'reference': 'Patient/p1'}})
+    sink.write_resource('patient', {'resourceType': 'Patient', 'id': 'p2'})
+    sink.write_resource('Encounter', {'resourceType': 'Encounter', 'id': 'e1'}, patient_ref='Patient/p3')
+    sink.write_event({'eventType': 'location', 'patient': {'reference': 'Patient/p1'}})
+    sink.write_event({'eventType': 'Ramping'})
+    sink.close()
+    assert broker.topics() == ['sim.condition', 'sim.encounter', 'sim.event_hospital_location', 'sim.event_ramping', 'sim.patient']
+    assert broker.messages('sim.condition') == [('p1', {'resourceType': 'Condition', 'id': 'c1',
+                                                         'subject': {'reference': 'Patient/p1'}})]
+    assert [key for key, _ in broker.messages('sim.patient') + broker.messages('sim.encounter')] == ['p2', 'p3']
+    assert broker.messages('sim.event_ramping', decode=False) == [(None, b'{"eventType": "Ramping"}')]
+    assert event_topic('redirect') == 'event_ambulance_redirect'
+
+def test_batches_flush_in_order_and_report_delivery():
+    batches, delivered = [], []
+
+    class RecordingSink(InMemorySink):
+        def _send_batch(self, messages):
+            batches.append(len(messages))
+            super()._send_batch(messages)
+
+    sink = RecordingSink(batch_size=10, linger_ms=50, on_delivery=lambda topic, key, error: delivered.append((key, error)))
+    for i in range(25):
+        sink.publish('t', {'n': i}, key=str(i))
+    sink.flush()
+    assert [value['n'] for _, value in sink.broker.messages('t')] == list(range(25))
+    assert max(batches) <= 10 and sum(batches) == 25 and len(batches) < 25
+    assert delivered == [(str(i), None) for i in range(25)]
+    assert sink.stats() == {'published': 25, 'delivered': 25, 'failed': 0, 'queued': 0}
+    sink.close()
+
+def test_failed_batch_reports_every_message():
+    delivered = []
+    fail = threading.Event()
+    fail.set()
+
+    class FlakySink(InMemorySink):
+        def _send_batch(self, messages):
+            if fail.is_set():
+                raise ConnectionError('broker down')
+            super()._send_batch(messages)
+
+    sink = FlakySink(batch_size=5, on_delivery=lambda topic, key, error: delivered.append((topic, key, type(error))))
+    sink.publish('t', {}, key='a')
+    sink.publish('t', {}, key='b')
+    sink.flush()
+    fail.clear()
+    sink.publish('t', {}, key='c')
+    sink.flush()
+    assert delivered == [('t', 'a', ConnectionError), ('t', 'b', ConnectionError), ('t', 'c', type(None))]
+    assert sink.stats()['failed'] == 2 and sink.stats()['delivered'] == 1
+    assert sink.broker.messages('t') == [('c', {})]
+    sink.close()
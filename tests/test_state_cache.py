@@ -0,0 +1,62 @@
+import json
+
+import msgpack
+import pytest
+
+from simulation.state_cache import AppendOnlyFragments, JSONCodec, MessagePackCodec, Tracked
+
+DECODE = {'json': json.loads, 'msgpack': msgpack.unpackb}
+
+@pytest.fixture(params=[JSONCodec, MessagePackCodec], ids=['json', 'msgpack'])
+def codec(request):
+    return request.param()
+
+def _decode(codec, data):
+    return DECODE[codec.name](data)
+
+def test_frames_decode_to_the_plain_value(codec):
+    for count in (0, 1, 15, 16, 70000):
+        items = [codec.encode({'id': i}) for i in range(count)]
+        entity = codec.extend(codec.encode({'id': 'a1', 'x': 1.5}), [('wait', codec.encode(7)), ('ramp', codec.encode(None))])
+        frame = codec.object([('patients', codec.array(codec.join(items), count)), ('ambulance', entity)])
+        assert _decode(codec, frame) == {'patients': [{'id': i} for i in range(count)],
+                                         'ambulance': {'id': 'a1', 'x': 1.5, 'wait': 7, 'ramp': None}}
+    assert _decode(codec, codec.object([])) == {}
+
+def test_msgpack_extend_needs_a_fixmap():
+    codec = MessagePackCodec()
+    with pytest.raises(ValueError):
+        codec.extend(codec.encode({str(i): i for i in range(15)}), [('a', codec.encode(1)), ('b', codec.encode(2))])
+
+def test_append_only_fragments_encode_each_item_once(codec):
+    fragments, encoded = AppendOnlyFragments(), []
+
+    def encode_item(item):
+        encoded.append(item)
+        return codec.encode(item)
+
+    items = list(range(20))
+    assert _decode(codec, fragments.array(items[:3], encode_item, codec)) == [0, 1, 2]
+    assert _decode(codec, fragments.array(items, encode_item, codec)) == items
+    assert encoded == items
+    assert _decode(codec, fragments.array(items[:2], encode_item, codec)) == [0, 1]  # Shorter list: start over
+    assert _decode(codec, fragments.array([], encode_item, codec)) == []
+
+def test_tracked_fragment_is_rebuilt_only_after_a_change(codec):
+    class Entity(Tracked):
+        state_fields = frozenset({'x'})
+
+    entity, builds = Entity(), []
+    entity.x = 1
+
+    def build(e):
+        builds.append(e.x)
+        return {'x': e.x}
+
+    first = entity.state_fragment(build, codec)
+    entity.x = 1  # Same value
+    entity.unrelated = 5
+    assert entity.state_fragment(build, codec) is first
+    entity.x = 2
+    assert _decode(codec, entity.state_fragment(build, codec)) == {'x': 2}
+    assert builds == [1, 2]
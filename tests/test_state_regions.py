@@ -0,0 +1,38 @@
+import json
+
+import pytest
+
+import app
+
+@pytest.fixture
+def layout(monkeypatch):
+    monkeypatch.setattr(app, 'houses', [app.House(i, 50, 50 + i * 60) for i in range(3)])
+    monkeypatch.setattr(app, 'hospitals', [app.Hospital(i, 450, 50 + i * 200) for i in range(2)])
+    monkeypatch.setattr(app, 'ambulances', [app.Ambulance(0, 100, 50), app.Ambulance(1, 400, 250)])
+    monkeypatch.setattr(app, 'STATE_REGIONS', {})
+
+def _ids(view):
+    state = json.loads(app.get_state(view))
+    return {kind: [e['id'] for e in state[kind]] for kind in ('ambulances', 'houses', 'hospitals')}
+
+def test_regions_follow_the_layout(layout, monkeypatch):
+    assert _ids('region:houses') == {'ambulances': [0], 'houses': [0, 1, 2], 'hospitals': []}
+    assert _ids('region:hospitals') == {'ambulances': [1], 'houses': [], 'hospitals': [0, 1]}
+    monkeypatch.setattr(app, 'hospitals', [app.Hospital(0, 1200, 50)])  # A wider map moves the split
+    app.ambulances[1].x = 600  # Split now at x=625
+    assert _ids('region:houses')['ambulances'] == [0, 1]
+    monkeypatch.setattr(app, 'hospitals', [])
+    assert _ids('region:houses')['houses'] == [0, 1, 2] and _ids('region:hospitals')['houses'] == []
+
+def test_configured_regions_replace_the_layout(layout, monkeypatch):
+    monkeypatch.setattr(app, 'STATE_REGIONS', app.parse_state_regions(['top=0,0,1000,100', ' rest = 0,100,1000,1e4']))
+    assert _ids('region:top') == {'ambulances': [0], 'houses': [0], 'hospitals': [0]}
+    assert _ids('region:rest') == {'ambulances': [1], 'houses': [1, 2], 'hospitals': [1]}
+    assert app.subscription_rooms({'state': 'region:top'}) == {app.state_room('region:top')}
+    with pytest.raises(ValueError, match='region:<top|rest>'):
+        app.subscription_rooms({'state': 'region:houses'})
+
+@pytest.mark.parametrize('item', ['top', 'top=0,0,10', 'top=a,0,10,10', '=0,0,10,10', 'top=10,0,0,10'])
+def test_malformed_regions_are_rejected(item):
+    with pytest.raises(ValueError, match='NAME=X0,Y0,X1,Y1'):
+        app.parse_state_regions([item])
@@ -0,0 +1,50 @@
+from fhir_generators.synthea_pool import PatientPool
+
+def _bundle(i):
+    return {'patient': {'id': f'src-{i}', 'name': [{'given': [f'P{i}']}]},
+            'encounter': {'subject': {'reference': f'Patient/src-{i}'}}}
+
+def _samples(path, seed, count=5):
+    pool = PatientPool(str(path), seed=seed)
+    try:
+        return [pool.sample() for _ in range(count)]
+    finally:
+        pool.close()
+
+def test_seeded_sampling_repeats(tmp_path):
+    path = tmp_path / 'pool.ndjson'
+    pool = PatientPool(str(path))
+    assert pool.sample() is None
+    assert pool.extend([_bundle(i) for i in range(20)] + [{'no': 'patient'}]) == 20
+    pool.close()
+    first, second = _samples(path, seed=11), _samples(path, seed=11)
+    assert first == second
+    assert first != _samples(path, seed=12)
+
+def test_sample_reidentifies_everywhere(tmp_path):
+    path = tmp_path / 'pool.ndjson'
+    PatientPool(str(path)).extend([_bundle(0)])
+    bundle = _samples(path, seed=1, count=1)[0]
+    new_id = bundle['patient']['id']
+    assert new_id != 'src-0'
+    assert bundle['encounter']['subject']['reference'] == f'Patient/{new_id}'
+
+def test_index_survives_reopen(tmp_path):
+    path = tmp_path / 'pool.ndjson'
+    PatientPool(str(path)).extend([_bundle(i) for i in range(3)])
+    reopened = PatientPool(str(path))
+    assert len(reopened) == 3
+    assert reopened.get(2)['patient']['id'] == 'src-2'
+
+def test_index_lagging_the_data_is_extended(tmp_path):
+    path = tmp_path / 'pool.ndjson'
+    PatientPool(str(path)).extend([_bundle(0)])
+    stale_index = (tmp_path / 'pool.ndjson.idx').read_bytes()
+    PatientPool(str(path)).extend([_bundle(1), _bundle(2)])
+    (tmp_path / 'pool.ndjson.idx').write_bytes(stale_index)
+    with open(path, 'ab') as f:
+        f.write(b'{"patient": {"id": "partial"')  # Interrupted append
+    pool = PatientPool(str(path))
+    assert len(pool) == 3
+    assert [pool.get(i)['patient']['id'] for i in range(3)] == ['src-0', 'src-1', 'src-2']
+    assert path.read_bytes().endswith(b'}\n')
@@ -0,0 +1,79 @@
+import itertools
+import threading
+import time
+
+import pytest
+
+import fhir_generators.generate_synthea_patient as synthea
+from fhir_generators.circuit_breaker import CircuitBreaker
+from fhir_generators.generate_synthea_patient import SyntheaPrefetcher
+from fhir_generators.synthea_pool import PatientPool
+
+class StubClient:
+    """fetch_batch returns numbered bundles, or raises while failing is set."""
+
+    def __init__(self):
+        self.calls = []
+        self.failing = threading.Event()
+        self._ids = itertools.count()
+
+    def fetch_batch(self, batch_size, probe=False):
+        self.calls.append((batch_size, probe))
+        if self.failing.is_set():
+            raise ConnectionError('synthea down')
+        return [{'patient': {'id': f'syn-{next(self._ids)}'}} for _ in range(batch_size)]
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.005)
+
+@pytest.fixture
+def prefetcher():
+    client = StubClient()
+    prefetcher = SyntheaPrefetcher(client, batch_size=2, low_watermark=2, high_watermark=5, retry_delay=0.01,
+                                   breaker=CircuitBreaker('test', failure_threshold=2, reset_timeout=60))
+    yield prefetcher
+    prefetcher.stop()
+
+def test_fills_to_the_high_watermark_and_refills_below_the_low_one(prefetcher):
+    prefetcher.start()
+    _wait_for(lambda: prefetcher.depth() >= 5)
+    time.sleep(0.05)
+    assert prefetcher.depth() == 6 and len(prefetcher.client.calls) == 3  # Stops once at or above high
+    served = [prefetcher.take()['patient']['id'] for _ in range(4)]
+    assert served == ['syn-0', 'syn-1', 'syn-2', 'syn-3']  # Oldest first
+    time.sleep(0.05)
+    assert len(prefetcher.client.calls) == 3  # Depth 2 is not below the low watermark
+    prefetcher.take()
+    _wait_for(lambda: prefetcher.depth() >= 5)
+    assert prefetcher.metrics()['served'] == 5
+
+def test_take_never_waits_for_the_network(prefetcher):
+    prefetcher.client.failing.set()
+    prefetcher.start()
+    started = time.monotonic()
+    assert prefetcher.take() is None
+    assert time.monotonic() - started < 0.05
+    _wait_for(lambda: prefetcher.breaker.state == 'open')
+    metrics = prefetcher.metrics()
+    assert metrics['misses'] == 1 and metrics['fetch_failures'] == 2
+
+def test_generate_falls_back_to_the_pool_then_the_fallback_patient(prefetcher, tmp_path, monkeypatch):
+    prefetcher.client.failing.set()
+    monkeypatch.setattr(synthea, '_prefetcher', prefetcher)
+    monkeypatch.setattr(synthea, '_pool_offline', False)
+    monkeypatch.setattr(synthea, '_patient_pool', None)
+    patient = synthea.generate_fhir_resources()['patient']
+    assert patient['identifier'][0]['system'] == 'ambosim/fallback'
+
+    pool = PatientPool(str(tmp_path / 'pool.ndjson'), seed=1)
+    pool.extend([{'patient': {'id': 'pooled', 'resourceType': 'Patient'}}])
+    monkeypatch.setattr(synthea, '_patient_pool', pool)
+    patient = synthea.generate_fhir_resources()['patient']
+    assert patient['resourceType'] == 'Patient' and patient['id'] != 'pooled'
+
+    prefetcher.client.failing.clear()
+    prefetcher._queue.append({'patient': {'id': 'buffered'}})
+    assert synthea.generate_fhir_resources()['patient']['id'] == 'buffered'
@@ -0,0 +1,30 @@
+import random
+
+from simulation.warm_pool import WarmPool
+
+def _pool(**kwargs):
+    # Producers are never started; items are placed directly
+    return WarmPool('test', produce=lambda bucket: bucket, buckets=('Mild', 'Moderate', 'Severe'), **kwargs)
+
+def test_take_follows_weights_not_filled_buckets():
+    pool = _pool()
+    pool._items['Severe'].extend(['Severe'] * 1000)
+    random.seed(4)
+    taken = [pool.take() for _ in range(300)]
+    # Only a third of the draws land on the one filled bucket; the rest miss (callers fall back)
+    assert 70 < taken.count('Severe') < 130
+    assert taken.count(None) == 300 - taken.count('Severe')
+    assert pool.metrics()['misses'] == taken.count(None)
+
+def test_weights_bias_the_draw():
+    pool = _pool(weights=(0, 0, 1))
+    pool._items['Mild'].append('Mild')
+    pool._items['Severe'].append('Severe')
+    assert pool.take() == 'Severe'
+    assert pool.take() is None
+
+def test_named_bucket():
+    pool = _pool()
+    pool._items['Mild'].append('Mild')
+    assert pool.take('Moderate') is None
+    assert pool.take('Mild') == 'Mild'
@@ -0,0 +1,80 @@
+import threading
+import time
+
+import pytest
+
+from simulation.work_queue import BoundedExecutor, OVERFLOW_BLOCK, OVERFLOW_DEGRADE, OVERFLOW_DROP
+
+def _noop(*args):
+    pass
+
+def _executor(**kwargs):
+    fallbacks = []
+    executor = BoundedExecutor('test', workers=1, max_queue=1, fallback=fallbacks.append, **kwargs)
+    return executor, fallbacks
+
+def _occupy(executor):
+    """Block the only worker until the returned event is set."""
+    started, release = threading.Event(), threading.Event()
+    executor.submit(lambda: (started.set(), release.wait(5)))
+    assert started.wait(5)
+    return release
+
+def test_degrade_runs_the_fallback_in_the_submitting_thread():
+    executor, fallbacks = _executor(overflow=OVERFLOW_DEGRADE)
+    release = _occupy(executor)
+    assert executor.submit(_noop, 'queued')
+    assert executor.submit(_noop, 'overflow')
+    assert fallbacks == ['overflow']
+    release.set()
+    executor.shutdown()
+    stats = executor.stats()
+    assert (stats['degraded'], stats['completed']) == (1, 2)
+
+def test_drop_and_block_discard_when_full():
+    executor, fallbacks = _executor(overflow=OVERFLOW_DROP)
+    release = _occupy(executor)
+    executor.submit(_noop, 'queued')
+    assert not executor.submit(_noop, 'dropped')
+    release.set()
+    executor.shutdown()
+
+    executor, _ = _executor(overflow=OVERFLOW_BLOCK, block_timeout=0.05)
+    release = _occupy(executor)
+    executor.submit(_noop, 'queued')
+    started = time.monotonic()
+    assert not executor.submit(_noop, 'dropped')
+    assert time.monotonic() - started >= 0.05
+    release.set()
+    executor.shutdown()
+    assert executor.stats()['blocked'] == 1
+    assert fallbacks == []
+
+def test_block_admits_once_a_worker_frees_room():
+    executor, _ = _executor(overflow=OVERFLOW_BLOCK, block_timeout=5)
+    release = _occupy(executor)
+    executor.submit(_noop, 'queued')
+    threading.Timer(0.05, release.set).start()
+    assert executor.submit(_noop, 'admitted')
+    executor.shutdown()
+    assert executor.stats()['dropped'] == 0
+
+def test_stale_tasks_degrade_or_drop():
+    for fallback, expected in [(True, ['stale']), (False, [])]:
+        ran, fallbacks = [], []
+        executor = BoundedExecutor('test', workers=1, max_queue=5, max_age=0.02,
+                                   fallback=fallbacks.append if fallback else None)
+        release = _occupy(executor)
+        executor.submit(ran.append, 'stale')
+        time.sleep(0.05)
+        release.set()
+        executor.shutdown()
+        assert ran == [] and fallbacks == expected
+        assert executor.stats()['stale'] == 1
+
+def test_degrade_needs_a_fallback_and_shutdown_rejects():
+    with pytest.raises(ValueError):
+        BoundedExecutor('test', overflow=OVERFLOW_DEGRADE)
+    executor, _ = _executor()
+    executor.shutdown()
+    assert not executor.submit(_noop, 'late')